@@ -0,0 +1,246 @@
+"""
+Battery discharge model fitted from the voltages devices report.
+
+Samples come from logs/battery_charge-*.tsv (ISO time, tab, volts) and from
+the battery= / device= values in web server access logs. They are kept per
+device in append-only arrays and saved as one .npz. Charge cycles are found
+by the voltage jump of a recharge; every cycle that ran from full to dead is
+used to refit the voltage -> percent curve and the full-charge runtime, in
+place of the hand-fitted table in php/index.php's getBatteryLevel().
+
+    python battery_model.py logs/battery_charge-*.tsv --access-log /var/log/nginx/access.log
+
+writes battery_model.json, which dev_weather loads for the battery icon and
+the days-remaining estimate:
+
+    model = load_model("battery_model.json")
+    model.level(3.72), model.days_remaining(3.72)
+"""
+import argparse
+import glob
+import json
+import os
+import re
+from array import array
+from datetime import datetime
+
+import numpy as np
+
+# php/index.php's getBatteryLevel() table and estimateDaysRemaining() runtime,
+# used until logs with a complete discharge are available
+DEFAULT_CURVE = (
+    (4.20, 100.0), (4.10, 99.7), (4.00, 92.8), (3.95, 86.4), (3.90, 80.9),
+    (3.85, 74.9), (3.80, 70.5), (3.75, 65.6), (3.70, 58.4), (3.65, 51.5),
+    (3.60, 42.6), (3.55, 33.9), (3.50, 23.6), (3.45, 16.6), (3.40, 7.5),
+    (3.35, 4.8), (3.30, 3.6), (3.20, 1.6), (3.10, 0.9), (3.00, 0.4),
+    (2.90, 0.0),
+)
+DEFAULT_RUNTIME_HOURS = 904.8
+
+CHARGE_JUMP = 0.4   # volts between two samples that can only be a recharge
+FULL = 3.95         # a cycle has to start at least this high to count
+DEAD = 3.05         # ... and report at or below this before it goes quiet
+MAX_GAP = 6 * 3600  # seconds without reports after which the device was dead
+LOOKUP_STEP = 0.01  # volts per entry in BatteryModel's lookup table
+
+ACCESS_LOG_LINE = re.compile(r'\[([^\]]+)\] "GET [^"]*[?&]battery=([0-9.]+)[^"]*"')
+DEVICE_PARAM = re.compile(r"[?&]device=([^& \"]+)")
+
+
+class BatterySeries:
+    """Append-only (epoch seconds, volts) samples for one device"""
+
+    def __init__(self, times=(), volts=()):
+        self.times = array("d", times)
+        self.volts = array("f", volts)
+
+    def append(self, timestamp, voltage):
+        self.times.append(timestamp)
+        self.volts.append(voltage)
+
+    def __len__(self):
+        return len(self.times)
+
+    def arrays(self):
+        """Samples as NumPy arrays sorted by time, duplicates removed"""
+        times = np.frombuffer(self.times, dtype=np.float64)
+        volts = np.frombuffer(self.volts, dtype=np.float32).astype(np.float64)
+        times, first = np.unique(times, return_index=True)
+        return times, volts[first]
+
+
+class BatteryStore:
+    def __init__(self):
+        self.devices = {}
+
+    def series(self, device):
+        if device not in self.devices:
+            self.devices[device] = BatterySeries()
+        return self.devices[device]
+
+    def ingest_tsv(self, path, device="default"):
+        """Read a battery_charge-*.tsv log line by line"""
+        series = self.series(device)
+        with open(path) as log_file:
+            for line in log_file:
+                stamp, _, volts = line.strip().partition("\t")
+                if not volts:
+                    continue
+                series.append(datetime.strptime(stamp, "%Y-%m-%dT%H:%M:%S%z").timestamp(), float(volts))
+
+    def ingest_access_log(self, path):
+        """Read battery= (and device=) from the frame requests in a combined-format access log"""
+        with open(path, errors="replace") as log_file:
+            for line in log_file:
+                match = ACCESS_LOG_LINE.search(line)
+                if not match:
+                    continue
+                device = DEVICE_PARAM.search(line)
+                timestamp = datetime.strptime(match.group(1), "%d/%b/%Y:%H:%M:%S %z").timestamp()
+                self.series(device.group(1) if device else "default").append(timestamp, float(match.group(2)))
+
+    def save(self, path):
+        arrays = {}
+        for device, series in self.devices.items():
+            # Logs are re-read on every run, arrays() drops the repeated samples
+            times, volts = series.arrays()
+            arrays[f"{device}@times"] = times
+            arrays[f"{device}@volts"] = volts.astype(np.float32)
+        with open(path, "wb") as store_file:
+            np.savez_compressed(store_file, **arrays)
+
+    def load(self, path):
+        if not os.path.exists(path):
+            return
+        with np.load(path) as store:
+            for key in store.files:
+                device, kind = key.rsplit("@", 1)
+                if kind == "times":
+                    self.devices[device] = BatterySeries(store[key], store[f"{device}@volts"])
+
+
+def discharge_cycles(times, volts):
+    """(start, end) index pairs of every discharge, split at recharges
+
+    A discharge ends at its last report before the next recharge, or at the
+    first report at or below DEAD that is followed by a gap longer than
+    MAX_GAP (the device died; later reports come from boots on the charger).
+    A long gap at a healthy voltage is just missed reports.
+    """
+    charges = np.flatnonzero(np.diff(volts) >= CHARGE_JUMP) + 1
+    starts = np.concatenate(([0], charges))
+    stops = np.concatenate((charges, [len(volts)])) - 1
+    gap_after = np.flatnonzero((np.diff(times) > MAX_GAP) & (volts[:-1] <= DEAD))
+    cycles = []
+    for start, stop in zip(starts, stops):
+        inside = gap_after[(gap_after >= start) & (gap_after < stop)]
+        cycles.append((start, inside[0] if len(inside) else stop))
+    return cycles
+
+
+def complete_cycles(times, volts):
+    """Discharges that started full and ran until the device died"""
+    return [(start, end) for start, end in discharge_cycles(times, volts)
+            if volts[start] >= FULL and volts[end] <= DEAD and end > start]
+
+
+class BatteryModel:
+    """Voltage -> percent curve and full-charge runtime, answered from a lookup table"""
+
+    def __init__(self, curve=DEFAULT_CURVE, runtime_hours=DEFAULT_RUNTIME_HOURS, cycles=0):
+        points = sorted(curve)
+        self.curve = tuple((float(v), float(p)) for v, p in points)
+        self.runtime_hours = float(runtime_hours)
+        self.cycles = cycles
+        volts = np.array([v for v, _ in points])
+        percents = np.array([p for _, p in points])
+        self.min_volts = volts[0]
+        grid = np.arange(volts[0], volts[-1] + LOOKUP_STEP / 2, LOOKUP_STEP)
+        self.table = np.interp(grid, volts, percents).round(1).tolist()
+
+    def level(self, voltage):
+        """Remaining charge in percent"""
+        i = int(round((voltage - self.min_volts) / LOOKUP_STEP))
+        return self.table[min(max(i, 0), len(self.table) - 1)]
+
+    def days_remaining(self, voltage):
+        return self.level(voltage) / 100.0 * self.runtime_hours / 24.0
+
+    def to_json(self):
+        return {"curve": self.curve, "runtime_hours": self.runtime_hours, "cycles": self.cycles}
+
+
+def fit(series_list):
+    """BatteryModel refitted from every complete discharge, the default model if there are none
+
+    Each sample of a complete cycle is labelled with the share of the
+    cycle's runtime still ahead of it. The curve is the median label per
+    observed voltage, forced to be monotonic; the runtime is the median
+    cycle length.
+    """
+    volts_seen, remaining, runtimes = [], [], []
+    for series in series_list:
+        times, volts = series.arrays()
+        for start, end in complete_cycles(times, volts):
+            runtime = times[end] - times[start]
+            volts_seen.append(volts[start:end + 1])
+            remaining.append(100.0 * (times[end] - times[start:end + 1]) / runtime)
+            runtimes.append(runtime / 3600)
+    if not runtimes:
+        return BatteryModel()
+
+    volts_seen = np.round(np.concatenate(volts_seen), 2)
+    remaining = np.concatenate(remaining)
+    order = np.argsort(volts_seen, kind="stable")
+    volts_seen, remaining = volts_seen[order], remaining[order]
+    knots, first = np.unique(volts_seen, return_index=True)
+    medians = np.array([np.median(group) for group in np.split(remaining, first[1:])])
+    # Higher voltage never means less charge left
+    medians = np.maximum.accumulate(medians)
+    curve = list(zip(knots.tolist(), medians.round(1).tolist()))
+    # Pin the ends so the lookup covers the whole range
+    if knots[0] > DEFAULT_CURVE[-1][0]:
+        curve.insert(0, (DEFAULT_CURVE[-1][0], 0.0))
+    if knots[-1] < DEFAULT_CURVE[0][0]:
+        curve.append((DEFAULT_CURVE[0][0], 100.0))
+    return BatteryModel(curve, float(np.median(runtimes)), len(runtimes))
+
+
+def load_model(path):
+    """Model saved by this script, the default model if there is none"""
+    if not os.path.exists(path):
+        return BatteryModel()
+    with open(path) as model_file:
+        data = json.load(model_file)
+    return BatteryModel(data["curve"], data["runtime_hours"], data.get("cycles", 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit the battery discharge model from device logs")
+    parser.add_argument("logs", nargs="*", help="battery_charge-*.tsv files (default: logs/)")
+    parser.add_argument("--access-log", action="append", default=[], help="web server access log with frame requests")
+    parser.add_argument("--device", default="default", help="device the .tsv logs belong to")
+    parser.add_argument("--store", default="battery_store.npz", help="sample store, extended on every run")
+    parser.add_argument("--model", default="battery_model.json")
+    args = parser.parse_args()
+
+    store = BatteryStore()
+    store.load(args.store)
+    for path in args.logs or sorted(glob.glob("logs/battery_charge-*.tsv")):
+        store.ingest_tsv(path, args.device)
+    for path in args.access_log:
+        store.ingest_access_log(path)
+    store.save(args.store)
+
+    model = fit(store.devices.values())
+    with open(args.model, "w") as model_file:
+        json.dump(model.to_json(), model_file, indent=2)
+
+    print(f"{sum(len(s) for s in store.devices.values())} samples from {len(store.devices)} devices")
+    print(f"{model.cycles} complete discharges, runtime {model.runtime_hours:.1f}h")
+    for volts, percent in reversed(model.curve):
+        print(f"  {volts:.2f}V  {percent:5.1f}%")
+
+
+if __name__ == "__main__":
+    main()
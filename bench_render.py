@@ -0,0 +1,232 @@
+"""
+Micro-benchmarks for the render pipeline, offline against fixtures/forecasts.
+
+Every fixture is rendered for each orientation and a spread of battery
+voltages, and once per met.no symbol code (substituted into the first
+timeseries entry) so every icon is exercised. Each stage is timed on its
+own:
+
+    json_decode   json.loads of the raw locationforecast payload
+    model_parse   forecast_model.ForecastModel, the columnar parse (cached per version)
+    summarize     dev_weather.summarize_forecast (current values, min/max, histogram)
+    layout        dev_weather.pillow_create_weather_display (layout and drawing)
+    quantize      frame_codec.quantize
+    encode_bmp    frame_codec.encode_bmp_2bpp
+    encode_rle    frame_codec.encode_rle
+
+A second pass runs each stage once under tracemalloc for its peak and
+total allocation. Results are written as JSON and compared with the
+baseline (fixtures/bench_baseline.json unless --baseline says otherwise):
+the run fails (exit 1) when a stage's fastest pass is slower than the baseline
+by more than --tolerance, or when there is no baseline. Timings only
+compare on the same machine; --save-baseline records a new one there.
+
+    python bench_render.py                                  # compare with fixtures/bench_baseline.json
+    python bench_render.py --save-baseline fixtures/bench_baseline.json
+    python bench_render.py --baseline mine.json --tolerance 0.5 --output bench.json
+    python bench_render.py --no-baseline                    # just measure
+"""
+import argparse
+import contextlib
+import copy
+import glob
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import PIL
+
+import dev_weather
+import forecast_model
+import frame_codec
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_DIR = os.path.join(HERE, "fixtures", "forecasts")
+BASELINE_PATH = os.path.join(HERE, "fixtures", "bench_baseline.json")
+
+ORIENTATIONS = ("landscape_left", "landscape_right", "portrait_up", "portrait_down", "portrait_left")
+BATTERY_VOLTAGES = (4.15, 3.85, 3.55, 3.35, 3.1)
+TIMEZONE_OFFSET = 1
+STAGES = ("json_decode", "model_parse", "summarize", "layout", "quantize", "encode_bmp", "encode_rle")
+
+
+def load_fixtures(pattern=None):
+    """{name: raw payload bytes} for the recorded forecasts"""
+    paths = sorted(glob.glob(os.path.join(FIXTURE_DIR, pattern or "*.json")))
+    fixtures = {}
+    for path in paths:
+        with open(path, "rb") as fixture_file:
+            fixtures[os.path.splitext(os.path.basename(path))[0]] = fixture_file.read()
+    return fixtures
+
+
+def with_symbol(weather_data, symbol_code):
+    """Copy of a payload showing another symbol code"""
+    data = copy.deepcopy(weather_data)
+    data["properties"]["timeseries"][0]["data"]["next_12_hours"]["summary"]["symbol_code"] = symbol_code
+    return data
+
+
+def scenarios(fixtures):
+    """(raw payload, decoded payload, orientation, battery) for the whole matrix"""
+    decoded = {name: json.loads(raw) for name, raw in fixtures.items()}
+    for name, raw in fixtures.items():
+        for orientation in ORIENTATIONS:
+            for battery in BATTERY_VOLTAGES:
+                yield raw, decoded[name], orientation, battery
+    first = next(iter(fixtures))
+    for symbol_code in sorted(dev_weather.WEATHER_ICON_NAMES):
+        yield fixtures[first], with_symbol(decoded[first], symbol_code), "landscape_left", 3.85
+
+
+def run_stages(raw, weather_data, orientation, battery, timer):
+    """Run the pipeline once, timing each stage with timer(stage, function, *args)"""
+    timer("json_decode", json.loads, raw)
+    timer("model_parse", forecast_model.ForecastModel, weather_data)
+    timer("summarize", dev_weather.summarize_forecast, weather_data)
+    magtag_instance = dev_weather.MockMagTag(battery=battery)
+    timer("layout", dev_weather.pillow_create_weather_display, weather_data, magtag_instance,
+          TIMEZONE_OFFSET, orientation)
+    indices = timer("quantize", frame_codec.quantize, magtag_instance.image)
+    timer("encode_bmp", frame_codec.encode_bmp_2bpp, indices)
+    timer("encode_rle", frame_codec.encode_rle, indices)
+
+
+def measure_time(matrix, repeat):
+    samples = {stage: [] for stage in STAGES}
+
+    def timer(stage, function, *args):
+        started = time.perf_counter_ns()
+        result = function(*args)
+        samples[stage].append(time.perf_counter_ns() - started)
+        return result
+
+    for _ in range(repeat):
+        for scenario in matrix:
+            run_stages(*scenario, timer)
+    return samples
+
+
+def measure_allocations(matrix):
+    peaks = {stage: [] for stage in STAGES}
+    totals = {stage: [] for stage in STAGES}
+
+    def timer(stage, function, *args):
+        tracemalloc.start()
+        result = function(*args)
+        snapshot = tracemalloc.take_snapshot()
+        peaks[stage].append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        totals[stage].append(sum(stat.size for stat in snapshot.statistics("filename")))
+        return result
+
+    for scenario in matrix:
+        run_stages(*scenario, timer)
+    return peaks, totals
+
+
+def summarize(samples, peaks, totals):
+    stages = {}
+    for stage in STAGES:
+        times = np.array(samples[stage]) / 1000
+        # One allocation sample per scenario, so that is the length of a pass
+        passes = times.reshape(-1, len(peaks[stage]))
+        stages[stage] = {
+            "runs": len(times),
+            "median_us": round(float(np.median(times)), 1),
+            "best_pass_median_us": round(float(np.median(passes, axis=1).min()), 1),
+            "p90_us": round(float(np.percentile(times, 90)), 1),
+            "mean_us": round(float(times.mean()), 1),
+            "peak_alloc_kb": round(max(peaks[stage]) / 1024, 1),
+            "retained_kb": round(float(np.median(totals[stage])) / 1024, 1),
+        }
+    return stages
+
+
+def compare(stages, baseline, tolerance):
+    """Stages slower than the baseline by more than tolerance
+
+    Compares the median of the fastest pass, which a busy or throttled
+    machine disturbs far less than the median over all passes.
+    """
+    regressions = []
+    for stage, result in stages.items():
+        reference = baseline.get("stages", {}).get(stage)
+        if reference is None:
+            continue
+        metric = "best_pass_median_us" if "best_pass_median_us" in reference else "median_us"
+        if result[metric] > reference[metric] * (1 + tolerance):
+            regressions.append((stage, reference[metric], result[metric]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the render pipeline stage by stage")
+    parser.add_argument("--fixtures", help="glob within fixtures/forecasts, default all")
+    parser.add_argument("--repeat", type=int, default=3, help="passes over the scenario matrix")
+    parser.add_argument("--output", help="write results as JSON here")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="results JSON to compare against")
+    parser.add_argument("--no-baseline", action="store_true", help="measure without comparing")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown, 0.25 = 25%%")
+    parser.add_argument("--save-baseline", help="write results as a new baseline")
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixtures)
+    if not fixtures:
+        parser.error(f"no fixtures in {FIXTURE_DIR}")
+    matrix = list(scenarios(fixtures))
+    dev_weather.ICONS.warm()
+
+    # The renderer prints progress for every frame
+    with contextlib.redirect_stdout(io.StringIO()):
+        for scenario in matrix:  # warm the icon and text caches
+            run_stages(*scenario, lambda stage, function, *a: function(*a))
+        samples = measure_time(matrix, args.repeat)
+        peaks, totals = measure_allocations(matrix)
+
+    results = {
+        "scenarios": len(matrix),
+        "fixtures": sorted(fixtures),
+        "repeat": args.repeat,
+        "python": platform.python_version(),
+        "pillow": PIL.__version__,
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "stages": summarize(samples, peaks, totals),
+    }
+
+    print(f"{len(matrix)} scenarios x {args.repeat}")
+    print(f"{'stage':<12} {'median us':>10} {'p90 us':>10} {'peak KB':>9} {'retained KB':>12}")
+    for stage, result in results["stages"].items():
+        print(f"{stage:<12} {result['median_us']:>10} {result['p90_us']:>10} "
+              f"{result['peak_alloc_kb']:>9} {result['retained_kb']:>12}")
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as results_file:
+                json.dump(results, results_file, indent=2)
+
+    if args.no_baseline or args.save_baseline:
+        return
+    if not os.path.exists(args.baseline):
+        sys.exit(f"No baseline at {args.baseline}, record one with --save-baseline {args.baseline}")
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    if (baseline.get("machine"), baseline.get("python")) != (results["machine"], results["python"]):
+        print(f"Baseline is from {baseline.get('machine')} / Python {baseline.get('python')}, "
+              f"timings may not compare")
+    regressions = compare(results["stages"], baseline, args.tolerance)
+    for stage, before, after in regressions:
+        print(f"REGRESSION {stage}: {before}us -> {after}us (+{after / before - 1:.0%})")
+    if regressions:
+        sys.exit(1)
+    print(f"No stage slower than the baseline by more than {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""
+Build the CIRCUITPY image for the MagTag: only what code.py needs, precompiled.
+
+On every wake CircuitPython compiles code.py and each .py it imports from
+source, which takes time and heap before the first packet goes out. The
+image built here has:
+
+    code.py          a stub importing weather_main.mpy, code.py compiled with
+                     mpy-cross (code.py itself has to stay source)
+    *.mpy            the modules from magtag/ that code.py imports, compiled
+    lib/             only the library modules code.py (and what they import)
+                     uses, down to the submodule, from an unpacked Adafruit
+                     bundle (adafruit-circuitpython-bundle-9.x-mpy-*/lib)
+    icons/, *.bdf    only with frame_format "summary", and only the icons the
+                     render server can name
+    secrets.py       from --secrets, which also decides the frame format
+
+Files already on the target with the same contents are not rewritten, and
+--prune removes what the image no longer needs from icons/, lib/ and the
+top level, so the image can be written straight to a mounted CIRCUITPY.
+--profile adds magtag/import_profile.py, which reports import time and
+heap per module on the board.
+
+    python deploy.py --secrets secrets.py --lib-dir ~/bundle/lib --output /media/$USER/CIRCUITPY --prune
+    python deploy.py --secrets secrets.py --output build --profile
+
+mpy-cross must match the board's CircuitPython major version (9.x here). Without
+it the modules are copied as source, which works but saves nothing.
+"""
+import argparse
+import ast
+import os
+import runpy
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import dev_weather
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MAGTAG_DIR = os.path.join(HERE, "magtag")
+MAIN_MODULE = "weather_main"
+CODE_STUB = f"""# Written by deploy.py: the program is code.py, precompiled as {MAIN_MODULE}.mpy
+import {MAIN_MODULE}
+{MAIN_MODULE}.main()
+"""
+
+# Modules in the CircuitPython 9 firmware of the MagTag, nothing to copy
+BUILTIN_MODULES = {
+    "alarm", "analogio", "binascii", "bitmaptools", "board", "busio", "displayio", "gc",
+    "hashlib", "ipaddress", "socketpool", "ssl", "struct", "terminalio", "time", "wifi",
+    "micropython", "os", "sys", "digitalio", "neopixel_write", "math", "secrets",
+}
+# What library modules import in turn; .mpy files can't be scanned for it
+LIBRARY_DEPENDENCIES = {
+    "adafruit_requests": ("adafruit_connection_manager",),
+    "adafruit_bitmap_font.bitmap_font": ("adafruit_bitmap_font.bdf", "adafruit_bitmap_font.glyph_cache"),
+    "adafruit_lis3dh": ("adafruit_bus_device.i2c_device", "adafruit_bus_device.spi_device"),
+    "adafruit_hashlib": ("adafruit_hashlib._sha256",),
+}
+# Fallbacks that are only imported if the firmware lacks something, copied when the bundle has them
+OPTIONAL_LIBRARIES = {"adafruit_hashlib"}
+# Only imported when the device composes frames itself (frame_format "summary")
+SUMMARY_ONLY = {"weather_summary", "adafruit_bitmap_font", "adafruit_bitmap_font.bitmap_font"}
+SUMMARY_FONTS = ("Roboto-Regular-25.bdf", "Roboto-Regular-50.bdf")
+# Files on CIRCUITPY that --prune never touches
+KEEP = {"boot_out.txt", "settings.toml", "boot.py", "secrets.py"}
+
+
+def imported_modules(path):
+    """Dotted names of the modules a source file imports, anywhere in it"""
+    with open(path) as source_file:
+        tree = ast.parse(source_file.read(), path)
+    modules = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            modules.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            # from package import submodule: the submodule may be a file of its own
+            modules.add(node.module)
+            modules.update(f"{node.module}.{alias.name}" for alias in node.names)
+    return modules
+
+
+def resolve(frame_format):
+    """(local modules, library modules) code.py needs for a frame format"""
+    local, libraries = [], set()
+    pending = ["code"]
+    while pending:
+        name = pending.pop()
+        for module in imported_modules(os.path.join(MAGTAG_DIR, name + ".py")):
+            top = module.split(".")[0]
+            if frame_format != "summary" and module in SUMMARY_ONLY:
+                continue
+            if os.path.exists(os.path.join(MAGTAG_DIR, module + ".py")):
+                if module not in local and module != "import_profile":
+                    local.append(module)
+                    pending.append(module)
+            elif top not in BUILTIN_MODULES:
+                libraries.add(module)
+    for module in list(libraries):
+        libraries.update(LIBRARY_DEPENDENCIES.get(module, ()))
+    return local, libraries
+
+
+def library_files(lib_dir, modules):
+    """Paths within lib_dir for library modules; raises FileNotFoundError naming the missing ones"""
+    files, missing = set(), []
+    for module in modules:
+        parts = module.split(".")
+        # Each package on the way down needs its __init__
+        for depth in range(1, len(parts)):
+            init = os.path.join(*parts[:depth], "__init__.mpy")
+            if os.path.exists(os.path.join(lib_dir, init)):
+                files.add(init)
+        candidates = (os.path.join(*parts) + ".mpy", os.path.join(*parts, "__init__.mpy"))
+        found = [path for path in candidates if os.path.exists(os.path.join(lib_dir, path))]
+        if found:
+            files.add(found[0])
+        elif parts[0] in OPTIONAL_LIBRARIES:
+            continue
+        elif len(parts) == 1 or not os.path.isdir(os.path.join(lib_dir, *parts[:-1])):
+            missing.append(module)
+        # else: "from package import name" named something inside the package, not a file
+    if missing:
+        raise FileNotFoundError(f"not in {lib_dir}: {', '.join(sorted(missing))}")
+    return sorted(files)
+
+
+def summary_icons():
+    """Icons magtag/code.py can be asked to show, the rest of magtag/icons is never opened"""
+    names = set(dev_weather.WEATHER_ICON_NAMES.values()) | {"unknown"}
+    names.update(f"battery_{bars}_bar_90deg" for bars in range(7))
+    names.update(("battery_alert_90deg", "battery_full_90deg"))
+    return sorted(f"{name}.bmp" for name in names)
+
+
+def compile_module(mpy_cross, source, target, name):
+    subprocess.run([mpy_cross, "-s", name + ".py", "-o", target, source], check=True)
+
+
+def build(args, staging):
+    """{path on CIRCUITPY: path of the file to put there}, written into staging where generated"""
+    secrets = runpy.run_path(args.secrets)["secrets"] if args.secrets else {}
+    frame_format = secrets.get("frame_format", "rle")
+    local, libraries = resolve(frame_format)
+    mpy_cross = shutil.which(args.mpy_cross) if args.mpy_cross else None
+    if not mpy_cross:
+        print(f"mpy-cross not found ({args.mpy_cross}), copying modules as source")
+
+    files = {}
+    if mpy_cross:
+        target = os.path.join(staging, MAIN_MODULE + ".mpy")
+        compile_module(mpy_cross, os.path.join(MAGTAG_DIR, "code.py"), target, MAIN_MODULE)
+        files[MAIN_MODULE + ".mpy"] = target
+        with open(os.path.join(staging, "code.py"), "w") as stub_file:
+            stub_file.write(CODE_STUB)
+        files["code.py"] = os.path.join(staging, "code.py")
+    else:
+        files["code.py"] = os.path.join(MAGTAG_DIR, "code.py")
+    for module in local + (["import_profile"] if args.profile else []):
+        source = os.path.join(MAGTAG_DIR, module + ".py")
+        if mpy_cross and module != "import_profile":  # import_profile runs once, from the REPL
+            compile_module(mpy_cross, source, os.path.join(staging, module + ".mpy"), module)
+            files[module + ".mpy"] = os.path.join(staging, module + ".mpy")
+        else:
+            files[module + ".py"] = source
+    if args.secrets:
+        files["secrets.py"] = args.secrets
+
+    if args.lib_dir:
+        for path in library_files(args.lib_dir, libraries):
+            files[os.path.join("lib", path)] = os.path.join(args.lib_dir, path)
+    else:
+        print(f"No --lib-dir, expecting these on the board already: {', '.join(sorted(libraries))}")
+
+    if frame_format == "summary":
+        for font in SUMMARY_FONTS:
+            files[font] = os.path.join(MAGTAG_DIR, font)
+        for icon in summary_icons():
+            files[os.path.join("icons", icon)] = os.path.join(MAGTAG_DIR, "icons", icon)
+    return frame_format, files
+
+
+def same_contents(path, other):
+    if not os.path.exists(other) or os.path.getsize(path) != os.path.getsize(other):
+        return False
+    with open(path, "rb") as a, open(other, "rb") as b:
+        return a.read() == b.read()
+
+
+def write(files, output):
+    """Copy files into output, skipping unchanged ones; returns the number written"""
+    written = 0
+    for target, source in sorted(files.items()):
+        destination = os.path.join(output, target)
+        if same_contents(source, destination):
+            continue
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        shutil.copyfile(source, destination)
+        written += 1
+    return written
+
+
+def prune(files, output):
+    """Remove files in output's icons/, lib/ and top level that the image doesn't have"""
+    removed = []
+    for directory, _, names in os.walk(output):
+        relative = os.path.relpath(directory, output)
+        top = relative.split(os.sep)[0]
+        if relative != "." and top not in ("icons", "lib"):
+            continue
+        for name in names:
+            path = os.path.normpath(os.path.join(relative, name))
+            managed = top in ("icons", "lib") or name.endswith((".py", ".mpy", ".bdf"))
+            if managed and path not in files and name not in KEEP:
+                os.remove(os.path.join(output, path))
+                removed.append(path)
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a minimal, precompiled CIRCUITPY image")
+    parser.add_argument("--output", required=True, help="directory or mounted CIRCUITPY drive")
+    parser.add_argument("--secrets", help="secrets.py for the board")
+    parser.add_argument("--lib-dir", help="lib/ of an unpacked adafruit-circuitpython-bundle-9.x-mpy")
+    parser.add_argument("--mpy-cross", default="mpy-cross", help="CircuitPython 9 mpy-cross binary")
+    parser.add_argument("--prune", action="store_true", help="remove files the image doesn't need")
+    parser.add_argument("--profile", action="store_true", help="add import_profile.py")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as staging:
+        try:
+            frame_format, files = build(args, staging)
+        except (FileNotFoundError, subprocess.CalledProcessError) as e:
+            sys.exit(f"Cannot build the image: {e}")
+        os.makedirs(args.output, exist_ok=True)
+        written = write(files, args.output)
+        removed = prune(files, args.output) if args.prune else []
+
+    sizes = {target: os.path.getsize(os.path.join(args.output, target)) for target in files}
+    groups = {}
+    for target, size in sizes.items():
+        group = target.split(os.sep)[0] if os.sep in target else "top level"
+        count, total = groups.get(group, (0, 0))
+        groups[group] = (count + 1, total + size)
+    print(f"Image for frame_format {frame_format!r} in {args.output}:")
+    for group, (count, total) in sorted(groups.items()):
+        print(f"  {group:<10} {count:4} files {total / 1024:8.1f} KB")
+    print(f"  {'total':<10} {len(sizes):4} files {sum(sizes.values()) / 1024:8.1f} KB")
+    print(f"{written} written, {len(files) - written} unchanged, {len(removed)} removed")
+    for path in removed:
+        print(f"  removed {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,18 @@
-import sys
 import os
+import email.utils
 from PIL import Image, ImageDraw, ImageFont
-from datetime import datetime
+from datetime import datetime, timedelta
 import requests
 
-# Mock secrets for development - must be done before any imports
+import battery_model
+import forecast_model
+import frame_codec
+import icon_store
+import text_cache
+from forecast_cache import MET_NO_URL, USER_AGENT
+from magtag import weather_summary
+
+# Location used by main()
 class MockSecrets:
     secrets = {
         "ssid": "dev_wifi",
@@ -14,201 +22,52 @@ class MockSecrets:
         "timezone_offset": 1,
     }
 
-sys.modules['secrets'] = MockSecrets()
-
 # Display constants
 DISPLAY_WIDTH = 296
 DISPLAY_HEIGHT = 128
 
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Decoded and quantized once, see icon_store.IconStore.warm()
+ICONS = icon_store.IconStore(icon_store.MAGTAG_ICON_DIR)
+# Rasterized single-line labels, see text_cache.TextCache
+TEXT = text_cache.TextCache()
+# Fitted by battery_model.py from the discharge logs, php/index.php's curve if missing
+BATTERY = battery_model.load_model(os.path.join(HERE, "battery_model.json"))
+
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
 GREY = (128, 128, 128)  # 50% gray to match physical display
 
-# Mock CircuitPython/Adafruit modules
-class MockModule:
-    def __getattr__(self, name):
-        return MockModule()
-    
-    def __call__(self, *args, **kwargs):
-        return MockModule()
-
-# Mock all the CircuitPython imports
-sys.modules['board'] = MockModule()
-sys.modules['alarm'] = MockModule()
-sys.modules['alarm.time'] = MockModule()
-sys.modules['wifi'] = MockModule()
-sys.modules['socketpool'] = MockModule()
-sys.modules['displayio'] = MockModule()
-sys.modules['terminalio'] = MockModule()
-sys.modules['analogio'] = MockModule()
-sys.modules['digitalio'] = MockModule()
-sys.modules['ssl'] = MockModule()
-sys.modules['adafruit_datetime'] = MockModule()
-sys.modules['adafruit_requests'] = MockModule()
-sys.modules['adafruit_display_text'] = MockModule()
-sys.modules['adafruit_display_text.label'] = MockModule()
-sys.modules['adafruit_magtag'] = MockModule()
-sys.modules['adafruit_magtag.magtag'] = MockModule()
-sys.modules['adafruit_bitmap_font'] = MockModule()
-
-# Mock classes to replace CircuitPython/Adafruit libraries
+# Stands in for the MagTag object: the peripherals the layout reads and the
+# Pillow image it draws on. magtag/code.py itself runs under displayio_emulator.py.
 class MockMagTag:
-    def __init__(self):
-        self.splash = MockGroup()
-        self.peripherals = MockPeripherals()
+    def __init__(self, battery=3.9):
+        self.peripherals = MockPeripherals(battery)
         self.image = Image.new('RGB', (DISPLAY_WIDTH, DISPLAY_HEIGHT), WHITE)
         self.draw = ImageDraw.Draw(self.image)
         
     def refresh(self):
-        # Save the image for viewing
+        # Save the image for viewing, plus the 2bpp frame the device would load
         self.image.save('weather_display.png')
-        print("Display refreshed - saved to weather_display.png")
+        with open('weather_display.bmp', 'wb') as bmp_file:
+            bmp_file.write(frame_codec.frame_to_bmp(self.image))
+        print("Display refreshed - saved to weather_display.png and weather_display.bmp")
 
 class MockPeripherals:
-    @property
-    def battery(self):
+    def __init__(self, battery=3.9):
         # Mock battery voltage - you can change this for testing
-        return 3.9
+        self._battery = battery
 
-class MockGroup:
-    def __init__(self):
-        self.items = []
-    
-    def append(self, item):
-        self.items.append(item)
-    
-    def insert(self, index, item):
-        self.items.insert(index, item)
-    
-    def pop(self):
-        if self.items:
-            return self.items.pop()
-    
-    def __len__(self):
-        return len(self.items)
-
-class MockLabel:
-    def __init__(self, font, text, color, x, y):
-        self.font = font
-        self.text = text
-        self.color = color
-        self.x = x
-        self.y = y
-
-class MockBitmap:
-    def __init__(self, width, height, colors):
-        pass
-
-class MockPalette:
-    def __init__(self, colors):
-        pass
-    
-    def __setitem__(self, key, value):
-        pass
-
-class MockTileGrid:
-    def __init__(self, bitmap, pixel_shader=None, x=0, y=0):
-        pass
-
-class MockOnDiskBitmap:
-    def __init__(self, filename):
-        self.pixel_shader = None
-
-# Mock the specific modules and classes
-sys.modules['displayio'].Bitmap = MockBitmap
-sys.modules['displayio'].Palette = MockPalette
-sys.modules['displayio'].TileGrid = MockTileGrid
-sys.modules['displayio'].OnDiskBitmap = MockOnDiskBitmap
-sys.modules['displayio'].Group = MockGroup
-sys.modules['adafruit_display_text.label'].Label = MockLabel
-sys.modules['adafruit_magtag.magtag'].MagTag = MockMagTag
-
-# Mock terminalio.FONT
-class MockFont:
-    pass
-
-sys.modules['terminalio'].FONT = MockFont()
-
-# Mock bitmap_font
-class MockBitmapFont:
-    @staticmethod
-    def load_font(filename):
-        return MockFont()
-
-sys.modules['adafruit_bitmap_font'].bitmap_font = MockBitmapFont()
-
-# Mock wifi
-class MockRadio:
-    def __init__(self):
-        self.ipv4_address = "192.168.1.100"
-        self.enabled = True
-    
-    def connect(self, ssid, password):
-        print(f"Mock: Connected to {ssid}")
-
-sys.modules['wifi'].radio = MockRadio()
-
-# Mock time
-import time as real_time
-sys.modules['time'] = real_time
-
-# Mock datetime
-from datetime import datetime as real_datetime
-sys.modules['adafruit_datetime'].datetime = real_datetime
-
-# Mock requests
-class MockSession:
-    def __init__(self, pool, context):
-        pass
-    
-    def get(self, url, headers=None):
-        response = requests.get(url, headers=headers)
-        mock_response = MockResponse(response)
-        return mock_response
-
-class MockResponse:
-    def __init__(self, real_response):
-        self._real_response = real_response
-        self.headers = real_response.headers
-    
-    def json(self):
-        return self._real_response.json()
-    
-    def close(self):
-        pass
-
-sys.modules['adafruit_requests'].Session = MockSession
-
-# Mock socketpool
-class MockSocketPool:
-    def __init__(self, radio):
-        pass
-
-sys.modules['socketpool'].SocketPool = MockSocketPool
-
-# Mock ssl
-import ssl as real_ssl
-sys.modules['ssl'].create_default_context = real_ssl.create_default_context
-
-# Mock alarm
-class MockTimeAlarm:
-    def __init__(self, monotonic_time):
-        pass
-
-class MockAlarm:
-    time = type('time', (), {'TimeAlarm': MockTimeAlarm})()
-    
-    @staticmethod
-    def exit_and_deep_sleep_until_alarms(alarm):
-        print("Mock: Would enter deep sleep here")
-
-sys.modules['alarm'] = MockAlarm()
+    @property
+    def battery(self):
+        return self._battery
 
 # Font loading - use the same Roboto fonts as the MagTag
 try:
     # Load the Roboto fonts from the magtag folder
-    FONT = ImageFont.truetype("magtag/Roboto-Regular-25.bdf", 25)
-    BIG_FONT = ImageFont.truetype("magtag/Roboto-Regular-50.bdf", 50)
+    FONT = ImageFont.truetype(os.path.join(HERE, "magtag", "Roboto-Regular-25.bdf"), 25)
+    BIG_FONT = ImageFont.truetype(os.path.join(HERE, "magtag", "Roboto-Regular-50.bdf"), 50)
     print("Roboto fonts loaded successfully")
 except Exception as e:
     print(f"Could not load Roboto fonts: {e}")
@@ -236,173 +95,350 @@ except:
         except:
             SMALL_FONT = ImageFont.load_default()
 
-# Create a custom create_weather_display that uses Pillow
-def pillow_create_weather_display(weather_data, magtag_instance):
-    """Create the weather display layout using Pillow"""
-    # Clear the image
-    magtag_instance.image = Image.new('RGB', (DISPLAY_WIDTH, DISPLAY_HEIGHT), WHITE)
-    magtag_instance.draw = ImageDraw.Draw(magtag_instance.image)
+PORTRAIT_ORIENTATIONS = ("portrait_up", "portrait_down", "portrait_left")
+
+# met.no symbol codes (without _day/_night/_polartwilight) to magtag/icons names
+WEATHER_ICON_BASE_NAMES = {
+    "clearsky": "clear",
+    "fair": "mostlysunny",
+    "partlycloudy": "partlycloudy",
+    "cloudy": "cloudy",
+    "fog": "fog",
+    "lightrainshowers": "chancerain",
+    "rainshowers": "chancerain",
+    "heavyrainshowers": "rain",
+    "lightrainshowersandthunder": "chancetstorms",
+    "rainshowersandthunder": "chancetstorms",
+    "heavyrainshowersandthunder": "tstorms",
+    "lightsleetshowers": "chancesleet",
+    "sleetshowers": "chancesleet",
+    "heavysleetshowers": "sleet",
+    "lightssleetshowersandthunder": "chancetstorms",
+    "sleetshowersandthunder": "chancetstorms",
+    "heavysleetshowersandthunder": "tstorms",
+    "lightsnowshowers": "chanceflurries",
+    "snowshowers": "chancesnow",
+    "heavysnowshowers": "snow",
+    "lightssnowshowersandthunder": "chancetstorms",
+    "snowshowersandthunder": "chancetstorms",
+    "heavysnowshowersandthunder": "tstorms",
+    "lightrain": "rain",
+    "rain": "rain",
+    "heavyrain": "rain",
+    "lightrainandthunder": "tstorms",
+    "rainandthunder": "tstorms",
+    "heavyrainandthunder": "tstorms",
+    "lightsleet": "sleet",
+    "sleet": "sleet",
+    "heavysleet": "sleet",
+    "lightsleetandthunder": "tstorms",
+    "sleetandthunder": "tstorms",
+    "heavysleetandthunder": "tstorms",
+    "lightsnow": "flurries",
+    "snow": "snow",
+    "heavysnow": "snow",
+    "lightsnowandthunder": "tstorms",
+    "snowandthunder": "tstorms",
+    "heavysnowandthunder": "tstorms",
+}
+
+WEATHER_ICON_NAMES = {}
+for _base, _name in WEATHER_ICON_BASE_NAMES.items():
+    WEATHER_ICON_NAMES[_base] = _name
+    WEATHER_ICON_NAMES[f"{_base}_day"] = _name
+    WEATHER_ICON_NAMES[f"{_base}_polartwilight"] = _name
+    WEATHER_ICON_NAMES[f"{_base}_night"] = f"nt_{_name}"
+
+def rfc2822_to_iso(value):
+    """Convert an HTTP date header to ISO 8601, None if missing or invalid"""
+    if not value:
+        return None
+    try:
+        return email.utils.parsedate_to_datetime(value).isoformat()
+    except (TypeError, ValueError):
+        return None
+
+def _local_time(iso_time, timezone_offset=0):
+    """Parse a met.no ISO timestamp and shift it by the timezone offset in hours"""
+    return datetime.fromisoformat(iso_time.replace("Z", "+00:00")) + timedelta(hours=timezone_offset)
+
+def get_current_date(iso_time, timezone_offset=0):
+    """Three-line date for the left column, e.g. 'Mon\\n13\\nApr'"""
+    local = _local_time(iso_time, timezone_offset)
+    return f"{local:%a}\n{local.day}\n{local:%b}"
+
+def format_updated_time(iso_time, timezone_offset=0):
+    """Local HH:MM for the 'updated:' label"""
+    if not iso_time:
+        return "??:??"
+    return f"{_local_time(iso_time, timezone_offset):%H:%M}"
+
+def get_battery_bars(voltage):
+    """0-6 bars for the remaining charge, like getBatteryIconName() in php/index.php"""
+    return max(0, min(6, round(BATTERY.level(voltage) / 100 * 6)))
+
+def get_battery_icon_name(voltage):
+    """Battery icon in magtag/icons for a voltage"""
+    if voltage < 3.3:
+        return "battery_alert_90deg"
+    if voltage >= 4.1:
+        return "battery_full_90deg"
+    return f"battery_{get_battery_bars(voltage)}_bar_90deg"
+
+def battery_hours_remaining(voltage):
+    """Estimated runtime left in hours, rounded to whole days once it is more than one"""
+    days = BATTERY.days_remaining(voltage)
+    return round(days) * 24 if days >= 1 else round(days * 24)
+
+def format_battery_text(voltage):
+    """Voltage and estimated runtime left, e.g. '3.8V ~26d'"""
+    days = BATTERY.days_remaining(voltage)
+    remaining = f"~{round(days)}d" if days >= 1 else f"~{round(days * 24)}h"
+    return f"{voltage:.1f}V {remaining}"
+
+def battery_bucket(voltage, warning_threshold=3.4):
+    """Everything about the battery that shows up in a frame"""
+    return (get_battery_icon_name(voltage), format_battery_text(voltage), voltage <= warning_threshold)
+
+def _paste_icon(image, name, position):
+    """Paste an icon from magtag/icons, return False if it could not be loaded"""
+    try:
+        icon = ICONS.get(name)
+        if icon is None:
+            return False
+        image.paste(icon.image, position, icon.mask)
+        return True
+    except Exception as icon_error:
+        print(f"Could not load icon {name}: {icon_error}")
+        return False
 
-    if not weather_data:
-        # Error display
-        magtag_instance.draw.text((DISPLAY_WIDTH // 2 - 60, DISPLAY_HEIGHT // 2), 
-                        "Weather data\nunavailable", fill=BLACK, font=FONT)
-        return
+def _draw_histogram(draw, hourly_data, histogram_x, histogram_y):
+    """Draw the 16-hour temperature (grey) and precipitation (black) histogram"""
+    histogram_height = 12
+    column_width = 8  # 128 / 16 = 8 pixels per hour
 
-    # Import the actual functions from the magtag code
-    import magtag.code as magtag_code
+    if not hourly_data:
+        return
 
+    # Calculate temperature range for scaling
+    temps = [h["temp"] for h in hourly_data]
+    temp_min, temp_max = min(temps), max(temps)
+    temp_range = temp_max - temp_min if temp_max != temp_min else 1
+    temp_mid = (temp_min + temp_max) / 2
+
+    # Calculate precipitation range for scaling
+    precips = [h["precip"] for h in hourly_data]
+    precip_max = max(precips) if precips else 1
+    precip_max = precip_max if precip_max > 0 else 1
+
+    # Draw temperature bars (grey)
+    for i, data in enumerate(hourly_data):
+        x = histogram_x + i * column_width
+        temp = data["temp"]
+
+        # Scale temperature to histogram height
+        temp_offset = (temp - temp_mid) / temp_range * (histogram_height / 2)
+        mid_y = histogram_y + histogram_height // 2
+
+        if temp_offset > 0:
+            # Temperature above average - bar goes up from middle
+            bar_top = max(histogram_y, int(mid_y - temp_offset))
+            bar_height = mid_y - bar_top
+            if bar_height > 0:
+                draw.rectangle([x, bar_top, x + column_width - 1, mid_y], fill=GREY)
+        else:
+            # Temperature below average - bar goes down from middle
+            bar_bottom = min(histogram_y + histogram_height, int(mid_y - temp_offset))
+            bar_height = bar_bottom - mid_y
+            if bar_height > 0:
+                draw.rectangle([x, mid_y, x + column_width - 1, bar_bottom], fill=GREY)
+
+    # Draw precipitation bars (black, 4 pixels wide with 4 pixel gap)
+    for i, data in enumerate(hourly_data):
+        x = histogram_x + i * column_width
+        precip = data["precip"]
+
+        if precip > 0:
+            # Scale precipitation to histogram height
+            precip_height = int((precip / precip_max) * histogram_height)
+            precip_height = max(1, precip_height)  # At least 1 pixel if there's precipitation
+
+            # Draw 4-pixel wide black bar from bottom
+            bar_top = histogram_y + histogram_height - precip_height
+            draw.rectangle([x, bar_top, x + 3, histogram_y + histogram_height - 1], fill=BLACK)
+
+def _draw_status(image, draw, battery_voltage, updated_text, warning):
+    """Battery icon and voltage bottom left, updated time bottom right"""
+    width, height = image.size
+    battery_icon_name = get_battery_icon_name(battery_voltage)
+    print(f"Loading battery icon: {battery_icon_name} (voltage: {battery_voltage:.1f}V)")
+    _paste_icon(image, battery_icon_name, (2, height - 14))
+
+    # Below the warning threshold the voltage is drawn black instead of grey.
+    # Portrait has the row to itself, so it also fits the runtime estimate;
+    # in landscape the histogram starts right after the voltage.
+    portrait = width <= DISPLAY_HEIGHT
+    voltage_text = format_battery_text(battery_voltage) if portrait else f"{battery_voltage:.1f}V"
+    TEXT.draw(image, (22, height - 12), voltage_text, BLACK if warning else GREY, SMALL_FONT)
+    # Too narrow in portrait for both on one line, so the updated time goes above
+    updated_y = height - 24 if portrait else height - 12
+    TEXT.draw(image, (width - 90, updated_y), updated_text, GREY, SMALL_FONT)
+
+def summarize_forecast(weather_data, day_range=None):
+    """Values a frame shows, taken from a locationforecast payload
+
+    day_range is (low, high) of today from temperature_history, shown
+    instead of the next 24 hours' range when given.
+    """
     # Get first timeseries entry
     timeseries = weather_data["properties"]["timeseries"]
     current_data = timeseries[0]
     instant_details = current_data["data"]["instant"]["details"]
     forecast_6h = current_data["data"]["next_12_hours"]
     updated_time = weather_data["properties"]["meta"]["updated_at"]
-    fetched_at = magtag_code.rfc2822_to_iso(weather_data["properties"]["meta"].get("fetched_at"))
+    fetched_at = rfc2822_to_iso(weather_data["properties"]["meta"].get("fetched_at"))
     if fetched_at:
         updated_time = fetched_at
 
-    # Extract data
-    temperature = instant_details["air_temperature"]
-    symbol_code = forecast_6h["summary"]["symbol_code"]
+    # Min/max over the next 24 entries and the 16-hour histogram, from the
+    # columns parsed once per forecast version
+    model = forecast_model.model_for(weather_data)
+    min_temperature = min(50.0, float(model.temperature[:24].min()))
+    max_temperature = max(-50.0, float(model.temperature[:24].max()))
+    if day_range is not None:
+        min_temperature, max_temperature = day_range
+    temperatures, precipitation = model.hourly(16)
+    hourly_data = [{"temp": temp, "precip": precip}
+                   for temp, precip in zip(temperatures.tolist(), precipitation.tolist())]
+
+    return {
+        "temperature": instant_details["air_temperature"],
+        "symbol_code": forecast_6h["summary"]["symbol_code"],
+        "min_temperature": min_temperature,
+        "max_temperature": max_temperature,
+        "hourly_data": hourly_data,
+        "updated_time": updated_time,
+    }
 
-    min_temperature = 50.0
-    max_temperature = -50.0
-    for entry in timeseries[:24]:
-        entry_temp = entry["data"]["instant"]["details"]["air_temperature"]
-        min_temperature = min(entry_temp, min_temperature)
-        max_temperature = max(entry_temp, max_temperature)
+# Create a custom create_weather_display that uses Pillow
+def pillow_create_weather_display(weather_data, magtag_instance, timezone_offset=0,
+                                  orientation="landscape_left", warning_threshold=3.4, day_range=None):
+    """Create the weather display layout using Pillow"""
+    portrait = orientation in PORTRAIT_ORIENTATIONS
+    if portrait:
+        width, height = DISPLAY_HEIGHT, DISPLAY_WIDTH
+    else:
+        width, height = DISPLAY_WIDTH, DISPLAY_HEIGHT
 
+    # Clear the image
+    magtag_instance.image = Image.new('RGB', (width, height), WHITE)
+    magtag_instance.draw = ImageDraw.Draw(magtag_instance.image)
+    image, draw = magtag_instance.image, magtag_instance.draw
+
+    if not weather_data:
+        # Error display
+        draw.text((width // 2 - 60, height // 2), "Weather data\nunavailable", fill=BLACK, font=FONT)
+        _rotate_for_orientation(magtag_instance, orientation)
+        return
+
+    summary = summarize_forecast(weather_data, day_range)
+    symbol_code = summary["symbol_code"]
+    min_temperature = summary["min_temperature"]
+    max_temperature = summary["max_temperature"]
+    hourly_data = summary["hourly_data"]
+    updated_time = summary["updated_time"]
     print(f"Symbol code: {symbol_code}")
-    print(f"Temperature: {temperature}°C")
+    print(f"Temperature: {summary['temperature']}°C")
+
+    battery_voltage = magtag_instance.peripherals.battery
+    updated_text = f"updated: {format_updated_time(updated_time, timezone_offset)}"
+    date_lines = get_current_date(updated_time, timezone_offset).split('\n')
+    icon_name = WEATHER_ICON_NAMES.get(symbol_code, 'unknown')
+    print(f"Looking for icon: {icon_name}")
+
+    if portrait:
+        # Portrait: icon on top, temperatures, date, histogram, status row
+        if not _paste_icon(image, icon_name, (0, -8)):
+            draw.text((4, 20), f"ERROR:\n{symbol_code[:12]}\nIcon not found.", fill=BLACK, font=FONT)
+        TEXT.draw(image, (4, 118), f"{max_temperature:.1f}º", BLACK, BIG_FONT)
+        TEXT.draw(image, (4, 170), f"{min_temperature:.1f}º", GREY, BIG_FONT)
+        date_line = " ".join(date_lines)
+        bbox = TEXT.bbox(date_line, FONT)
+        TEXT.draw(image, ((width - (bbox[2] - bbox[0])) // 2, 228), date_line, BLACK, FONT)
+        _draw_histogram(draw, hourly_data, 0, 256)
+        _draw_status(image, draw, battery_voltage, updated_text, battery_voltage <= warning_threshold)
+        _rotate_for_orientation(magtag_instance, orientation)
+        return
 
     # Weather icon
     icon_x = 50
-    try:
-        icon_file = f"magtag/icons/{magtag_code.WEATHER_ICON_NAMES.get(symbol_code, 'unknown')}.bmp"
-        print(f"Looking for icon: {icon_file}")
-        if os.path.exists(icon_file):
-            icon_img = Image.open(icon_file)
-            # Convert to RGB if needed
-            if icon_img.mode != 'RGB':
-                icon_img = icon_img.convert('RGB')
-            magtag_instance.image.paste(icon_img, (icon_x, -8))
-            print("Icon loaded successfully")
-        else:
-            # Draw placeholder text if icon not found
-            magtag_instance.draw.text((icon_x, 20), f"ERROR:\n{symbol_code[:12]}\nIcon not found.", 
-                           fill=BLACK, font=FONT)
-    except Exception as icon_error:
-        print(f"Could not load icon: {symbol_code}, error: {icon_error}")
-        magtag_instance.draw.text((icon_x, 20), f"ERROR:\n{symbol_code[:12]}\nIcon not found.", 
-                        fill=BLACK, font=FONT)
+    if not _paste_icon(image, icon_name, (icon_x, -8)):
+        # Draw placeholder text if icon not found
+        draw.text((icon_x, 20), f"ERROR:\n{symbol_code[:12]}\nIcon not found.", fill=BLACK, font=FONT)
 
     # Date display (left side, centered) - adjusted positioning to match MagTag
-    date_text = magtag_code.get_current_date(updated_time)
-    # Split the date text and draw each line with proper spacing, centered
-    date_lines = date_text.split('\n')
     y_start = 13
     line_spacing = int(25 * 1.35)  # 1.35x line spacing for 25pt font
     for i, line in enumerate(date_lines):
         # Get text width to center it
-        bbox = magtag_instance.draw.textbbox((0, 0), line, font=FONT)
+        bbox = TEXT.bbox(line, FONT)
         text_width = bbox[2] - bbox[0]
         # Center within the left area (before icon at x=50)
         x_centered = (50 - text_width) // 2
-        magtag_instance.draw.text((x_centered, y_start + i * line_spacing), line, fill=BLACK, font=FONT)
+        TEXT.draw(image, (x_centered, y_start + i * line_spacing), line, BLACK, FONT)
 
     # Temperature displays - adjusted positioning to match MagTag
-    magtag_instance.draw.text((175, 7), f"{max_temperature:.1f}º", fill=BLACK, font=BIG_FONT)
-    magtag_instance.draw.text((175, 72), f"{min_temperature:.1f}º", fill=GREY, font=BIG_FONT)
-
-    # Updated time (bottom right corner) - using small font to match terminalio.FONT
-    updated_text = f"updated: {magtag_code.format_updated_time(fetched_at)}"
-    magtag_instance.draw.text((DISPLAY_WIDTH - 90, DISPLAY_HEIGHT - 12), updated_text, 
-                    fill=GREY, font=SMALL_FONT)
+    TEXT.draw(image, (175, 7), f"{max_temperature:.1f}º", BLACK, BIG_FONT)
+    TEXT.draw(image, (175, 72), f"{min_temperature:.1f}º", GREY, BIG_FONT)
+
+    # Battery and updated time along the bottom, histogram aligned with the weather icon
+    _draw_status(image, draw, battery_voltage, updated_text, battery_voltage <= warning_threshold)
+    _draw_histogram(draw, hourly_data, icon_x, DISPLAY_HEIGHT - 12)
+
+def _rotate_for_orientation(magtag_instance, orientation):
+    """Rotate portrait layouts onto the landscape panel, same angles as php/index.php"""
+    if orientation == "portrait_up":
+        magtag_instance.image = magtag_instance.image.rotate(-90, expand=True)
+    elif orientation in ("portrait_down", "portrait_left"):
+        magtag_instance.image = magtag_instance.image.rotate(90, expand=True)
+    magtag_instance.draw = ImageDraw.Draw(magtag_instance.image)
 
-    # Battery icon and voltage (bottom left corner)
-    battery_voltage = magtag_instance.peripherals.battery
-    battery_icon_name = magtag_code.get_battery_icon_name(battery_voltage)
+def render_frame(weather_data, battery_voltage=3.8, timezone_offset=0,
+                 orientation="landscape_left", warning_threshold=3.4, frame_format="bmp", day_range=None):
+    """Render a complete frame, encoded as 2bpp BMP or in another frame_codec format"""
+    magtag_instance = MockMagTag(battery=battery_voltage)
+    pillow_create_weather_display(weather_data, magtag_instance, timezone_offset,
+                                  orientation, warning_threshold, day_range)
+    return frame_codec.encode_frame(magtag_instance.image, frame_format)
+
+def encode_summary(weather_data, battery_voltage=3.8, timezone_offset=0, warning_threshold=3.4,
+                   day_range=None):
+    """magtag/weather_summary.py bytes for a device that renders itself, None without a forecast"""
+    if not weather_data:
+        return None
+    summary = summarize_forecast(weather_data, day_range)
+    local = _local_time(summary["updated_time"], timezone_offset)
+    return weather_summary.pack(
+        WEATHER_ICON_NAMES.get(summary["symbol_code"]), summary["temperature"],
+        summary["min_temperature"], summary["max_temperature"],
+        [(hour["temp"], hour["precip"]) for hour in summary["hourly_data"]],
+        updated=(local.weekday(), local.day, local.month, local.hour, local.minute),
+        battery_bars=get_battery_bars(battery_voltage),
+        battery_hours=battery_hours_remaining(battery_voltage),
+        battery_warning=battery_voltage <= warning_threshold,
+        battery_voltage=battery_voltage,
+    )
+
+def get_weather_data(latitude, longitude):
+    """Fetch a locationforecast payload straight from met.no, None on failure"""
     try:
-        battery_icon_file = f"magtag/icons/{battery_icon_name}"
-        print(f"Loading battery icon: {battery_icon_file} (voltage: {battery_voltage:.1f}V)")
-        if os.path.exists(battery_icon_file):
-            battery_img = Image.open(battery_icon_file)
-            if battery_img.mode != 'RGB':
-                battery_img = battery_img.convert('RGB')
-            magtag_instance.image.paste(battery_img, (2, DISPLAY_HEIGHT - 14))
-            print("Battery icon loaded successfully")
-    except Exception as battery_error:
-        print(f"Could not load battery icon: {battery_error}")
-
-    voltage_text = f"{battery_voltage:.1f}V"
-    magtag_instance.draw.text((22, DISPLAY_HEIGHT - 12), voltage_text, fill=GREY, font=SMALL_FONT)
-
-    # Weather histogram (bottom 12 pixels, aligned with weather icon)
-    histogram_height = 12
-    histogram_y = DISPLAY_HEIGHT - histogram_height
-    histogram_x = icon_x  # Align with weather icon
-    histogram_width = 128  # Icon width
-    column_width = 8  # 128 / 16 = 8 pixels per hour
-    
-    # Get next 16 hours of data
-    hourly_data = []
-    for i in range(min(16, len(timeseries))):
-        entry = timeseries[i]
-        temp = entry["data"]["instant"]["details"]["air_temperature"]
-        precip = 0
-        # Check for precipitation in next_1_hours
-        if "next_1_hours" in entry["data"]:
-            precip = entry["data"]["next_1_hours"]["details"].get("precipitation_amount", 0)
-        hourly_data.append({"temp": temp, "precip": precip})
-    
-    if hourly_data:
-        # Calculate temperature range for scaling
-        temps = [h["temp"] for h in hourly_data]
-        temp_min, temp_max = min(temps), max(temps)
-        temp_range = temp_max - temp_min if temp_max != temp_min else 1
-        temp_mid = (temp_min + temp_max) / 2
-        
-        # Calculate precipitation range for scaling
-        precips = [h["precip"] for h in hourly_data]
-        precip_max = max(precips) if precips else 1
-        precip_max = precip_max if precip_max > 0 else 1
-        
-        # Draw temperature bars (grey)
-        for i, data in enumerate(hourly_data):
-            x = histogram_x + i * column_width
-            temp = data["temp"]
-            
-            # Scale temperature to histogram height
-            temp_offset = (temp - temp_mid) / temp_range * (histogram_height / 2)
-            mid_y = histogram_y + histogram_height // 2
-            
-            if temp_offset > 0:
-                # Temperature above average - bar goes up from middle
-                bar_top = max(histogram_y, int(mid_y - temp_offset))
-                bar_height = mid_y - bar_top
-                if bar_height > 0:
-                    magtag_instance.draw.rectangle([x, bar_top, x + column_width - 1, mid_y], fill=GREY)
-            else:
-                # Temperature below average - bar goes down from middle
-                bar_bottom = min(histogram_y + histogram_height, int(mid_y - temp_offset))
-                bar_height = bar_bottom - mid_y
-                if bar_height > 0:
-                    magtag_instance.draw.rectangle([x, mid_y, x + column_width - 1, bar_bottom], fill=GREY)
-        
-        # Draw precipitation bars (black, 4 pixels wide with 4 pixel gap)
-        for i, data in enumerate(hourly_data):
-            x = histogram_x + i * column_width
-            precip = data["precip"]
-            
-            if precip > 0:
-                # Scale precipitation to histogram height
-                precip_height = int((precip / precip_max) * histogram_height)
-                precip_height = max(1, precip_height)  # At least 1 pixel if there's precipitation
-                
-                # Draw 4-pixel wide black bar from bottom
-                bar_top = histogram_y + histogram_height - precip_height
-                magtag_instance.draw.rectangle([x, bar_top, x + 3, histogram_y + histogram_height - 1], fill=BLACK)
+        response = requests.get(MET_NO_URL, params={"lat": f"{latitude:.2f}", "lon": f"{longitude:.2f}"},
+                                headers={"User-Agent": USER_AGENT}, timeout=30)
+        response.raise_for_status()
+        return response.json()
+    except requests.RequestException as error:
+        print(f"Could not fetch the forecast: {error}")
+        return None
 
 def main():
     """Main program loop"""
@@ -410,20 +446,18 @@ def main():
     
     # Create mock magtag instance
     magtag_instance = MockMagTag()
-    
-    # Import and monkey patch the magtag code
-    import magtag.code as magtag_code
-    magtag_code.magtag = magtag_instance
-    
-    # Connect to WiFi
-    if not magtag_code.connect_wifi():
-        print("WiFi connection failed")
-        return
+    secrets = MockSecrets.secrets
     
     # Get and display weather data
-    weather_data = magtag_code.get_weather_data()
+    weather_data = get_weather_data(secrets["latitude"], secrets["longitude"])
     try:
-        pillow_create_weather_display(weather_data, magtag_instance)
+        pillow_create_weather_display(weather_data, magtag_instance, secrets["timezone_offset"])
+        # What a device with frame_format = "summary" downloads instead of the frame
+        summary = encode_summary(weather_data, magtag_instance.peripherals.battery, secrets["timezone_offset"])
+        if summary:
+            with open('weather_summary.bin', 'wb') as summary_file:
+                summary_file.write(summary)
+            print(f"Summary for local rendering: {len(summary)} bytes, saved to weather_summary.bin")
     except Exception as error:
         print(f"Display creation error: {error}")
         import traceback
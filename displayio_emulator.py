@@ -0,0 +1,857 @@
+"""
+Host emulator of the CircuitPython display stack and the MagTag board.
+
+install() puts NumPy-backed stand-ins for displayio, bitmaptools,
+terminalio, adafruit_display_text.label, adafruit_bitmap_font,
+adafruit_magtag, board, alarm, wifi, socketpool, analogio and
+adafruit_requests into sys.modules, so magtag/code.py, font_test.py and
+grayscale_test.py run unmodified on a PC:
+
+    python displayio_emulator.py magtag/code.py --secrets secrets.example.py --output frames
+    python displayio_emulator.py grayscale_test.py --output frames
+
+Bitmaps are NumPy arrays and Groups, TileGrids and Labels are composited
+with array slicing. Colors become panel shades the way CircuitPython does
+it for the MagTag's 2-bit grayscale EPD: luma = (19 r + 182 g + 54 b) / 255,
+then luma >> 6. display.refresh() keeps the result as display.frame
+(shade levels, 0 = black .. 3 = white, in panel orientation), so batch
+tests can composite thousands of frames a second without touching disk:
+
+    display = displayio_emulator.install(battery=3.7)
+    code = displayio_emulator.load_script("magtag/code.py")
+    display.root_group = code.create_weather_display(summary, 3.7, "landscape_left")
+    display.refresh()
+    display.indices          # frame_codec palette indices, comparable to server frames
+
+Labels are laid out like adafruit_display_text (origin at the vertical
+middle of the first line, anchored positions on the ascent/descent box)
+from the real BDF files. terminalio.FONT's glyphs are not on the host, so
+it is a 6x12 font rasterized from Pillow's built-in bitmap font: the same
+metrics, but not the same pixels.
+"""
+import argparse
+import gc
+import ipaddress
+import os
+import runpy
+import signal
+import sys
+import time
+import types
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+PANEL_WIDTH = 296
+PANEL_HEIGHT = 128
+PANEL_ROTATION = 270  # board.DISPLAY.rotation at boot, the landscape panel orientation
+SHADES = np.array([0, 85, 170, 255], dtype=np.uint8)  # gray of each 2-bit panel level
+SLEEP_MEMORY_SIZE = 8192
+CIRCUITPY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "magtag")  # the board's drive
+
+
+def _circuitpy_path(path):
+    """Absolute paths on the board ("/icons/sunny.bmp") resolve into magtag/"""
+    if isinstance(path, str) and not os.path.exists(path):
+        return os.path.join(CIRCUITPY, path.lstrip("/"))
+    return path
+
+
+def _rgb888(color):
+    if isinstance(color, int):
+        return color & 0xFFFFFF
+    r, g, b = color[:3]
+    return (r << 16) | (g << 8) | b
+
+
+def panel_levels(colors):
+    """2-bit panel level (0 black .. 3 white) of RGB888 colors, as displayio computes it"""
+    colors = np.asarray(colors, dtype=np.uint32)
+    r, g, b = colors >> 16, (colors >> 8) & 0xFF, colors & 0xFF
+    return ((r * 19 + g * 182 + b * 54) // 255 >> 6).astype(np.uint8)
+
+
+# displayio
+
+class Bitmap:
+    def __init__(self, width, height, value_count):
+        dtype = np.uint8 if value_count <= 256 else np.uint16 if value_count <= 65536 else np.uint32
+        self.data = np.zeros((height, width), dtype=dtype)
+        self.value_count = value_count
+
+    @property
+    def width(self):
+        return self.data.shape[1]
+
+    @property
+    def height(self):
+        return self.data.shape[0]
+
+    def _position(self, index):
+        if isinstance(index, tuple):
+            return index[1], index[0]
+        return divmod(index, self.width)
+
+    def __getitem__(self, index):
+        return int(self.data[self._position(index)])
+
+    def __setitem__(self, index, value):
+        self.data[self._position(index)] = value
+
+    def fill(self, value):
+        self.data.fill(value)
+
+
+class Palette:
+    def __init__(self, color_count, *, dither=False):
+        self._colors = np.zeros(color_count, dtype=np.uint32)
+        self._levels = np.zeros(color_count, dtype=np.uint8)
+        self._transparent = np.zeros(color_count, dtype=bool)
+
+    def __len__(self):
+        return len(self._colors)
+
+    def __getitem__(self, index):
+        return int(self._colors[index])
+
+    def __setitem__(self, index, color):
+        self._colors[index] = _rgb888(color)
+        self._levels[index] = panel_levels(self._colors[index])
+
+    def make_transparent(self, index):
+        self._transparent[index] = True
+
+    def make_opaque(self, index):
+        self._transparent[index] = False
+
+    def is_transparent(self, index):
+        return bool(self._transparent[index])
+
+    def _shade(self, values):
+        """(levels, opaque mask or None) for an array of pixel values"""
+        opaque = ~self._transparent[values] if self._transparent.any() else None
+        return self._levels[values], opaque
+
+
+class ColorConverter:
+    def __init__(self, *, input_colorspace=None, dither=False):
+        self._transparent_color = None
+
+    def convert(self, color):
+        return _rgb888(color)
+
+    def make_transparent(self, color):
+        self._transparent_color = _rgb888(color)
+
+    def make_opaque(self, color):
+        self._transparent_color = None
+
+    def _shade(self, values):
+        opaque = values != self._transparent_color if self._transparent_color is not None else None
+        return panel_levels(values), opaque
+
+
+class OnDiskBitmap:
+    """A BMP file; indexed files come with a Palette, others with a ColorConverter"""
+
+    def __init__(self, file):
+        image = Image.open(_circuitpy_path(file))
+        if image.mode == "P":
+            self.data = np.asarray(image, dtype=np.uint8)
+            colors = np.array(image.getpalette()[:3 * 256], dtype=np.uint32).reshape(-1, 3)
+            self.pixel_shader = Palette(max(int(self.data.max()) + 1, 1))
+            for i in range(len(self.pixel_shader)):
+                self.pixel_shader[i] = tuple(int(c) for c in colors[i])
+        else:
+            rgb = np.asarray(image.convert("RGB"), dtype=np.uint32)
+            self.data = (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
+            self.pixel_shader = ColorConverter()
+
+    @property
+    def width(self):
+        return self.data.shape[1]
+
+    @property
+    def height(self):
+        return self.data.shape[0]
+
+
+class TileGrid:
+    def __init__(self, bitmap, *, pixel_shader, width=1, height=1, tile_width=None, tile_height=None,
+                 default_tile=0, x=0, y=0):
+        self.bitmap = bitmap
+        self.pixel_shader = pixel_shader
+        self.tile_width = tile_width or bitmap.width
+        self.tile_height = tile_height or bitmap.height
+        self.width = width
+        self.height = height
+        self._tiles = np.full((height, width), default_tile, dtype=np.uint16)
+        self.x = x
+        self.y = y
+        self.hidden = False
+        self.flip_x = False
+        self.flip_y = False
+        self.transpose_xy = False
+
+    def __getitem__(self, index):
+        x, y = index if isinstance(index, tuple) else (index % self.width, index // self.width)
+        return int(self._tiles[y, x])
+
+    def __setitem__(self, index, tile):
+        x, y = index if isinstance(index, tuple) else (index % self.width, index // self.width)
+        self._tiles[y, x] = tile
+
+    def _pixels(self):
+        """Pixel values of the whole grid, (height, width)"""
+        data = self.bitmap.data
+        tw, th = self.tile_width, self.tile_height
+        if self.width == self.height == 1 and (tw, th) == (self.bitmap.width, self.bitmap.height) \
+                and self._tiles[0, 0] == 0:
+            pixels = data
+        else:
+            columns = self.bitmap.width // tw
+            tiles = data[:data.shape[0] // th * th, :columns * tw].reshape(-1, th, columns, tw)
+            tiles = tiles.transpose(0, 2, 1, 3).reshape(-1, th, tw)
+            grid = tiles[self._tiles]  # (rows, columns, th, tw)
+            pixels = grid.transpose(0, 2, 1, 3).reshape(self.height * th, self.width * tw)
+        if self.transpose_xy:
+            pixels = pixels.T
+        if self.flip_x:
+            pixels = pixels[:, ::-1]
+        if self.flip_y:
+            pixels = pixels[::-1]
+        return pixels
+
+
+class Group:
+    def __init__(self, *, scale=1, x=0, y=0):
+        self._items = []
+        self.scale = scale
+        self.x = x
+        self.y = y
+        self.hidden = False
+
+    def append(self, item):
+        self._items.append(item)
+
+    def insert(self, index, item):
+        self._items.insert(index, item)
+
+    def index(self, item):
+        return self._items.index(item)
+
+    def pop(self, index=-1):
+        return self._items.pop(index)
+
+    def remove(self, item):
+        self._items.remove(item)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getitem__(self, index):
+        return self._items[index]
+
+    def __setitem__(self, index, item):
+        self._items[index] = item
+
+    def __delitem__(self, index):
+        del self._items[index]
+
+
+def _draw(frame, item, origin_x, origin_y, scale):
+    if item.hidden:
+        return
+    x, y = origin_x + item.x * scale, origin_y + item.y * scale
+    if isinstance(item, Group):
+        for child in item._items:
+            _draw(frame, child, x, y, scale * item.scale)
+        return
+
+    levels, opaque = item.pixel_shader._shade(item._pixels())
+    if scale != 1:
+        levels = levels.repeat(scale, axis=0).repeat(scale, axis=1)
+        if opaque is not None:
+            opaque = opaque.repeat(scale, axis=0).repeat(scale, axis=1)
+    height, width = frame.shape
+    left, top = max(x, 0), max(y, 0)
+    right, bottom = min(x + levels.shape[1], width), min(y + levels.shape[0], height)
+    if left >= right or top >= bottom:
+        return
+    source = (slice(top - y, bottom - y), slice(left - x, right - x))
+    target = frame[top:bottom, left:right]
+    if opaque is None:
+        target[...] = levels[source]
+    else:
+        np.copyto(target, levels[source], where=opaque[source])
+
+
+def composite(group, width=PANEL_WIDTH, height=PANEL_HEIGHT):
+    """Panel levels (0 black .. 3 white) of a group; uncovered pixels are black, as in displayio"""
+    frame = np.zeros((height, width), dtype=np.uint8)
+    if group is not None:
+        _draw(frame, group, 0, 0, 1)
+    return frame
+
+
+class Display:
+    """board.DISPLAY: the 296x128 grayscale EPD, composited on refresh()
+
+    Like the real panel, refresh() raises RuntimeError within
+    seconds_per_frame of the previous refresh (0, the default, never does).
+    """
+
+    def __init__(self, width=PANEL_WIDTH, height=PANEL_HEIGHT, rotation=PANEL_ROTATION, seconds_per_frame=0):
+        self.panel_width = width
+        self.panel_height = height
+        self.rotation = rotation
+        self.root_group = None
+        self.frame = np.full((height, width), 3, dtype=np.uint8)
+        self.refresh_count = 0
+        self.listeners = []  # called as listener(display) after every refresh
+        self.seconds_per_frame = seconds_per_frame
+        self.last_refresh = None
+        self.busy = False
+
+    @property
+    def time_to_refresh(self):
+        if self.last_refresh is None:
+            return 0
+        return max(0.0, self.last_refresh + self.seconds_per_frame - time.monotonic())
+
+    @property
+    def _quarter_turns(self):
+        """Clockwise quarter turns from the panel to what the program draws"""
+        return (self.rotation - PANEL_ROTATION) % 360 // 90
+
+    @property
+    def width(self):
+        return self.panel_height if self._quarter_turns % 2 else self.panel_width
+
+    @property
+    def height(self):
+        return self.panel_width if self._quarter_turns % 2 else self.panel_height
+
+    def show(self, group):
+        self.root_group = group
+
+    def refresh(self):
+        if self.time_to_refresh > 0:
+            raise RuntimeError("Refresh too soon")
+        self.last_refresh = time.monotonic()
+        # Drawn upright, then turned onto the panel like dev_weather._rotate_for_orientation
+        self.frame = np.rot90(composite(self.root_group, self.width, self.height), -self._quarter_turns)
+        self.refresh_count += 1
+        for listener in self.listeners:
+            listener(self)
+
+    @property
+    def image(self):
+        """The panel as a grayscale Pillow image"""
+        return Image.fromarray(SHADES[self.frame])
+
+    @property
+    def indices(self):
+        """The panel as frame_codec palette indices (0 white .. 3 black)"""
+        return 3 - self.frame
+
+
+# bitmaptools
+
+def fill_region(dest_bitmap, x1, y1, x2, y2, value):
+    x1, x2 = sorted((x1, x2))
+    y1, y2 = sorted((y1, y2))
+    dest_bitmap.data[max(y1, 0):max(y2, 0), max(x1, 0):max(x2, 0)] = value
+
+
+def arrayblit(bitmap, data, x1=0, y1=0, x2=None, y2=None, skip_index=None):
+    x2 = bitmap.width if x2 is None else x2
+    y2 = bitmap.height if y2 is None else y2
+    count = (x2 - x1) * (y2 - y1)
+    values = np.frombuffer(memoryview(data), dtype=np.uint8)[:count].reshape(y2 - y1, x2 - x1)
+    target = bitmap.data[y1:y2, x1:x2]
+    if skip_index is None:
+        target[...] = values
+    else:
+        np.copyto(target, values, where=values != skip_index, casting="unsafe")
+
+
+def blit(dest_bitmap, source_bitmap, x, y, *, x1=0, y1=0, x2=None, y2=None,
+         skip_source_index=None, skip_dest_index=None):
+    x2 = source_bitmap.width if x2 is None else x2
+    y2 = source_bitmap.height if y2 is None else y2
+    source = source_bitmap.data[y1:y2, x1:x2]
+    height = min(source.shape[0], dest_bitmap.height - y)
+    width = min(source.shape[1], dest_bitmap.width - x)
+    source = source[:height, :width]
+    target = dest_bitmap.data[y:y + height, x:x + width]
+    mask = np.ones(source.shape, dtype=bool)
+    if skip_source_index is not None:
+        mask &= source != skip_source_index
+    if skip_dest_index is not None:
+        mask &= target != skip_dest_index
+    np.copyto(target, source, where=mask, casting="unsafe")
+
+
+# Fonts
+
+class Glyph:
+    __slots__ = ("bitmap", "tile_index", "width", "height", "dx", "dy", "shift_x", "shift_y")
+
+    def __init__(self, bitmap, tile_index, width, height, dx, dy, shift_x, shift_y):
+        self.bitmap = bitmap
+        self.tile_index = tile_index
+        self.width = width
+        self.height = height
+        self.dx = dx
+        self.dy = dy
+        self.shift_x = shift_x
+        self.shift_y = shift_y
+
+
+def _glyph(mask, dx, dy, shift_x, shift_y=0):
+    bitmap = Bitmap(mask.shape[1], mask.shape[0], 2)
+    bitmap.data[...] = mask
+    return Glyph(bitmap, 0, mask.shape[1], mask.shape[0], dx, dy, shift_x, shift_y)
+
+
+class BDF:
+    """adafruit_bitmap_font.bdf.BDF, with every glyph parsed up front"""
+
+    def __init__(self, path):
+        self.glyphs = {}
+        self.ascent = self.descent = 0
+        self._box = (0, 0, 0, 0)
+        with open(path) as bdf_file:
+            lines = iter(bdf_file.read().splitlines())
+        code = dwidth = bbx = None
+        for line in lines:
+            key, _, value = line.partition(" ")
+            if key == "FONTBOUNDINGBOX":
+                self._box = tuple(int(v) for v in value.split())
+            elif key == "FONT_ASCENT":
+                self.ascent = int(value)
+            elif key == "FONT_DESCENT":
+                self.descent = int(value)
+            elif key == "ENCODING":
+                code = int(value.split()[0])
+            elif key == "DWIDTH":
+                dwidth = tuple(int(v) for v in value.split())
+            elif key == "BBX":
+                bbx = tuple(int(v) for v in value.split())
+            elif key == "BITMAP":
+                width, height, dx, dy = bbx
+                rows = [next(lines) for _ in range(height)]
+                if height and width:
+                    packed = np.array([bytes.fromhex(row) for row in rows], dtype="S").view(np.uint8)
+                    bits = np.unpackbits(packed.reshape(height, -1), axis=1)[:, :width]
+                else:
+                    bits = np.zeros((height, width), dtype=np.uint8)
+                self.glyphs[code] = _glyph(bits, dx, dy, *dwidth)
+
+    def get_bounding_box(self):
+        return self._box
+
+    def load_glyphs(self, code_points):
+        pass
+
+    def get_glyph(self, code_point):
+        return self.glyphs.get(code_point)
+
+
+def load_font(filename):
+    return BDF(_circuitpy_path(filename))
+
+
+class TerminalFont:
+    """terminalio.FONT's 6x12 cells, rasterized from Pillow's built-in bitmap font"""
+
+    def __init__(self):
+        font = ImageFont.load_default_imagefont()
+        self.glyphs = {}
+        for code in range(32, 127):
+            cell = Image.new("1", (6, 12), 0)
+            ImageDraw.Draw(cell).text((0, 1), chr(code), fill=1, font=font)
+            self.glyphs[code] = _glyph(np.asarray(cell, dtype=np.uint8), 0, 0, 6)
+
+    def get_bounding_box(self):
+        return (6, 12)
+
+    def get_glyph(self, code_point):
+        return self.glyphs.get(code_point)
+
+
+def _ascent_descent(font):
+    """Font ascent and descent the way adafruit_display_text measures them"""
+    if hasattr(font, "ascent"):
+        return font.ascent, font.descent
+    ascent = descent = 0
+    for char in "M j'":
+        glyph = font.get_glyph(ord(char))
+        if glyph:
+            ascent = max(ascent, glyph.height + glyph.dy)
+            descent = max(descent, -glyph.dy)
+    return ascent, descent
+
+
+class Label(Group):
+    """adafruit_display_text.label.Label: text as a two-color TileGrid inside a Group"""
+
+    def __init__(self, font, *, text="", color=0xFFFFFF, background_color=None, line_spacing=1.25,
+                 scale=1, x=0, y=0, anchor_point=None, anchored_position=None, base_alignment=False,
+                 **kwargs):
+        super().__init__(scale=scale, x=x, y=y)
+        self.font = font
+        self.line_spacing = line_spacing
+        self.base_alignment = base_alignment
+        self._text = text
+        self._color = color
+        self._background_color = background_color
+        self._anchor_point = anchor_point
+        self._anchored_position = anchored_position
+        self._layout()
+
+    def _layout(self):
+        font = self.font
+        ascent, descent = _ascent_descent(font)
+        line_height = int(self.line_spacing * font.get_bounding_box()[1])
+        y_offset = 0 if self.base_alignment else ascent // 2
+        placed = []
+        width = 0
+        for row, line in enumerate(self._text.split("\n")):
+            cursor = 0
+            baseline = y_offset + row * line_height
+            for char in line:
+                glyph = font.get_glyph(ord(char))
+                if glyph is None:
+                    continue
+                placed.append((glyph, cursor + glyph.dx, baseline - glyph.height - glyph.dy))
+                cursor += glyph.shift_x
+            width = max(width, cursor)
+        lines = self._text.count("\n") + 1
+        # The ascent/descent box anchored positions refer to, relative to the origin
+        self.bounding_box = (0, y_offset - ascent, width, ascent + descent + (lines - 1) * line_height)
+
+        box_x, box_y, box_width, box_height = self.bounding_box
+        left = min([box_x] + [gx for _, gx, _ in placed])
+        top = min([box_y] + [gy for _, _, gy in placed])
+        right = max([box_x + box_width] + [gx + g.width for g, gx, _ in placed])
+        bottom = max([box_y + box_height] + [gy + g.height for g, _, gy in placed])
+        bitmap = Bitmap(max(right - left, 1), max(bottom - top, 1), 3)
+        if self._background_color is not None:
+            bitmap.data[box_y - top:box_y - top + box_height, box_x - left:box_x - left + box_width] = 2
+        for glyph, gx, gy in placed:
+            target = bitmap.data[gy - top:gy - top + glyph.height, gx - left:gx - left + glyph.width]
+            target[glyph.bitmap.data.astype(bool)] = 1
+        palette = Palette(3)
+        palette[1] = self._color
+        palette.make_transparent(0)
+        if self._background_color is None:
+            palette.make_transparent(2)
+        else:
+            palette[2] = self._background_color
+        self._items = [TileGrid(bitmap, pixel_shader=palette, x=left, y=top)]
+
+        if self._anchor_point is not None and self._anchored_position is not None:
+            (anchor_x, anchor_y), (position_x, position_y) = self._anchor_point, self._anchored_position
+            self.x = int(position_x - box_x * self.scale - round(anchor_x * box_width * self.scale))
+            self.y = int(position_y - box_y * self.scale - round(anchor_y * box_height * self.scale))
+
+    @property
+    def text(self):
+        return self._text
+
+    @text.setter
+    def text(self, text):
+        self._text = text
+        self._layout()
+
+    @property
+    def color(self):
+        return self._color
+
+    @color.setter
+    def color(self, color):
+        self._color = color
+        self._layout()
+
+    @property
+    def background_color(self):
+        return self._background_color
+
+    @background_color.setter
+    def background_color(self, color):
+        self._background_color = color
+        self._layout()
+
+    @property
+    def anchor_point(self):
+        return self._anchor_point
+
+    @anchor_point.setter
+    def anchor_point(self, point):
+        self._anchor_point = point
+        self._layout()
+
+    @property
+    def anchored_position(self):
+        return self._anchored_position
+
+    @anchored_position.setter
+    def anchored_position(self, position):
+        self._anchored_position = position
+        self._layout()
+
+
+# Board, alarms, networking
+
+class DeepSleep(SystemExit):
+    """Raised by alarm.exit_and_deep_sleep_until_alarms, the end of a wake"""
+
+    def __init__(self, alarms):
+        super().__init__(0)
+        self.alarms = alarms
+
+
+class TimeAlarm:
+    def __init__(self, *, monotonic_time=None, epoch_time=None):
+        self.monotonic_time = monotonic_time
+        self.epoch_time = epoch_time
+
+
+class PinAlarm:
+    def __init__(self, pin, value, edge=False, pull=False):
+        self.pin = pin
+        self.value = value
+
+
+def exit_and_deep_sleep_until_alarms(*alarms, preserve_dios=()):
+    raise DeepSleep(alarms)
+
+
+def light_sleep_until_alarms(*alarms):
+    """Sleeps until the earliest TimeAlarm and returns it; pin alarms never fire"""
+    timed = [alarm for alarm in alarms if getattr(alarm, "monotonic_time", None) is not None]
+    if not timed:
+        return None
+    first = min(timed, key=lambda alarm: alarm.monotonic_time)
+    time.sleep(max(0.0, first.monotonic_time - time.monotonic()))
+    return first
+
+
+class Radio:
+    def __init__(self):
+        self.enabled = True
+        self.mac_address = bytes((0x02, 0x00, 0x00, 0x4D, 0x54, 0x01))
+        self.ipv4_address = ipaddress.IPv4Address("192.168.1.100")
+        self.ipv4_subnet = ipaddress.IPv4Address("255.255.255.0")
+        self.ipv4_gateway = ipaddress.IPv4Address("192.168.1.1")
+        self.ipv4_dns = ipaddress.IPv4Address("192.168.1.1")
+        self.ap_info = types.SimpleNamespace(channel=6, bssid=bytes((0x02, 0x00, 0x00, 0x00, 0x00, 0x01)))
+
+    def connect(self, ssid, password=b"", *, channel=0, bssid=None, timeout=None):
+        print(f"Emulator: connected to {ssid}")
+
+    def set_ipv4_address(self, *, ipv4, netmask, gateway, ipv4_dns=None):
+        self.ipv4_address, self.ipv4_subnet, self.ipv4_gateway = ipv4, netmask, gateway
+        if ipv4_dns is not None:
+            self.ipv4_dns = ipv4_dns
+
+    def start_dhcp(self):
+        pass
+
+
+class Response:
+    """adafruit_requests.Response over a streaming requests.Response, header names lowercased"""
+
+    def __init__(self, response):
+        self._response = response
+        self.status_code = response.status_code
+        self.headers = {name.lower(): value for name, value in response.headers.items()}
+
+    @property
+    def content(self):
+        return self._response.content
+
+    @property
+    def text(self):
+        return self._response.text
+
+    def json(self):
+        return self._response.json()
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        return self._response.iter_content(chunk_size, decode_unicode)
+
+    def close(self):
+        self._response.close()
+
+
+class Session:
+    def __init__(self, socket_pool, ssl_context=None):
+        import requests
+        self._session = requests.Session()
+
+    def get(self, url, headers=None, timeout=60, **kwargs):
+        return Response(self._session.get(url, headers=headers, stream=True, timeout=timeout))
+
+
+class AnalogIn:
+    """The battery divider: value reads back as the emulated battery voltage"""
+
+    def __init__(self, pin):
+        self.value = min(int(BOARD.battery_voltage / 2 / 3.3 * 65536), 65535)
+
+    def deinit(self):
+        pass
+
+
+class Button:
+    value = True  # pulled up, not pressed
+
+
+class MagTag:
+    """adafruit_magtag.magtag.MagTag: splash group on board.DISPLAY, four idle buttons"""
+
+    def __init__(self, *args, **kwargs):
+        self.graphics = types.SimpleNamespace(display=BOARD.DISPLAY)
+        self.display = BOARD.DISPLAY
+        self.splash = Group()
+        BOARD.DISPLAY.root_group = self.splash
+        self.peripherals = types.SimpleNamespace(
+            buttons=[Button() for _ in range(4)], battery=BOARD.battery_voltage)
+
+    def refresh(self):
+        self.display.refresh()
+
+
+BOARD = types.SimpleNamespace()
+
+
+def _module(name, **attributes):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    sys.modules[name] = module
+    return module
+
+
+def install(secrets=None, battery=3.9, sleep_memory=None, woke_from_sleep=False, seconds_per_frame=0):
+    """Install the emulated modules into sys.modules and return the emulated board.DISPLAY
+
+    secrets is the dict code.py imports from secrets.py; sleep_memory and
+    woke_from_sleep restore what a previous wake left in alarm.sleep_memory.
+    """
+    import secrets as stdlib_secrets  # kept usable, the emulated module shadows it
+
+    display = Display(seconds_per_frame=seconds_per_frame)
+    BOARD.DISPLAY = display
+    BOARD.battery_voltage = battery
+
+    _module("displayio", Bitmap=Bitmap, Palette=Palette, ColorConverter=ColorConverter,
+            OnDiskBitmap=OnDiskBitmap, TileGrid=TileGrid, Group=Group)
+    _module("bitmaptools", fill_region=fill_region, arrayblit=arrayblit, blit=blit)
+    _module("terminalio", FONT=TerminalFont())
+    label = _module("adafruit_display_text.label", Label=Label)
+    _module("adafruit_display_text", label=label)
+    bitmap_font = _module("adafruit_bitmap_font.bitmap_font", load_font=load_font)
+    _module("adafruit_bitmap_font", bitmap_font=bitmap_font)
+    magtag = _module("adafruit_magtag.magtag", MagTag=MagTag)
+    _module("adafruit_magtag", magtag=magtag)
+    _module("board", DISPLAY=display, SCL="SCL", SDA="SDA", BATTERY="BATTERY")
+    _module("analogio", AnalogIn=AnalogIn)
+
+    memory = bytearray(SLEEP_MEMORY_SIZE)
+    if sleep_memory:
+        memory[:len(sleep_memory)] = sleep_memory
+    alarm_time = _module("alarm.time", TimeAlarm=TimeAlarm)
+    alarm_pin = _module("alarm.pin", PinAlarm=PinAlarm)
+    _module("alarm", time=alarm_time, pin=alarm_pin, sleep_memory=memory,
+            wake_alarm=TimeAlarm(monotonic_time=0) if woke_from_sleep else None,
+            exit_and_deep_sleep_until_alarms=exit_and_deep_sleep_until_alarms,
+            light_sleep_until_alarms=light_sleep_until_alarms)
+
+    _module("wifi", radio=Radio())
+    _module("socketpool", SocketPool=lambda radio: None)
+    _module("adafruit_requests", Session=Session)
+    stdlib = {name: value for name, value in vars(stdlib_secrets).items() if not name.startswith("__")}
+    _module("secrets", **stdlib, secrets=dict(secrets or {}))
+
+    # CircuitPython's gc reports the heap; the host has plenty
+    if not hasattr(gc, "mem_free"):
+        gc.mem_free = lambda: 2 * 1024 * 1024
+        gc.mem_alloc = lambda: 0
+    return display
+
+
+def load_script(path, name=None):
+    """Run a CircuitPython script as a module (not as __main__) and return it
+
+    Its directory goes on sys.path first, like CIRCUITPY's root on the board.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+    module = types.ModuleType(name or os.path.splitext(os.path.basename(path))[0])
+    module.__file__ = path
+    module.__dict__.update(runpy.run_path(path, run_name=module.__name__))
+    return module
+
+
+class Stop(SystemExit):
+    pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a CircuitPython script against the emulated MagTag")
+    parser.add_argument("script", help="e.g. magtag/code.py, font_test.py, grayscale_test.py")
+    parser.add_argument("--secrets", help="secrets.py to load (default: none, empty dict)")
+    parser.add_argument("--output", default=".", help="directory for the refresh_N.png panel images")
+    parser.add_argument("--battery", type=float, default=3.9, help="emulated battery voltage")
+    parser.add_argument("--refreshes", type=int, default=1, help="stop after this many refreshes, 0 = never")
+    parser.add_argument("--timeout", type=int, default=60, help="stop after this many seconds")
+    parser.add_argument("--sleep-memory", help="file keeping alarm.sleep_memory between runs (wakes)")
+    parser.add_argument("--seconds-per-frame", type=float, default=5.0,
+                        help="minimum time between refreshes, as on the MagTag's panel")
+    args = parser.parse_args()
+
+    secrets = runpy.run_path(args.secrets)["secrets"] if args.secrets else {}
+    sleep_memory = None
+    if args.sleep_memory and os.path.exists(args.sleep_memory):
+        with open(args.sleep_memory, "rb") as memory_file:
+            sleep_memory = memory_file.read()
+    display = install(secrets, args.battery, sleep_memory, woke_from_sleep=sleep_memory is not None,
+                      seconds_per_frame=args.seconds_per_frame)
+
+    os.makedirs(args.output, exist_ok=True)
+
+    def save(display):
+        path = os.path.join(args.output, f"refresh_{display.refresh_count}.png")
+        display.image.save(path)
+        print(f"Emulator: refresh {display.refresh_count} saved to {path}")
+        if args.refreshes and display.refresh_count >= args.refreshes:
+            raise Stop(0)
+
+    def timed_out(signum, frame):
+        raise Stop(f"Emulator: stopped after {args.timeout}s")
+
+    display.listeners.append(save)
+    signal.signal(signal.SIGALRM, timed_out)
+    signal.alarm(args.timeout)
+    directory = os.path.dirname(os.path.abspath(args.script))
+    sys.path.insert(0, directory)
+    try:
+        runpy.run_path(args.script, run_name="__main__")
+    except DeepSleep:
+        print("Emulator: deep sleep")
+        if args.sleep_memory:
+            with open(args.sleep_memory, "wb") as memory_file:
+                memory_file.write(sys.modules["alarm"].sleep_memory)
+    except Stop as stop:
+        if stop.code:
+            print(stop.code)
+    finally:
+        signal.alarm(0)
+
+
+if __name__ == "__main__":
+    main()
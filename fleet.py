@@ -0,0 +1,172 @@
+"""
+Device registry and wake-aware prefetching for render_server.py.
+
+Every request with a device id (device=, secrets["device_id"] or the MAC
+address) records when the device was seen, the X-Next-Wake it was told and
+its grid cell, so the server knows when each device will be back. The
+scheduler wakes every `tick` seconds, collects the devices due within the
+next `lead` seconds (shifted by how late devices typically arrive compared
+to when they were told to), groups them by cell and, one cell at a time,
+refreshes the cell's forecast (a single upstream fetch for all its
+devices) and renders each device's last query into the frame cache. The
+hourly spike of devices waking together becomes background work spread
+over the minutes before it.
+
+    registry = FleetRegistry("fleet.json")
+    scheduler = PrefetchScheduler(render_server, registry, lead=300)
+    asyncio.create_task(scheduler.run())
+"""
+import asyncio
+import json
+import os
+import time
+from collections import deque
+
+import numpy as np
+
+from forecast_cache import round_location
+
+STALE_AFTER = 2  # sleep intervals past due before a device counts as overdue in stats()
+
+
+class DeviceRecord:
+    __slots__ = ("device", "cell", "query", "last_seen", "interval")
+
+    def __init__(self, device, cell, query, last_seen, interval):
+        self.device = device
+        self.cell = cell
+        self.query = query
+        self.last_seen = last_seen
+        self.interval = interval
+
+    @property
+    def due(self):
+        """Epoch seconds the device is expected back"""
+        return self.last_seen + self.interval
+
+
+class FleetRegistry:
+    def __init__(self, store_path=None, drift_window=500):
+        self.store_path = store_path
+        self.devices = {}
+        self.changed = False  # since the last save
+        # Seconds between when devices were expected and when they showed up
+        self.drift = deque(maxlen=drift_window)
+        if store_path:
+            self.load()
+
+    def seen(self, device, query, next_wake, now=None):
+        """Record a request from a device and the sleep it was told to take"""
+        now = time.time() if now is None else now
+        record = self.devices.get(device)
+        if record is not None and now - record.due < record.interval:
+            self.drift.append(now - record.due)
+        # The telemetry record is per wake and no use for a prefetch
+        query = dict(query, telemetry=None)
+        self.devices[device] = DeviceRecord(device, round_location(query["lat"], query["lon"]),
+                                            query, now, next_wake)
+        self.changed = True
+
+    def typical_drift(self):
+        """Median seconds devices show up after they are due, 0 until any have come back"""
+        return float(np.median(self.drift)) if self.drift else 0.0
+
+    def due_between(self, start, end):
+        """Records of the devices expected back within [start, end), due time plus typical drift"""
+        drift = self.typical_drift()
+        return [record for record in self.devices.values() if start <= record.due + drift < end]
+
+    def cohorts(self, start, end):
+        """{cell: [records]} of the devices due within [start, end), earliest cell first"""
+        cohorts = {}
+        for record in sorted(self.due_between(start, end), key=lambda record: record.due):
+            cohorts.setdefault(record.cell, []).append(record)
+        return cohorts
+
+    def stats(self, now=None):
+        now = time.time() if now is None else now
+        records = list(self.devices.values())
+        stats = {
+            "devices": len(records),
+            "cells": len({record.cell for record in records}),
+            "overdue": sum(now - record.due > STALE_AFTER * record.interval for record in records),
+            "due_next_hour": sum(0 <= record.due - now < 3600 for record in records),
+        }
+        if self.drift:
+            drift = np.array(self.drift)
+            stats["drift_s"] = {"p50": round(self.typical_drift(), 1),
+                                "p90": round(float(np.percentile(np.abs(drift), 90)), 1)}
+        return stats
+
+    def load(self):
+        if not os.path.exists(self.store_path):
+            return
+        with open(self.store_path) as store_file:
+            for item in json.load(store_file):
+                self.devices[item["device"]] = DeviceRecord(
+                    item["device"], tuple(item["cell"]), item["query"], item["last_seen"], item["interval"])
+
+    def snapshot(self):
+        """The records as JSON-ready items, taken on the event loop"""
+        self.changed = False
+        return [{"device": record.device, "cell": record.cell, "query": record.query,
+                 "last_seen": record.last_seen, "interval": record.interval}
+                for record in self.devices.values()]
+
+    def write(self, items):
+        """Write a snapshot(); blocking, meant for an executor"""
+        with open(self.store_path + ".tmp", "w") as store_file:
+            json.dump(items, store_file)
+        os.replace(self.store_path + ".tmp", self.store_path)
+
+    def save(self):
+        self.write(self.snapshot())
+
+
+class PrefetchScheduler:
+    """Fetch forecasts and render frames shortly before each cohort of devices is due"""
+
+    def __init__(self, server, registry, lead=300, tick=15):
+        self.server = server
+        self.registry = registry
+        self.lead = lead
+        self.tick = tick
+        self.horizon = None  # due times up to here have been prefetched
+        self.counters = {"cohorts": 0, "devices": 0, "forecast_refreshes": 0, "errors": 0}
+
+    async def run(self):
+        while True:
+            try:
+                await self.prefetch_due()
+            except Exception as e:
+                self.counters["errors"] += 1
+                print(f"Prefetch failed: {e}")
+            await asyncio.sleep(self.tick)
+
+    async def prefetch_due(self, now=None):
+        """Prefetch every cohort due between the last run's horizon and now + lead"""
+        now = time.time() if now is None else now
+        start = now if self.horizon is None else self.horizon
+        end = now + self.lead
+        self.horizon = end
+        cohorts = self.registry.cohorts(start, end)
+        for cell, records in cohorts.items():
+            # Cells one after another, so a big cohort doesn't starve live requests
+            await self.prefetch_cell(cell, records)
+        if self.registry.store_path and self.registry.changed:
+            await asyncio.get_running_loop().run_in_executor(None, self.registry.write, self.registry.snapshot())
+        return cohorts
+
+    async def prefetch_cell(self, cell, records):
+        forecasts = self.server.forecasts
+        # A forecast that expires before the cohort arrives is refreshed now, once for all of it
+        latest_due = max(record.due for record in records)
+        if await forecasts.refresh_before(*cell, latest_due):
+            self.counters["forecast_refreshes"] += 1
+        for record in records:
+            await self.server.render(record.query)
+        self.counters["cohorts"] += 1
+        self.counters["devices"] += len(records)
+
+    def stats(self):
+        return dict(self.counters, lead=self.lead, tick=self.tick)
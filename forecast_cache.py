@@ -0,0 +1,172 @@
+"""
+met.no forecast fetching with HTTP caching.
+
+Parsed locationforecast payloads are kept per rounded lat/lon grid cell and
+served until met.no's Expires. After that the cell is revalidated with a
+conditional GET (If-Modified-Since), so an unchanged forecast costs a 304
+instead of a full download. Concurrent requests for the same cell share one
+in-flight fetch.
+
+The upstream URL is a constructor argument so the cache can be pointed at
+met_stand_in.py instead of api.met.no.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+import email.utils
+
+import requests
+
+MET_NO_URL = "https://api.met.no/weatherapi/locationforecast/2.0/compact"
+USER_AGENT = "Magtag 0.1.2/ (jesse@krets.com)"
+FALLBACK_TTL = 30 * 60  # seconds, when met.no sends no usable Expires
+ERROR_RETRY = 60        # seconds a stale entry is served after a failed revalidation
+
+
+def round_location(lat, lon):
+    """Round a location to the grid cell frames and forecasts are shared by (~1 km)"""
+    return round(float(lat), 2), round(float(lon), 2)
+
+
+def parse_http_date(value, default=None):
+    """Epoch seconds for an HTTP date header, default if missing or invalid"""
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return default
+
+
+class ForecastEntry:
+    def __init__(self, payload, expires, last_modified):
+        self.payload = payload
+        self.expires = expires
+        self.last_modified = last_modified
+
+    def fresh(self, now=None):
+        return self.expires > (time.time() if now is None else now)
+
+
+class ForecastCache:
+    def __init__(self, url=MET_NO_URL, store_path=None):
+        self.url = url
+        self.store_path = store_path
+        self.entries = {}
+        self.inflight = {}
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        self.save_lock = threading.Lock()
+        self.counters = {"hits": 0, "coalesced": 0, "fetches": 0, "not_modified": 0, "errors": 0}
+        # Called as listener(cell, payload) whenever a cell gets a new forecast
+        self.listeners = []
+        if store_path:
+            self.load()
+
+    async def get(self, lat, lon):
+        """Forecast payload for a location, None if met.no never answered for its cell"""
+        cell = round_location(lat, lon)
+        entry = self.entries.get(cell)
+        if entry and entry.fresh():
+            self.counters["hits"] += 1
+            return entry.payload
+
+        entry = await self._shared_refresh(cell)
+        return entry.payload if entry else None
+
+    async def refresh_before(self, lat, lon, deadline):
+        """Refresh a location's forecast now if it would expire before deadline
+
+        Used by fleet.PrefetchScheduler so devices arriving at deadline find
+        a fresh forecast. Returns True if met.no was asked.
+        """
+        cell = round_location(lat, lon)
+        entry = self.entries.get(cell)
+        if entry and entry.fresh(deadline):
+            return False
+        await self._shared_refresh(cell)
+        return True
+
+    async def _shared_refresh(self, cell):
+        """Refresh a cell, joining a refresh that is already in flight"""
+        task = self.inflight.get(cell)
+        if task is not None:
+            self.counters["coalesced"] += 1
+        else:
+            task = asyncio.create_task(self._refresh(cell))
+            self.inflight[cell] = task
+            task.add_done_callback(lambda _: self.inflight.pop(cell, None))
+        return await asyncio.shield(task)
+
+    def expires(self, lat, lon):
+        """Epoch seconds when the cached forecast for a location expires, None if not cached"""
+        entry = self.entries.get(round_location(lat, lon))
+        return entry.expires if entry else None
+
+    async def _refresh(self, cell):
+        entry = self.entries.get(cell)
+        last_modified = entry.last_modified if entry else None
+        loop = asyncio.get_running_loop()
+        try:
+            response, payload = await loop.run_in_executor(None, self._fetch, cell, last_modified)
+        except (requests.RequestException, ValueError) as e:
+            self.counters["errors"] += 1
+            print(f"Forecast fetch failed for {cell}: {e}")
+            if entry:
+                # Keep serving the stale forecast, but don't retry on every request
+                entry.expires = time.time() + ERROR_RETRY
+            return entry
+
+        expires = parse_http_date(response.headers.get("Expires"), time.time() + FALLBACK_TTL)
+        if response.status_code == 304 and entry:
+            self.counters["not_modified"] += 1
+            entry.expires = expires
+            entry.last_modified = response.headers.get("Last-Modified", entry.last_modified)
+        else:
+            entry = ForecastEntry(payload, expires, response.headers.get("Last-Modified"))
+            self.entries[cell] = entry
+            for listener in self.listeners:
+                listener(cell, entry.payload)
+        if self.store_path:
+            # Snapshot on the loop, the JSON dump runs on the executor
+            await loop.run_in_executor(None, self._write, self._items())
+        return entry
+
+    def _fetch(self, cell, last_modified):
+        """(response, parsed payload or None for a 304); a truncated or non-JSON body raises ValueError"""
+        self.counters["fetches"] += 1
+        headers = {"If-Modified-Since": last_modified} if last_modified else {}
+        response = self.session.get(self.url, params={"lat": cell[0], "lon": cell[1]},
+                                    headers=headers, timeout=15)
+        if response.status_code == 304:
+            return response, None
+        response.raise_for_status()
+        return response, response.json()
+
+    def stats(self):
+        return dict(self.counters, cells=len(self.entries), inflight=len(self.inflight))
+
+    def load(self):
+        """Read entries saved by save(), e.g. across runs of weather_data_probe.py"""
+        if not os.path.exists(self.store_path):
+            return
+        with open(self.store_path) as store_file:
+            for item in json.load(store_file):
+                self.entries[tuple(item["cell"])] = ForecastEntry(
+                    item["payload"], item["expires"], item["last_modified"])
+
+    def save(self):
+        self._write(self._items())
+
+    def _items(self):
+        return [
+            {"cell": cell, "payload": entry.payload, "expires": entry.expires,
+             "last_modified": entry.last_modified}
+            for cell, entry in self.entries.items()
+        ]
+
+    def _write(self, items):
+        # Refreshes of different cells can finish together; one writer at a time
+        with self.save_lock:
+            with open(self.store_path, "w") as store_file:
+                json.dump(items, store_file)
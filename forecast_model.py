@@ -0,0 +1,118 @@
+"""
+Columnar view of a met.no locationforecast payload.
+
+The timeseries list of nested dicts is walked once and turned into NumPy
+columns; the renderer, wake_schedule and the temperature history then
+answer their questions (high/low and when, precipitation windows, the next
+hours) with vectorized queries instead of walking the dicts again. Models
+are shared between render_server.py's executor threads, so the cache is
+kept under a lock.
+
+    model = model_for(weather_data)          # parsed once per forecast version
+    model.extremes(start, end)               # (high, high_at, low, low_at)
+    model.daily(timezone_offset=2)           # [(date, high, high_at, low, low_at), ...]
+    model.precipitation_windows()            # [(start, end, mm), ...]
+
+Times are epoch seconds (UTC). Missing values are NaN.
+"""
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+MODEL_CACHE_SIZE = 64
+
+
+def _epoch(iso_time):
+    return int(datetime.fromisoformat(iso_time.replace("Z", "+00:00")).timestamp())
+
+
+def _detail(data, period, name):
+    value = data.get(period, {}).get("details", {}).get(name)
+    return np.nan if value is None else value
+
+
+class ForecastModel:
+    def __init__(self, weather_data):
+        properties = weather_data["properties"]
+        timeseries = properties["timeseries"]
+        self.updated_at = properties["meta"]["updated_at"]
+        count = len(timeseries)
+        self.times = np.empty(count, dtype=np.int64)
+        self.temperature = np.empty(count)
+        self.precipitation = np.empty(count)  # next_1_hours, mm
+        for i, entry in enumerate(timeseries):
+            data = entry["data"]
+            self.times[i] = _epoch(entry["time"])
+            self.temperature[i] = data["instant"]["details"]["air_temperature"]
+            self.precipitation[i] = _detail(data, "next_1_hours", "precipitation_amount")
+        self.precipitation_or_zero = np.nan_to_num(self.precipitation, nan=0.0)
+
+    def __len__(self):
+        return len(self.times)
+
+    def between(self, start, end):
+        """Index slice of the entries with start <= time < end"""
+        return slice(*np.searchsorted(self.times, (start, end)))
+
+    def extremes(self, start=None, end=None):
+        """(high, high_at, low, low_at) within [start, end), None if there are no entries"""
+        window = self.between(start if start is not None else self.times[0],
+                              end if end is not None else self.times[-1] + 1)
+        temperature = self.temperature[window]
+        if not len(temperature):
+            return None
+        times = self.times[window]
+        high, low = int(np.argmax(temperature)), int(np.argmin(temperature))
+        return float(temperature[high]), int(times[high]), float(temperature[low]), int(times[low])
+
+    def daily(self, timezone_offset=0, days=None):
+        """[(local date, high, high_at, low, low_at)] per local calendar day, in order"""
+        offset = timezone_offset * 3600
+        result = []
+        for day in np.unique((self.times + offset) // 86400)[:days]:
+            start = int(day) * 86400 - offset
+            date = (datetime(1970, 1, 1, tzinfo=timezone.utc) + timedelta(days=int(day))).date()
+            result.append((date,) + self.extremes(start, start + 86400))
+        return result
+
+    def precipitation_windows(self, min_amount=0.0, start=None):
+        """[(start, end, total mm)] of consecutive hours with more than min_amount"""
+        window = self.between(start if start is not None else self.times[0], self.times[-1] + 1)
+        amounts = self.precipitation[window]
+        times = self.times[window]
+        # NaN (the 6-hourly tail has no next_1_hours) compares False, so it counts as dry
+        wet = amounts > min_amount
+        edges = np.diff(np.concatenate(([0], wet.view(np.int8), [0])))
+        starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+        return [(int(times[s]), int(times[e - 1]) + 3600, round(float(amounts[s:e].sum()), 1))
+                for s, e in zip(starts, ends)]
+
+    def hourly(self, count, start_index=0):
+        """Temperature and precipitation (0 where unknown) of count entries"""
+        window = slice(start_index, start_index + count)
+        return self.temperature[window], self.precipitation_or_zero[window]
+
+
+_models = OrderedDict()
+_models_lock = threading.Lock()
+
+
+def model_for(weather_data):
+    """ForecastModel for a payload, shared by every caller with the same forecast version"""
+    geometry = weather_data.get("geometry", {}).get("coordinates")
+    key = (weather_data["properties"]["meta"]["updated_at"], tuple(geometry) if geometry else None,
+           len(weather_data["properties"]["timeseries"]))
+    with _models_lock:
+        model = _models.get(key)
+        if model is not None:
+            _models.move_to_end(key)
+            return model
+    # Parsed outside the lock; two threads may both parse a new forecast, the last one is kept
+    model = ForecastModel(weather_data)
+    with _models_lock:
+        _models[key] = model
+        if len(_models) > MODEL_CACHE_SIZE:
+            _models.popitem(last=False)
+    return model
@@ -0,0 +1,114 @@
+"""
+Quantize rendered frames to the 4 shades the MagTag panel can show and
+encode them in formats the device can load.
+"""
+
+import hashlib
+import struct
+
+import numpy as np
+
+# Panel shades, index 0 is the background. Same order and values as the
+# palette built at the end of php/index.php.
+PALETTE = (
+    (255, 255, 255),  # white
+    (170, 170, 170),  # light gray
+    (85, 85, 85),     # dark gray
+    (0, 0, 0),        # black
+)
+
+
+def quantize(image):
+    """Map a Pillow image to a (height, width) uint8 array of palette indices"""
+    rgb = np.asarray(image.convert("RGB"), dtype=np.uint32)
+    # Same integer luminance and 192/128/64 thresholds as the PHP loop
+    gray = (299 * rgb[..., 0] + 587 * rgb[..., 1] + 114 * rgb[..., 2]) // 1000
+    return (3 - (gray > 64).astype(np.uint8) - (gray > 128) - (gray > 192)).astype(np.uint8)
+
+
+def pack_2bpp(indices):
+    """Pack palette indices four pixels per byte, leftmost pixel in the high bits"""
+    height, width = indices.shape
+    padded = np.zeros((height, (width + 3) // 4 * 4), dtype=np.uint8)
+    padded[:, :width] = indices
+    quads = padded.reshape(height, -1, 4)
+    return (quads[..., 0] << 6) | (quads[..., 1] << 4) | (quads[..., 2] << 2) | quads[..., 3]
+
+
+def encode_bmp_2bpp(indices, palette=PALETTE):
+    """Encode palette indices as an uncompressed 2-bit-per-pixel indexed BMP"""
+    height, width = indices.shape
+    packed = pack_2bpp(indices)
+    stride = (packed.shape[1] + 3) // 4 * 4
+    rows = np.zeros((height, stride), dtype=np.uint8)
+    rows[:, :packed.shape[1]] = packed
+
+    palette_bytes = b"".join(bytes((b, g, r, 0)) for r, g, b in palette)
+    offset = 14 + 40 + len(palette_bytes)
+    pixel_bytes = rows[::-1].tobytes()  # BMP rows are stored bottom-up
+
+    file_header = struct.pack("<2sIHHI", b"BM", offset + len(pixel_bytes), 0, 0, offset)
+    info_header = struct.pack(
+        "<IiiHHIIiiII",
+        40, width, height, 1, 2, 0, len(pixel_bytes), 2835, 2835, len(palette), len(palette),
+    )
+    return file_header + info_header + palette_bytes + pixel_bytes
+
+
+def encode_rle(indices, palette=PALETTE):
+    """Encode palette indices in the MTR1 run-length format
+
+    b"MTR1", width and height as little-endian uint16, the number of palette
+    colors as a byte, then r, g, b per color. Pixel data follows as one byte
+    per run, (index << 6) | (length - 1), for runs of 1-64 pixels in
+    row-major order. Runs never cross rows, so a decoder can fill one row
+    segment per byte; index 0 is the background and can be skipped.
+    """
+    height, width = indices.shape
+    flat = indices.ravel().astype(np.int64)
+    # A run starts wherever the value changes and at the start of every row
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    starts = np.union1d(changes, np.arange(0, flat.size, width))
+    lengths = np.diff(np.append(starts, flat.size))
+
+    # Split runs longer than 64 pixels into full 64 pixel runs plus a remainder
+    pieces = (lengths + 63) // 64
+    values = np.repeat(flat[starts], pieces)
+    run_lengths = np.full(values.size, 64, dtype=np.int64)
+    run_lengths[np.cumsum(pieces) - 1] = lengths - (pieces - 1) * 64
+
+    header = b"MTR1" + struct.pack("<HHB", width, height, len(palette))
+    header += b"".join(bytes(color) for color in palette)
+    return header + ((values << 6) | (run_lengths - 1)).astype(np.uint8).tobytes()
+
+
+def decode_rle(data):
+    """Decode an MTR1 frame back to (indices, palette)"""
+    if data[:4] != b"MTR1":
+        raise ValueError("not an MTR1 frame")
+    width, height, colors = struct.unpack_from("<HHB", data, 4)
+    palette = tuple(tuple(data[9 + 3 * i:12 + 3 * i]) for i in range(colors))
+    runs = np.frombuffer(data, dtype=np.uint8, offset=9 + 3 * colors)
+    indices = np.repeat(runs >> 6, (runs & 0x3F).astype(np.int64) + 1)
+    if indices.size != width * height:
+        raise ValueError(f"MTR1 frame has {indices.size} pixels, expected {width * height}")
+    return indices.reshape(height, width), palette
+
+
+ENCODERS = {"bmp": encode_bmp_2bpp, "rle": encode_rle}
+CONTENT_TYPES = {"bmp": "image/bmp", "rle": "application/octet-stream"}
+
+
+def frame_to_bmp(image):
+    """Quantize a rendered frame and return it as 2bpp BMP bytes"""
+    return encode_bmp_2bpp(quantize(image))
+
+
+def encode_frame(image, frame_format="bmp"):
+    """Quantize a rendered frame and encode it in one of ENCODERS' formats"""
+    return ENCODERS[frame_format](quantize(image))
+
+
+def frame_etag(frame):
+    """Strong ETag for an encoded frame"""
+    return '"' + hashlib.sha1(frame).hexdigest()[:16] + '"'
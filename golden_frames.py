@@ -0,0 +1,250 @@
+"""
+Golden-frame regression run over the full scenario matrix.
+
+One fixture forecast is rendered for every met.no symbol code (each base
+in dev_weather.WEATHER_ICON_BASE_NAMES as _day and _night, the set from
+notes.md), every orientation, one voltage per battery band (battery icon
+and warning state) and a spread of timezone offsets. Frames are quantized
+like the server's, hashed, and compared with the digests stored in
+fixtures/golden_frames.json. The work is split by symbol code over a
+process pool.
+
+For each mismatching frame a PNG is written to --diff-dir: the golden
+frame, the new frame and the changed pixels, side by side. The golden
+frames are rendered on demand from the revision the digests were saved
+at (git archive into a temporary directory), so only the digests are
+kept in the repo.
+
+    python golden_frames.py                    # compare, exit 1 on mismatches
+    python golden_frames.py --update           # accept the current rendering
+    python golden_frames.py --symbols clearsky_day rain --diff-dir /tmp/diffs
+"""
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+import bench_render
+import dev_weather
+import frame_codec
+import prerender
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+GOLDEN_PATH = os.path.join(HERE, "fixtures", "golden_frames.json")
+FIXTURE = "berlin_autumn"
+SYMBOL_CODES = tuple(f"{base}_{period}" for base in dev_weather.WEATHER_ICON_BASE_NAMES
+                     for period in ("day", "night"))
+ORIENTATIONS = prerender.ORIENTATIONS
+TIMEZONES = (-8, 0, 1, 10)
+WARNING_THRESHOLD = 3.4
+DIGEST_LENGTH = 12  # hex characters of the SHA-1 kept per frame
+DIFF_SHADES = np.array([255, 170, 85, 0], dtype=np.uint8)  # frame_codec palette index to gray
+
+
+def battery_bands(warning_threshold=WARNING_THRESHOLD):
+    """One voltage per battery icon and warning state, the highest of each"""
+    bands = {}
+    for voltage in prerender.VOLTAGES:
+        bands[(dev_weather.get_battery_icon_name(voltage), voltage <= warning_threshold)] = voltage
+    return tuple(sorted(bands.values()))
+
+
+BATTERY_BANDS = battery_bands()
+
+
+def render_indices(weather_data, orientation, voltage, timezone_offset):
+    """frame_codec palette indices of one frame"""
+    magtag_instance = dev_weather.MockMagTag(battery=voltage)
+    dev_weather.pillow_create_weather_display(weather_data, magtag_instance, timezone_offset,
+                                              orientation, WARNING_THRESHOLD)
+    return frame_codec.quantize(magtag_instance.image)
+
+
+def digest(indices):
+    return hashlib.sha1(indices.tobytes()).hexdigest()[:DIGEST_LENGTH]
+
+
+_base_data = None
+
+
+def _init_worker(fixture):
+    global _base_data
+    # The renderer prints progress for every frame
+    sys.stdout = open(os.devnull, "w")
+    dev_weather.ICONS.warm()
+    _base_data = json.loads(bench_render.load_fixtures(fixture + ".json")[fixture])
+
+
+def render_symbol(symbol_code):
+    """{orientation: {timezone: [digest per battery band]}} for one symbol code"""
+    weather_data = bench_render.with_symbol(_base_data, symbol_code)
+    return symbol_code, {
+        orientation: {str(timezone_offset): [digest(render_indices(weather_data, orientation, voltage,
+                                                                   timezone_offset))
+                                             for voltage in BATTERY_BANDS]
+                      for timezone_offset in TIMEZONES}
+        for orientation in ORIENTATIONS}
+
+
+def render_matrix(symbols, fixture=FIXTURE, workers=None):
+    """{symbol: {orientation: {timezone: [digests]}}} rendered over a process pool"""
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(fixture,)) as pool:
+        return dict(pool.map(render_symbol, symbols))
+
+
+def mismatches(frames, golden):
+    """[(symbol, orientation, timezone, voltage)] whose digest differs from (or is missing in) golden"""
+    result = []
+    for symbol, by_orientation in frames.items():
+        for orientation, by_timezone in by_orientation.items():
+            for timezone_offset, digests in by_timezone.items():
+                expected = golden.get(symbol, {}).get(orientation, {}).get(timezone_offset)
+                for i, frame_digest in enumerate(digests):
+                    if not expected or expected[i] != frame_digest:
+                        result.append((symbol, orientation, int(timezone_offset), BATTERY_BANDS[i]))
+    return result
+
+
+def render_scenarios(scenarios, fixture=FIXTURE):
+    """[indices] of (symbol, orientation, timezone, voltage) scenarios, in this process"""
+    base_data = json.loads(bench_render.load_fixtures(fixture + ".json")[fixture])
+    with contextlib.redirect_stdout(io.StringIO()):
+        return [render_indices(bench_render.with_symbol(base_data, symbol), orientation, voltage,
+                               timezone_offset)
+                for symbol, orientation, timezone_offset, voltage in scenarios]
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def render_at_revision(revision, scenarios, fixture=FIXTURE):
+    """[indices] of scenarios rendered by the tree at a git revision, None if it can't be"""
+    with tempfile.TemporaryDirectory() as tree:
+        archive = subprocess.run(["git", "archive", "--format=tar", revision], cwd=HERE,
+                                 capture_output=True)
+        if archive.returncode:
+            print(f"Cannot check out {revision}: {archive.stderr.decode().strip()}")
+            return None
+        with tarfile.open(fileobj=io.BytesIO(archive.stdout)) as tar:
+            tar.extractall(tree)
+        scenarios_path = os.path.join(tree, "golden_scenarios.json")
+        frames_path = os.path.join(tree, "golden_frames.npy")
+        with open(scenarios_path, "w") as scenarios_file:
+            json.dump(scenarios, scenarios_file)
+        # -m puts the archived tree first on sys.path, so its dev_weather renders;
+        # this module comes from PYTHONPATH in case the revision predates it
+        env = dict(os.environ, PYTHONPATH=HERE)
+        rendered = subprocess.run([sys.executable, "-m", "golden_frames", "--fixture", fixture,
+                                   "--render", scenarios_path, frames_path], cwd=tree, env=env)
+        if rendered.returncode:
+            return None
+        return list(np.load(frames_path))
+
+
+def write_golden(path, golden):
+    """JSON with one line per symbol code, so a layout change shows up as a readable git diff"""
+    frames = golden["frames"]
+    lines = [f" {json.dumps(symbol)}: {json.dumps(frames[symbol], sort_keys=True)}"
+             for symbol in sorted(frames)]
+    header = json.dumps({key: value for key, value in golden.items() if key != "frames"}, sort_keys=True)
+    with open(path, "w") as golden_file:
+        golden_file.write(header[:-1] + ', "frames": {\n' + ",\n".join(lines) + "\n}}\n")
+
+
+def write_diff(path, golden, current):
+    """golden | current | changed pixels (black) as one grayscale PNG"""
+    panels = [DIFF_SHADES[current]]
+    if golden is not None:
+        gap = np.full((current.shape[0], 4), 128, dtype=np.uint8)
+        changed = np.where(golden != current, 0, 255).astype(np.uint8)
+        panels = [DIFF_SHADES[golden], gap, DIFF_SHADES[current], gap, changed]
+    Image.fromarray(np.hstack(panels)).save(path)
+
+
+def write_diffs(diff_dir, failed, revision, fixture=FIXTURE):
+    os.makedirs(diff_dir, exist_ok=True)
+    current = render_scenarios(failed, fixture)
+    golden = render_at_revision(revision, failed, fixture) if revision else None
+    for i, (symbol, orientation, timezone_offset, voltage) in enumerate(failed):
+        name = f"{symbol}_{orientation}_{voltage:.2f}V_tz{timezone_offset:+d}.png"
+        write_diff(os.path.join(diff_dir, name), golden[i] if golden else None, current[i])
+    print(f"Wrote {len(failed)} diffs to {diff_dir}" + ("" if golden else " (new frames only)"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare rendered frames with the golden digests")
+    parser.add_argument("--golden", default=GOLDEN_PATH)
+    parser.add_argument("--fixture", default=FIXTURE, help="name in fixtures/forecasts")
+    parser.add_argument("--symbols", nargs="+", help="symbol codes to run, default all")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--update", action="store_true", help="write the current digests as golden")
+    parser.add_argument("--diff-dir", default="golden_diffs", help="where mismatch PNGs go")
+    parser.add_argument("--max-diffs", type=int, default=50, help="write at most this many diffs")
+    parser.add_argument("--render", nargs=2, metavar=("SCENARIOS", "OUTPUT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.render:
+        # Reference rendering inside render_at_revision's archived tree
+        with open(args.render[0]) as scenarios_file:
+            scenarios = [tuple(scenario) for scenario in json.load(scenarios_file)]
+        np.save(args.render[1], np.array(render_scenarios(scenarios, args.fixture)))
+        return
+
+    symbols = args.symbols or SYMBOL_CODES
+    started = time.perf_counter()
+    frames = render_matrix(symbols, args.fixture, args.workers)
+    elapsed = time.perf_counter() - started
+    count = len(symbols) * len(ORIENTATIONS) * len(TIMEZONES) * len(BATTERY_BANDS)
+    print(f"{count} frames in {elapsed:.1f}s on {args.workers} workers ({count / elapsed:.0f} frames/s)")
+
+    golden = {"frames": {}}
+    if os.path.exists(args.golden):
+        with open(args.golden) as golden_file:
+            golden = json.load(golden_file)
+
+    if args.update:
+        golden = {
+            "revision": git_revision(),
+            "fixture": args.fixture,
+            "battery_bands": BATTERY_BANDS,
+            "timezones": TIMEZONES,
+            # Only the symbols run are replaced
+            "frames": dict(golden.get("frames", {}), **frames) if args.symbols else frames,
+        }
+        write_golden(args.golden, golden)
+        print(f"Golden digests written to {args.golden} at {golden['revision']}")
+        return
+
+    if golden.get("fixture", args.fixture) != args.fixture \
+            or tuple(golden.get("battery_bands", BATTERY_BANDS)) != BATTERY_BANDS \
+            or tuple(golden.get("timezones", TIMEZONES)) != TIMEZONES:
+        parser.error(f"{args.golden} was made for another matrix, run with --update")
+    failed = mismatches(frames, golden["frames"])
+    if not failed:
+        print(f"All {count} frames match {args.golden}")
+        return
+    print(f"{len(failed)} of {count} frames differ from {args.golden}")
+    for symbol, orientation, timezone_offset, voltage in failed[:10]:
+        print(f"  {symbol} {orientation} {voltage:.2f}V tz {timezone_offset:+d}")
+    write_diffs(args.diff_dir, failed[:args.max_diffs], golden.get("revision"), args.fixture)
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Decoded and 4-shade quantized icons, shared across renders.
+
+Each icon is decoded from disk once, at its native size. Icons are kept as RGB
+images already mapped to the panel palette, plus a paste mask for icons
+with transparency, so the render path only calls Image.paste().
+
+    store = IconStore(MAGTAG_ICON_DIR)
+    store.warm("icon_cache_magtag.npz")   # decode everything up front
+    icon = store.get("partlycloudy")
+    frame.paste(icon.image, (50, -8), icon.mask)
+
+Images are marked read-only: Pillow copies them before any in-place change,
+so a caller drawing on an icon can't corrupt the shared one.
+"""
+import glob
+import os
+
+import numpy as np
+from PIL import Image
+
+import frame_codec
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MAGTAG_ICON_DIR = os.path.join(HERE, "magtag", "icons")
+
+SHADES = np.array([gray for gray, _, _ in frame_codec.PALETTE], dtype=np.uint8)
+
+
+class Icon:
+    __slots__ = ("image", "mask")
+
+    def __init__(self, image, mask=None):
+        self.image = image
+        self.mask = mask
+
+
+def _shared(image):
+    # Pillow checks this flag and copies before mutating (copy-on-write)
+    image.readonly = 1
+    return image
+
+
+def _icon_from_arrays(indices, alpha=None):
+    gray = SHADES[indices]
+    image = _shared(Image.fromarray(np.dstack((gray, gray, gray))))
+    mask = _shared(Image.fromarray(alpha)) if alpha is not None else None
+    return Icon(image, mask)
+
+
+class IconStore:
+    def __init__(self, directory):
+        self.directory = directory
+        self.icons = {}
+        self._sources = None
+        self.hits = 0
+        self.misses = 0
+
+    def sources(self, rescan=False):
+        """All icon files in the directory, keyed by name without extension; scanned once"""
+        if self._sources is None or rescan:
+            paths = glob.glob(os.path.join(self.directory, "*.bmp")) + glob.glob(os.path.join(self.directory, "*.png"))
+            self._sources = {os.path.splitext(os.path.basename(path))[0]: path for path in sorted(paths)}
+        return self._sources
+
+    def get(self, name):
+        """Shared Icon for a name, None if missing"""
+        if name in self.icons:
+            self.hits += 1
+            return self.icons[name]
+        self.misses += 1
+        # Missing icons are remembered as None so they don't hit the disk again
+        path = self.sources().get(name)
+        icon = self.icons[name] = _icon_from_arrays(*self._decode(path)) if path else None
+        return icon
+
+    def _decode(self, path):
+        """Return (palette indices, alpha or None) for a file"""
+        source = Image.open(path)
+        has_alpha = source.mode in ("RGBA", "LA") or "transparency" in source.info
+        source = source.convert("RGBA")
+        # Flatten onto white first, the same background PHP resizes onto
+        flat = Image.new("RGBA", source.size, (255, 255, 255, 255))
+        flat.alpha_composite(source)
+        indices = frame_codec.quantize(flat)
+        alpha = np.where(np.asarray(source)[..., 3] > 0, 255, 0).astype(np.uint8) if has_alpha else None
+        return indices, alpha
+
+    def warm(self, pack_path=None):
+        """Decode every icon, reusing pack_path when it is newer than the icons"""
+        sources = self.sources(rescan=True)
+        newest = max((os.path.getmtime(path) for path in sources.values()), default=0)
+        if pack_path and os.path.exists(pack_path) and os.path.getmtime(pack_path) >= newest:
+            if self._load_pack(pack_path):
+                return len(self.icons)
+
+        arrays = {}
+        for name, path in sources.items():
+            indices, alpha = self._decode(path)
+            self.icons[name] = _icon_from_arrays(indices, alpha)
+            arrays[name] = indices
+            if alpha is not None:
+                arrays[f"{name}@alpha"] = alpha
+        if pack_path:
+            with open(pack_path, "wb") as pack_file:
+                np.savez_compressed(pack_file, **arrays)
+        return len(self.icons)
+
+    def _load_pack(self, pack_path):
+        """False for a pack from before icons were keyed by name alone ("name@size")"""
+        with np.load(pack_path) as pack:
+            names = [key for key in pack.files if not key.endswith("@alpha")]
+            if any("@" in name for name in names):
+                return False
+            for name in names:
+                alpha_key = f"{name}@alpha"
+                alpha = pack[alpha_key] if alpha_key in pack.files else None
+                self.icons[name] = _icon_from_arrays(pack[name], alpha)
+        return True
+
+    def stats(self):
+        return {"icons": len(self.icons), "hits": self.hits, "misses": self.misses}
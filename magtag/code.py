@@ -1,18 +1,22 @@
 import time
-import ssl
+import gc
+import struct
 
 ## CircuitPython
 import board
 import alarm
 import wifi
 import socketpool
+import ipaddress
 import displayio
 import terminalio
-import io
+import bitmaptools
 
 ## Adafruit
 import adafruit_requests
-import adafruit_imageload
+
+# ssl, frame_auth, weather_summary, adafruit_display_text, adafruit_bitmap_font
+# and adafruit_lis3dh are imported on the paths that use them, not on every wake
 
 # Get wifi details from secrets.py file
 try:
@@ -24,20 +28,612 @@ except ImportError:
 # Display constants
 DISPLAY_WIDTH = 296
 DISPLAY_HEIGHT = 128
+# Rotation the panel boots with, in which server frames are drawn. Captured
+# once: create_weather_display turns the display for portrait summaries.
+PANEL_ROTATION = board.DISPLAY.rotation
+
+# Deep sleep between wakes, in seconds. The render server may suggest a
+# different interval (X-Next-Wake), which is clamped to these bounds.
+DEFAULT_SLEEP = 3 * 60 * 60
+MIN_SLEEP = 10 * 60
+MAX_SLEEP = 12 * 60 * 60
+# Sleep after a failed wake, doubled with every further failure up to MAX_SLEEP
+RETRY_SLEEP = 15 * 60
+
+# alarm.sleep_memory layout. Survives deep sleep, but not a reset or power
+# loss, so it is only trusted when we woke from an alarm.
+SLEEP_ETAG = 0        # length byte + ETag of the frame currently on screen
+SLEEP_ETAG_SIZE = 48
+SLEEP_TELEMETRY = 48  # previous wake's phase timings, see Telemetry
+SLEEP_WIFI = 80       # access point and DHCP lease of the last connection, see connect_wifi
+SLEEP_ORIENTATION = 108  # LIS3DH address and last orientation, see get_orientation
+SLEEP_OFFLINE = 112   # failure count and last good frame, see OfflineCache
+SLEEP_OFFLINE_DATA = 128  # the frame itself, up to the end of sleep_memory
+
+# Wi-Fi connect timeouts in seconds. The cached-lease path is retried with a
+# full scan and DHCP if it doesn't associate quickly.
+FAST_WIFI_TIMEOUT = 5
+FULL_WIFI_TIMEOUT = 20
+# A cached lease is reused for at most half the router's lease time
+# (secrets["dhcp_lease"], seconds), so its address is never handed to
+# another host while we still use it
+DEFAULT_DHCP_LEASE = 24 * 60 * 60
+
+def woke_from_sleep():
+    """True when sleep_memory still holds what the previous wake stored"""
+    return alarm.wake_alarm is not None
+
+def load_etag():
+    """ETag of the frame on screen, None after a cold boot"""
+    if not woke_from_sleep():
+        return None
+    length = alarm.sleep_memory[SLEEP_ETAG]
+    if not 0 < length < SLEEP_ETAG_SIZE:
+        return None
+    return bytes(alarm.sleep_memory[SLEEP_ETAG + 1:SLEEP_ETAG + 1 + length]).decode()
+
+def save_etag(etag):
+    """Remember the ETag of the frame just displayed (None to forget it)"""
+    data = etag.encode() if etag else b""
+    if len(data) >= SLEEP_ETAG_SIZE:
+        data = b""
+    alarm.sleep_memory[SLEEP_ETAG] = len(data)
+    alarm.sleep_memory[SLEEP_ETAG + 1:SLEEP_ETAG + 1 + len(data)] = data
+
+class Telemetry:
+    """Per-phase wake timings and free memory, uploaded with the next request
+
+    Each phase records its duration in milliseconds and gc.mem_free() in KB
+    when it ends. The record is kept in sleep_memory across deep sleep and
+    sent as telemetry= on the following wake; render_server.py aggregates
+    it per device. The phases:
+
+        wifi         association (and DHCP after a full connect)
+        orientation  accelerometer read, or the cached orientation
+        setup        socket pool and TLS context, no network traffic yet
+        request      TCP connect, TLS handshake, the request and the response
+                     headers; adafruit_requests connects inside get()
+        body         the body streaming in, decoded (or unpacked) as it arrives
+        refresh      the EPD refresh, including any wait for the panel
+    """
+    PHASES = ("wifi", "orientation", "setup", "request", "body", "refresh")
+    VERSION = 1
+    FORMAT = "<B6H6H"
+
+    def __init__(self):
+        self.ms = [0] * len(self.PHASES)
+        self.mem = [0] * len(self.PHASES)
+        self.started = time.monotonic_ns()
+
+    def start(self):
+        self.started = time.monotonic_ns()
+
+    def stop(self, phase):
+        """End a phase started with start() and begin timing the next one"""
+        now = time.monotonic_ns()
+        i = self.PHASES.index(phase)
+        # At least 1: telemetry.py reads 0 as "phase didn't run"
+        self.ms[i] = min(max(1, (now - self.started) // 1000000), 0xFFFF)
+        self.mem[i] = min(gc.mem_free() // 1024, 0xFFFF)
+        print(f"{phase}: {self.ms[i]} ms, {self.mem[i]} KB free")
+        self.started = time.monotonic_ns()
+
+    def save(self):
+        record = struct.pack(self.FORMAT, self.VERSION, *self.ms, *self.mem)
+        alarm.sleep_memory[SLEEP_TELEMETRY:SLEEP_TELEMETRY + len(record)] = record
+
+    @classmethod
+    def load_previous(cls):
+        """Query parameter value for the previous wake's record, None after a cold boot"""
+        if not woke_from_sleep():
+            return None
+        size = struct.calcsize(cls.FORMAT)
+        values = struct.unpack(cls.FORMAT, alarm.sleep_memory[SLEEP_TELEMETRY:SLEEP_TELEMETRY + size])
+        if values[0] != cls.VERSION:
+            return None
+        return ",".join(str(value) for value in values[1:])
+
+TELEMETRY = Telemetry()
+
+def local_time(http_date, timezone_offset):
+    """(hour, minute) of an HTTP Date header ('Sat, 17 Oct 2026 07:12:00 GMT') in local time, None without one"""
+    try:
+        hour, minute = http_date.split(" ")[4].split(":")[:2]
+        return (int(hour) + timezone_offset) % 24, int(minute)
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+class OfflineCache:
+    """The last good frame and the run of failed wakes, kept for when the server can't be reached
+
+    A successful wake stores the RLE frame or forecast summary it showed,
+    with the local time it was fetched. After a failed wake (no Wi-Fi, no
+    or bad response) the frame is shown again marked "stale since HH:MM"
+    instead of an error, and the wake after that comes RETRY_SLEEP later,
+    twice as long for every further failure. A summary is moved on by the
+    hours that have passed since, while its hourly forecast lasts.
+
+    Everything lives in sleep_memory: CIRCUITPY is read-only to code.py,
+    and an RLE frame (2-3 KB) or a summary fits. BMP frames don't and
+    are not kept.
+    """
+    FORMAT = "<BBBBBBHI"  # failures, kind, shown, orientation, hour, minute, length, seconds since fetched
+    NONE, FRAME, SUMMARY = 0, 1, 2
+    NO_TIME = 255
+
+    def __init__(self):
+        self.failures, self.kind, self.shown, self.orientation = 0, self.NONE, 0, 0
+        self.hour, self.minute, self.length, self.age = self.NO_TIME, 0, 0, 0
+        if woke_from_sleep():
+            size = struct.calcsize(self.FORMAT)
+            (self.failures, self.kind, self.shown, self.orientation, self.hour, self.minute,
+             self.length, self.age) = struct.unpack(self.FORMAT, alarm.sleep_memory[SLEEP_OFFLINE:SLEEP_OFFLINE + size])
+            if self.length > self.capacity():
+                self.kind = self.NONE
+
+    @staticmethod
+    def capacity():
+        return len(alarm.sleep_memory) - SLEEP_OFFLINE_DATA
+
+    def save(self):
+        record = struct.pack(self.FORMAT, self.failures, self.kind, self.shown, self.orientation,
+                             self.hour, self.minute, self.length, self.age)
+        alarm.sleep_memory[SLEEP_OFFLINE:SLEEP_OFFLINE + len(record)] = record
+
+    def fetched(self, fetched_at):
+        """A good response came in: the run of failures ends and the cached frame is current again"""
+        self.failures = self.shown = self.age = 0
+        self.hour, self.minute = fetched_at or (self.NO_TIME, 0)
+
+    def store(self, kind, data, orientation, fetched_at):
+        """Keep the frame (FRAME) or summary (SUMMARY) that is about to be shown, None if it can't be"""
+        self.fetched(fetched_at)
+        if data is None or len(data) > self.capacity():
+            self.kind = self.NONE
+            return
+        alarm.sleep_memory[SLEEP_OFFLINE_DATA:SLEEP_OFFLINE_DATA + len(data)] = data
+        self.kind, self.length = kind, len(data)
+        self.orientation = ORIENTATIONS.index(orientation) if orientation in ORIENTATIONS else 0
+
+    def data(self):
+        return bytes(alarm.sleep_memory[SLEEP_OFFLINE_DATA:SLEEP_OFFLINE_DATA + self.length])
+
+    def failed(self):
+        """Count a failed wake and return how long to sleep before the next try"""
+        self.failures = min(self.failures + 1, 255)
+        return min(RETRY_SLEEP * 2 ** min(self.failures - 1, 16), MAX_SLEEP)
+
+    def slept(self, seconds):
+        """Age the cached frame by the coming deep sleep and save the record"""
+        self.age = min(self.age + seconds, 0xFFFFFFFF)
+        self.save()
+
+    def note(self):
+        if self.hour == self.NO_TIME:
+            return "stale"
+        return f"stale since {self.hour:02d}:{self.minute:02d}"
+
+class DisplayCoordinator:
+    """Collects the screen changes of a wake and shows them with one refresh
+
+    An EPD refresh takes seconds and much of a wake's energy, and the panel
+    refuses another one until display.time_to_refresh has passed. The new
+    frame and any overlays (error messages) are only recorded as they come
+    up; flush() at the end of the wake puts them together, waits out
+    time_to_refresh in light sleep if the panel isn't ready, and refreshes
+    once, with Wi-Fi already off.
+    """
+
+    def __init__(self):
+        self.frame = None
+        self.etag = None
+        self.rotation = PANEL_ROTATION
+        self.overlays = []
+
+    def show(self, group, etag=None, rotation=PANEL_ROTATION):
+        """Replace the screen with group, drawn for rotation; etag is saved once it is on screen"""
+        self.frame = group
+        self.etag = etag
+        self.rotation = rotation
+
+    def overlay(self, group):
+        """Draw group on top of the new frame, or of what is on screen without one"""
+        self.overlays.append(group)
+
+    def flush(self):
+        """Refresh once with everything collected, True if the screen changed"""
+        if self.frame is None and not self.overlays:
+            return False
+        display = board.DISPLAY
+        root = self.frame
+        if root is None:
+            root = display.root_group if isinstance(display.root_group, displayio.Group) else displayio.Group()
+        else:
+            display.rotation = self.rotation
+        for group in self.overlays:
+            root.append(group)
+        display.root_group = root
+
+        wait = display.time_to_refresh
+        if wait > 0:
+            print(f"Display busy, waiting {wait:.1f}s")
+            alarm.light_sleep_until_alarms(alarm.time.TimeAlarm(monotonic_time=time.monotonic() + wait))
+        display.refresh()
+        # An overlay hides part of the frame, so the screen matches no ETag any more
+        save_etag(None if self.overlays else self.etag)
+        self.frame, self.etag, self.overlays = None, None, []
+        self.rotation = PANEL_ROTATION
+        return True
+
+DISPLAY = DisplayCoordinator()
+OFFLINE = OfflineCache()
+
+def device_id():
+    """Stable id for this board, secrets["device_id"] or the Wi-Fi MAC address"""
+    return secrets.get("device_id") or "".join(f"{b:02x}" for b in wifi.radio.mac_address)
+
+RLE_MAGIC = b"MTR1"
+SUMMARY_MAGIC = b"MTS1"  # weather_summary.MAGIC
+
+class RleDecoder:
+    """Streams an MTR1 run-length frame (see frame_codec.encode_rle) into a Bitmap
+
+    Each run byte is (palette index << 6) | (length - 1) and runs never
+    cross rows. The bitmap starts out as index 0 (white), so only the
+    non-white runs have to be written.
+    """
+
+    def __init__(self, bitmap):
+        self.bitmap = bitmap
+        self.header = bytearray()
+        self.palette = None
+        self.x = 0
+        self.y = 0
+
+    def feed(self, data):
+        if self.palette is None:
+            self.header.extend(data)
+            if len(self.header) < 9:
+                return
+            colors = self.header[8]
+            header_size = 9 + 3 * colors
+            if len(self.header) < header_size:
+                return
+            width = self.header[4] | self.header[5] << 8
+            height = self.header[6] | self.header[7] << 8
+            if width != self.bitmap.width or height != self.bitmap.height:
+                raise ValueError(f"Frame is {width}x{height}, expected {self.bitmap.width}x{self.bitmap.height}")
+            self.palette = displayio.Palette(colors)
+            for i in range(colors):
+                r, g, b = self.header[9 + 3 * i:12 + 3 * i]
+                self.palette[i] = (r << 16) | (g << 8) | b
+            data = self.header[header_size:]
+            self.header = None
+
+        bitmap = self.bitmap
+        width = bitmap.width
+        x, y = self.x, self.y
+        for run in data:
+            length = (run & 0x3F) + 1
+            if run >> 6:
+                bitmaptools.fill_region(bitmap, x, y, x + length, y + 1, run >> 6)
+            x += length
+            if x >= width:
+                x = 0
+                y += 1
+        self.x, self.y = x, y
+
+    def finish(self):
+        """Return the palette once the whole frame has been decoded"""
+        if self.palette is None or self.y != self.bitmap.height:
+            raise ValueError(f"Truncated frame, got {self.y} rows")
+        return self.palette
+
+class BmpDecoder:
+    """Streams an indexed BMP into a Bitmap
+
+    Handles uncompressed 1, 2, 4 and 8 bit files (render_server.py) and
+    RLE8, which is what GD's imagebmp() writes for php/index.php. Rows are
+    assembled in one reused buffer and copied into the bitmap as soon as
+    they are complete, so the file itself is never held in memory.
+    """
+
+    def __init__(self, bitmap):
+        self.bitmap = bitmap
+        self.header = bytearray()
+        self.palette = None
+        self.line = 0      # rows done, counted in file order
+        self.x = 0         # RLE8 position within the current row
+        self.filled = 0    # bytes of the current row collected so far
+        self.pending = b""
+
+    def _start(self):
+        """Parse the headers once the pixel data offset has been reached"""
+        header = self.header
+        if len(header) < 54:
+            return None
+        if header[:2] != b"BM":
+            raise ValueError("Not a BMP or MTR1 frame")
+        offset = struct.unpack_from("<I", header, 10)[0]
+        if len(header) < offset:
+            return None
+
+        info_size, width, height, _, bits, compression = struct.unpack_from("<IiiHHI", header, 14)
+        colors = struct.unpack_from("<I", header, 46)[0] or 1 << bits
+        self.top_down = height < 0
+        height = abs(height)
+        if width != self.bitmap.width or height != self.bitmap.height:
+            raise ValueError(f"Frame is {width}x{height}, expected {self.bitmap.width}x{self.bitmap.height}")
+        if colors > 4 or compression not in (0, 1) or (compression == 1 and bits != 8):
+            raise ValueError(f"Unsupported BMP: {bits} bit, {colors} colors, compression {compression}")
+
+        self.palette = displayio.Palette(colors)
+        for i in range(colors):
+            b, g, r = header[14 + info_size + 4 * i:17 + info_size + 4 * i]
+            self.palette[i] = (r << 16) | (g << 8) | b
+
+        self.bits = bits
+        self.rle = compression == 1
+        self.stride = (width * bits + 31) // 32 * 4
+        self.row = bytearray(self.stride)
+        if bits == 8:
+            self.pixels = self.row
+        else:
+            # Pixel values of every packed byte, so rows are unpacked a byte at a
+            # time instead of a pixel at a time; padded to whole bytes
+            per_byte = 8 // bits
+            mask = (1 << bits) - 1
+            self.unpacked = [bytes([(value >> (8 - bits - i * bits)) & mask for i in range(per_byte)])
+                             for value in range(256)]
+            self.pixels = bytearray(self.stride * per_byte)
+        data = header[offset:]
+        self.header = None
+        return data
+
+    def _y(self):
+        return self.line if self.top_down else self.bitmap.height - 1 - self.line
+
+    def feed(self, data):
+        if self.palette is None:
+            self.header.extend(data)
+            data = self._start()
+            if data is None:
+                return
+        if self.rle:
+            self._feed_rle(data)
+        else:
+            self._feed_rows(data)
+
+    def _feed_rows(self, data):
+        stride = self.stride
+        pos = 0
+        while pos < len(data) and self.line < self.bitmap.height:
+            n = min(stride - self.filled, len(data) - pos)
+            self.row[self.filled:self.filled + n] = data[pos:pos + n]
+            self.filled += n
+            pos += n
+            if self.filled == stride:
+                self._write_row()
+                self.filled = 0
+                self.line += 1
+
+    def _write_row(self):
+        width = self.bitmap.width
+        if self.bits != 8:
+            per_byte = 8 // self.bits
+            unpacked, pixels = self.unpacked, self.pixels
+            x = 0
+            for value in self.row:
+                pixels[x:x + per_byte] = unpacked[value]
+                x += per_byte
+        y = self._y()
+        bitmaptools.arrayblit(self.bitmap, memoryview(self.pixels)[:width], 0, y, width, y + 1)
+
+    def _feed_rle(self, data):
+        buf = self.pending + data if self.pending else data
+        width, height = self.bitmap.width, self.bitmap.height
+        i = 0
+        while i + 1 < len(buf) and self.line < height:
+            count, value = buf[i], buf[i + 1]
+            if count:
+                # Encoded run; untouched pixels are already index 0
+                end = min(self.x + count, width)
+                if value and end > self.x:
+                    y = self._y()
+                    bitmaptools.fill_region(self.bitmap, self.x, y, end, y + 1, value)
+                self.x += count
+                i += 2
+            elif value == 0:  # end of line
+                self.x = 0
+                self.line += 1
+                i += 2
+            elif value == 1:  # end of bitmap
+                self.line = height
+                i += 2
+            elif value == 2:  # delta
+                if i + 4 > len(buf):
+                    break
+                self.x += buf[i + 2]
+                self.line += buf[i + 3]
+                i += 4
+            else:  # absolute run of `value` literal pixels, padded to 16 bits
+                size = 2 + value + (value & 1)
+                if i + size > len(buf):
+                    break
+                end = min(self.x + value, width)
+                if end > self.x:
+                    y = self._y()
+                    bitmaptools.arrayblit(self.bitmap, buf[i + 2:i + 2 + end - self.x], self.x, y, end, y + 1)
+                self.x += value
+                i += size
+        self.pending = bytes(buf[i:])
+
+    def finish(self):
+        """Return the palette once the whole frame has been decoded"""
+        # RLE8 files may stop at the last row without an end-of-line marker
+        if self.palette is None or self.line < self.bitmap.height - (1 if self.rle and self.x else 0):
+            raise ValueError(f"Truncated frame, got {self.line} rows")
+        return self.palette
+
+def next_wake(response):
+    """Seconds to sleep as suggested by the server, DEFAULT_SLEEP if it had no opinion"""
+    try:
+        seconds = int(response.headers.get("x-next-wake", DEFAULT_SLEEP))
+    except ValueError:
+        return DEFAULT_SLEEP
+    return min(max(seconds, MIN_SLEEP), MAX_SLEEP)
+
+WIFI_CACHE_FORMAT = "<IB6s4s4s4s4s"  # seconds since DHCP, channel, bssid, ip, netmask, gateway, dns
+
+def load_wifi_cache():
+    """(age, channel, bssid, ip, netmask, gateway, dns) of the last connection, None if unusable"""
+    if not woke_from_sleep():
+        return None
+    size = struct.calcsize(WIFI_CACHE_FORMAT)
+    cache = struct.unpack(WIFI_CACHE_FORMAT, alarm.sleep_memory[SLEEP_WIFI:SLEEP_WIFI + size])
+    age, channel = cache[0], cache[1]
+    if channel == 0 or age >= secrets.get("dhcp_lease", DEFAULT_DHCP_LEASE) // 2:
+        return None
+    return cache
+
+def save_wifi_cache(age):
+    """Remember the access point and lease we are connected to (age=0 after a fresh DHCP)"""
+    radio = wifi.radio
+    record = struct.pack(
+        WIFI_CACHE_FORMAT, age, radio.ap_info.channel, bytes(radio.ap_info.bssid),
+        radio.ipv4_address.packed, radio.ipv4_subnet.packed, radio.ipv4_gateway.packed,
+        radio.ipv4_dns.packed,
+    )
+    alarm.sleep_memory[SLEEP_WIFI:SLEEP_WIFI + len(record)] = record
+
+def forget_wifi_cache():
+    alarm.sleep_memory[SLEEP_WIFI + 4] = 0  # channel
+
+def age_wifi_cache(seconds):
+    """Add the coming deep sleep to the age of the cached lease"""
+    age = struct.unpack("<I", alarm.sleep_memory[SLEEP_WIFI:SLEEP_WIFI + 4])[0]
+    alarm.sleep_memory[SLEEP_WIFI:SLEEP_WIFI + 4] = struct.pack("<I", min(age + seconds, 0xFFFFFFFF))
 
 def connect_wifi():
-    """Connect to WiFi network"""
+    """Connect to WiFi network
+
+    After a deep sleep the access point's channel and BSSID and the previous
+    DHCP lease are reused, which skips the scan and DHCP, until half the
+    lease time has passed. If that fails the normal scan + DHCP connection
+    is tried.
+    """
+    started = time.monotonic()
+    cache = load_wifi_cache()
+    if cache:
+        age, channel, bssid, ip, netmask, gateway, dns = cache
+        connected = False
+        try:
+            print(f"Reconnecting to {secrets['ssid']} on channel {channel}...")
+            wifi.radio.set_ipv4_address(
+                ipv4=ipaddress.IPv4Address(ip), netmask=ipaddress.IPv4Address(netmask),
+                gateway=ipaddress.IPv4Address(gateway), ipv4_dns=ipaddress.IPv4Address(dns),
+            )
+            wifi.radio.connect(secrets["ssid"], secrets["password"], channel=channel, bssid=bssid,
+                               timeout=FAST_WIFI_TIMEOUT)
+            connected = True
+        except Exception as e:
+            print(f"Fast reconnect failed: {e}")
+            forget_wifi_cache()
+            wifi.radio.start_dhcp()
+        if connected:
+            # The lease keeps aging, reusing it doesn't renew it
+            save_wifi_cache(age)
+            print(f"Connected with cached lease in {time.monotonic() - started:.2f}s, IP: {wifi.radio.ipv4_address}")
+            return True
+
     try:
         print(f"Connecting to {secrets['ssid']}...")
-        wifi.radio.connect(secrets["ssid"], secrets["password"])
-        print(f"Connected! IP: {wifi.radio.ipv4_address}")
-        return True
+        wifi.radio.connect(secrets["ssid"], secrets["password"], timeout=FULL_WIFI_TIMEOUT)
     except Exception as e:
         print(f"WiFi failed: {e}")
+        forget_wifi_cache()
         return False
+    save_wifi_cache(0)
+    print(f"Connected in {time.monotonic() - started:.2f}s, IP: {wifi.radio.ipv4_address}")
+    return True
+
+ORIENTATIONS = ("landscape_left", "landscape_right", "portrait_up", "portrait_left")
+LIS3DH_ADDRESSES = (0x18, 0x19)  # 0x18 is default, 0x19 is alternate
+
+# LIS3DH registers for the orientation-change interrupt on INT1
+LIS3DH_CTRL_REG1 = 0x20
+LIS3DH_CTRL_REG3 = 0x22
+LIS3DH_INT1_CFG = 0x30
+LIS3DH_INT1_SRC = 0x31
+LIS3DH_INT1_THS = 0x32
+LIS3DH_INT1_DURATION = 0x33
+
+def load_orientation():
+    """(LIS3DH address, orientation) found by an earlier wake, None for unknown"""
+    if not woke_from_sleep():
+        return None, None
+    address, index = alarm.sleep_memory[SLEEP_ORIENTATION:SLEEP_ORIENTATION + 2]
+    address = address if address in LIS3DH_ADDRESSES else None
+    orientation = ORIENTATIONS[index - 1] if 0 < index <= len(ORIENTATIONS) else None
+    return address, orientation
+
+def save_orientation(address, orientation):
+    index = ORIENTATIONS.index(orientation) + 1 if orientation in ORIENTATIONS else 0
+    alarm.sleep_memory[SLEEP_ORIENTATION:SLEEP_ORIENTATION + 2] = bytes((address or 0, index))
+
+def woke_from_rotation():
+    """True when the accelerometer's orientation-change interrupt woke us"""
+    return isinstance(alarm.wake_alarm, alarm.pin.PinAlarm)
+
+def write_registers(i2c, address, registers):
+    """Write (register, value) pairs to an I2C device"""
+    while not i2c.try_lock():
+        pass
+    try:
+        for register, value in registers:
+            i2c.writeto(address, bytes((register, value)))
+    finally:
+        i2c.unlock()
+
+def arm_orientation_interrupt(i2c, address):
+    """Raise INT1 when the board is turned to another side (LIS3DH 6D movement recognition)"""
+    write_registers(i2c, address, (
+        (LIS3DH_CTRL_REG1, 0x2F),      # 10 Hz, low-power mode, X/Y/Z enabled
+        (LIS3DH_CTRL_REG3, 0x40),      # IA1 interrupt on INT1
+        (LIS3DH_INT1_THS, 0x20),       # ~0.5 g at the default +-2 g scale
+        (LIS3DH_INT1_DURATION, 0x05),  # held for 0.5 s, ignores taps and bumps
+        (LIS3DH_INT1_CFG, 0x7F),       # 6D movement on all six directions
+    ))
+    # Reading INT1_SRC clears a pending interrupt, so INT1 is low when we sleep
+    while not i2c.try_lock():
+        pass
+    try:
+        i2c.writeto_then_readfrom(address, bytes((LIS3DH_INT1_SRC,)), bytearray(1))
+    finally:
+        i2c.unlock()
+
+def rotation_wake_pin():
+    """Pin of the accelerometer interrupt, None if the board doesn't expose it or it's disabled"""
+    if not secrets.get("rotation_wake", True):
+        return None
+    return getattr(board, "ACCELEROMETER_INTERRUPT", None)
+
+def orientation_alarm():
+    pin = rotation_wake_pin()
+    return alarm.pin.PinAlarm(pin=pin, value=True, pull=False) if pin else None
 
 def get_orientation():
-    """Detect MagTag orientation using accelerometer"""
+    """Detect MagTag orientation using accelerometer
+
+    The accelerometer is only read after a cold boot or when its
+    orientation-change interrupt woke us; otherwise the orientation
+    stored in sleep_memory is still current. Without the interrupt it is
+    read on every wake, as a rotation would go unnoticed otherwise.
+    """
+    cached_address, cached_orientation = load_orientation()
+    if cached_orientation and rotation_wake_pin() and not woke_from_rotation():
+        return cached_orientation
+
     try:
         import adafruit_lis3dh
         import busio
@@ -45,8 +641,10 @@ def get_orientation():
         # Initialize I2C and accelerometer
         i2c = busio.I2C(board.SCL, board.SDA)
         
-        # Try different I2C addresses that LIS3DH might use
-        addresses_to_try = [0x18, 0x19]  # 0x18 is default, 0x19 is alternate
+        # Try the address that worked last time first
+        addresses_to_try = LIS3DH_ADDRESSES
+        if cached_address:
+            addresses_to_try = (cached_address,) + tuple(a for a in LIS3DH_ADDRESSES if a != cached_address)
         
         lis3dh = None
         for addr in addresses_to_try:
@@ -60,6 +658,7 @@ def get_orientation():
         
         if lis3dh is None:
             print("Could not find accelerometer at any address")
+            i2c.deinit()
             return "landscape_left"
         
         # Get acceleration values
@@ -74,14 +673,26 @@ def get_orientation():
         
         if abs(y) > abs(x):
             if y > 0:
-                return "landscape_right"  # USB port on right (y+ = gravity pulling right)
+                orientation = "landscape_right"  # USB port on right (y+ = gravity pulling right)
             else:
-                return "landscape_left"   # USB port on left (y- = gravity pulling left)
+                orientation = "landscape_left"   # USB port on left (y- = gravity pulling left)
         else:
             if x > 0:
-                return "portrait_left"    # USB port on top (x+ = gravity pulling down in portrait)
+                orientation = "portrait_left"    # USB port on top (x+ = gravity pulling down in portrait)
             else:
-                return "portrait_up"      # USB port on bottom (x- = gravity pulling up in portrait)
+                orientation = "portrait_up"      # USB port on bottom (x- = gravity pulling up in portrait)
+
+        armed = False
+        if rotation_wake_pin():
+            try:
+                arm_orientation_interrupt(i2c, addr)
+                armed = True
+            except Exception as e:
+                print(f"Could not arm orientation interrupt: {e}")
+        i2c.deinit()
+        # Only cached when a rotation is guaranteed to wake us
+        save_orientation(addr, orientation if armed else None)
+        return orientation
                 
     except ImportError:
         print("adafruit_lis3dh library not available")
@@ -90,77 +701,333 @@ def get_orientation():
         print(f"Could not read orientation: {e}")
         return "landscape_left"  # Default orientation
 
+# Local rendering (frame_format = "summary"), same layout as dev_weather.py
+FONT_FILE = "/Roboto-Regular-25.bdf"
+BIG_FONT_FILE = "/Roboto-Regular-50.bdf"
+ICON_DIR = "/icons"
+BLACK = 0x000000
+GREY = 0x555555  # the shade dev_weather's 50% grey is quantized to
+HISTOGRAM_HEIGHT = 12
+HISTOGRAM_COLUMN = 8  # pixels per hour
+DAY_NAMES = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+MONTH_NAMES = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+def get_weather_data(data, chunks, signer=None):
+    """Read the rest of a forecast summary response and unpack it, see weather_summary.py"""
+    import weather_summary
+    for chunk in chunks:
+        if signer:
+            signer.update(chunk)
+        data.extend(chunk)
+    return weather_summary.unpack(data)
+
+def get_current_date(date):
+    """Three-line date for the left column, e.g. 'Mon\n13\nApr'"""
+    weekday, day, month = date
+    return f"{DAY_NAMES[weekday % 7]}\n{day}\n{MONTH_NAMES[(month - 1) % 12]}"
+
+def get_battery_icon_name(voltage, bars):
+    """Battery icon in /icons for a voltage and the server's 0-6 bar estimate"""
+    if voltage < 3.3:
+        return "battery_alert_90deg"
+    if voltage >= 4.1:
+        return "battery_full_90deg"
+    return f"battery_{bars}_bar_90deg"
+
+def format_runtime(hours):
+    """Estimated runtime left, e.g. '~26d' or '~9h'"""
+    return f"~{hours // 24}d" if hours >= 24 else f"~{hours}h"
+
+def draw_histogram(bitmap, hourly_data, histogram_x, histogram_y):
+    """16-hour temperature (grey) and precipitation (black) bars, as in dev_weather._draw_histogram"""
+    if not hourly_data:
+        return
+    temps = [hour["temp"] for hour in hourly_data]
+    temp_min, temp_max = min(temps), max(temps)
+    temp_range = temp_max - temp_min if temp_max != temp_min else 1
+    temp_mid = (temp_min + temp_max) / 2
+    precip_max = max(hour["precip"] for hour in hourly_data)
+    precip_max = precip_max if precip_max > 0 else 1
+    mid_y = histogram_y + HISTOGRAM_HEIGHT // 2
+    bottom = histogram_y + HISTOGRAM_HEIGHT
+
+    for i, hour in enumerate(hourly_data):
+        x = histogram_x + i * HISTOGRAM_COLUMN
+        temp_offset = (hour["temp"] - temp_mid) / temp_range * (HISTOGRAM_HEIGHT / 2)
+        if temp_offset > 0:
+            top = max(histogram_y, int(mid_y - temp_offset))
+            if top < mid_y:
+                bitmaptools.fill_region(bitmap, x, top, x + HISTOGRAM_COLUMN, mid_y + 1, 2)
+        else:
+            end = min(bottom, int(mid_y - temp_offset))
+            if end > mid_y:
+                bitmaptools.fill_region(bitmap, x, mid_y, x + HISTOGRAM_COLUMN, min(end + 1, bitmap.height), 2)
+
+    # Precipitation on top, 4 pixels wide from the bottom
+    for i, hour in enumerate(hourly_data):
+        if hour["precip"] > 0:
+            x = histogram_x + i * HISTOGRAM_COLUMN
+            height = max(1, int(hour["precip"] / precip_max * HISTOGRAM_HEIGHT))
+            bitmaptools.fill_region(bitmap, x, bottom - height, x + 4, bottom, 3)
+
+def orientation_rotation(orientation):
+    """display.rotation for a summary drawn in orientation
+
+    Portrait gets the same quarter turn dev_weather._rotate_for_orientation
+    gives server frames; landscape stays at PANEL_ROTATION.
+    """
+    if orientation == "portrait_up":
+        return (PANEL_ROTATION + 90) % 360
+    if orientation.startswith("portrait"):
+        return (PANEL_ROTATION + 270) % 360
+    return PANEL_ROTATION
+
+def create_weather_display(summary, battery_voltage, orientation, note=None):
+    """Compose the frame for a forecast summary from the icons and fonts on CIRCUITPY
+
+    note replaces the "updated: HH:MM" text, see show_stale_frame. A
+    downloaded summary is drawn with its own battery_voltage, so a 304 for
+    its ETag never leaves an outdated voltage on screen.
+    """
+    from adafruit_bitmap_font import bitmap_font
+    from adafruit_display_text import label
+
+    display = board.DISPLAY
+    portrait = orientation.startswith("portrait")
+    # Absolute, so a summary drawn earlier in the wake doesn't turn this one further
+    display.rotation = orientation_rotation(orientation)
+    width, height = display.width, display.height
+
+    # Background and histogram, in the frame palette
+    canvas = displayio.Bitmap(width, height, 4)
+    palette = displayio.Palette(4)
+    for i, color in enumerate((0xFFFFFF, 0xAAAAAA, 0x555555, 0x000000)):
+        palette[i] = color
+    group = displayio.Group()
+    group.append(displayio.TileGrid(canvas, pixel_shader=palette))
+
+    def add_icon(name, x, y):
+        try:
+            icon = displayio.OnDiskBitmap(f"{ICON_DIR}/{name}.bmp")
+            group.append(displayio.TileGrid(icon, pixel_shader=icon.pixel_shader, x=x, y=y))
+            return True
+        except OSError as e:
+            print(f"Could not load icon {name}: {e}")
+            return False
+
+    def add_text(font, text, color, x, y, anchor=(0, 0)):
+        group.append(label.Label(font, text=text, color=color, anchor_point=anchor, anchored_position=(x, y)))
+
+    font = bitmap_font.load_font(FONT_FILE)
+    big_font = bitmap_font.load_font(BIG_FONT_FILE)
+    icon_name = summary["icon_name"] or "unknown"
+    icon_x = 0 if portrait else 50
+    if not add_icon(icon_name, icon_x, -8):
+        add_text(terminalio.FONT, f"ERROR:\n{icon_name}\nIcon not found.", BLACK, icon_x + 4, 20)
+
+    date_lines = get_current_date(summary["date"]).split("\n")
+    high = f"{summary['max_temperature']:.1f}º"
+    low = f"{summary['min_temperature']:.1f}º"
+    if portrait:
+        add_text(big_font, high, BLACK, 4, 118)
+        add_text(big_font, low, GREY, 4, 170)
+        add_text(font, " ".join(date_lines), BLACK, width // 2, 228, (0.5, 0))
+        draw_histogram(canvas, summary["hourly_data"], 0, 256)
+    else:
+        for i, line in enumerate(date_lines):
+            add_text(font, line, BLACK, 25, 13 + i * int(25 * 1.35), (0.5, 0))
+        add_text(big_font, high, BLACK, 175, 7)
+        add_text(big_font, low, GREY, 175, 72)
+        draw_histogram(canvas, summary["hourly_data"], icon_x, height - HISTOGRAM_HEIGHT)
+
+    # Status row: battery bottom left, update time bottom right (above it in portrait)
+    add_icon(get_battery_icon_name(battery_voltage, summary["battery_bars"]), 2, height - 14)
+    battery_text = f"{battery_voltage:.1f}V"
+    if portrait:
+        battery_text += " " + format_runtime(summary["battery_hours"])
+    add_text(terminalio.FONT, battery_text, BLACK if summary["battery_warning"] else GREY, 22, height - 12)
+    updated = summary["updated"]
+    updated_text = note or "updated: " + (f"{updated[0]:02d}:{updated[1]:02d}" if updated else "??:??")
+    updated_x = width - 6 * len(note) - 4 if note else width - 90  # the terminal font is 6 pixels wide
+    add_text(terminalio.FONT, updated_text, BLACK if note else GREY, updated_x, height - 24 if portrait else height - 12)
+    return group
+
+def read_battery_voltage():
+    battery_voltage = 3.8  # Default value
+    try:
+        import analogio
+        battery_pin = analogio.AnalogIn(board.BATTERY)
+        # Convert ADC reading to voltage (MagTag specific calculation)
+        battery_voltage = (battery_pin.value * 3.3) / 65536 * 2
+        battery_pin.deinit()
+    except Exception as e:
+        print(f"Could not read battery voltage: {e}")
+    return battery_voltage
+
 def download_and_display_image():
-    """Download BMP image from PHP endpoint and display it"""
+    """Download the frame from the PHP endpoint and display it
+
+    With frame_format = "summary" the server sends a packed forecast
+    summary instead, and the frame is composed here. Returns the number
+    of seconds to sleep afterwards, None on failure.
+    """
     try:
-        from adafruit_display_text import label
+        # Frames are allocated before any network buffers, the decoders write straight into them
+        gc.collect()
+        print(f"Free memory before download: {gc.mem_free()}")
+        frame_format = secrets.get("frame_format", "rle")
+        bitmap = None
+        if frame_format != "summary":
+            bitmap = displayio.Bitmap(DISPLAY_WIDTH, DISPLAY_HEIGHT, 4)
+
         # Get location and battery info
         lat = secrets.get("latitude", 52.5)
         lon = secrets.get("longitude", 13.45)
         timezone_offset = secrets.get("timezone_offset", 0)
 
-        # Get battery voltage
-        battery_voltage = 3.8  # Default value
-        try:
-            import analogio
-            battery_pin = analogio.AnalogIn(board.BATTERY)
-            # Convert ADC reading to voltage (MagTag specific calculation)
-            battery_voltage = (battery_pin.value * 3.3) / 65536 * 2
-            battery_pin.deinit()
-        except Exception as e:
-            print(f"Could not read battery voltage: {e}")
+        battery_voltage = read_battery_voltage()
 
         # Get orientation
+        TELEMETRY.start()
         orientation = get_orientation()
+        TELEMETRY.stop("orientation")
         print(f"Detected orientation: {orientation}")
 
-        # Build URL for PHP endpoint (using %.2f for precision)
-        php_url = secrets.get("php_endpoint", "https://krets.com/magtag/")
-        url = f"{php_url}?lat={lat}&lon={lon}&battery={battery_voltage:.2f}&timezone={timezone_offset:+d}&orientation={orientation}"
+        # Build the query (using %.2f for precision). format=rle asks for a
+        # run-length frame; servers that don't know it send a BMP instead.
+        query = f"lat={lat}&lon={lon}&battery={battery_voltage:.2f}&timezone={timezone_offset:+d}&orientation={orientation}&format={frame_format}&device={device_id()}"
+        previous = Telemetry.load_previous()
+        if previous:
+            query += f"&telemetry={previous}"
+
+        # LAN mode: plain HTTP to a render_server.py on the local network,
+        # with the query and the response signed by a pre-shared key instead of TLS
+        lan_key = secrets.get("lan_key")
+        if lan_key and secrets.get("lan_endpoint"):
+            import frame_auth
+            signed_query = frame_auth.sign_query(lan_key, query)
+            url = secrets["lan_endpoint"] + "?" + signed_query
+        else:
+            lan_key = None
+            url = secrets.get("php_endpoint", "https://krets.com/magtag/") + "?" + query
 
         print(f"Downloading image from: {url}")
 
-        # Create HTTP session
+        # Create HTTP session; the connection and TLS handshake happen in get()
+        TELEMETRY.start()
         pool = socketpool.SocketPool(wifi.radio)
-        requests = adafruit_requests.Session(pool, ssl.create_default_context())
+        if lan_key:
+            requests = adafruit_requests.Session(pool)
+        else:
+            import ssl
+            requests = adafruit_requests.Session(pool, ssl.create_default_context())
+        TELEMETRY.stop("setup")
+
+        # Send the ETag of the frame on screen, the server answers 304 if it is unchanged
+        headers = {}
+        etag = load_etag()
+        if etag:
+            headers["If-None-Match"] = etag
+
+        # Download the frame; the body is decoded while it streams in
+        response = requests.get(url, headers=headers)
+        TELEMETRY.stop("request")
 
-        # Download the BMP image
-        response = requests.get(url)
+        sleep_seconds = next_wake(response)
+        new_etag = response.headers.get("etag")
+        fetched_at = local_time(response.headers.get("date"), timezone_offset)
+        signer = None
+        if lan_key:
+            signature = response.headers.get("x-frame-signature", "")
+            signer = frame_auth.response_signer(lan_key, signed_query, new_etag, response.headers.get("x-next-wake"))
+
+        if response.status_code == 304:
+            response.close()
+            if signer and not frame_auth.equal(signer.hexdigest(), signature):
+                print("Bad response signature")
+                return None
+            OFFLINE.fetched(fetched_at)
+            print("Image unchanged, skipping decode and refresh")
+            return sleep_seconds
 
         if response.status_code != 200:
             print(f"HTTP error: {response.status_code}")
-            return False
+            response.close()
+            return None
 
         print("Image downloaded successfully")
 
-        # Get the BMP data
-        bmp_data = response.content
-        response.close()
+        chunks = response.iter_content(chunk_size=512)
+        start = bytearray()
+        for chunk in chunks:
+            start.extend(chunk)
+            if len(start) >= len(RLE_MAGIC):
+                break
+        if signer:
+            signer.update(start)
 
-        bitmap, palette = adafruit_imageload.load(io.BytesIO(bmp_data))
+        if start[:len(SUMMARY_MAGIC)] == SUMMARY_MAGIC:
+            summary = get_weather_data(start, chunks, signer)
+            response.close()
+            TELEMETRY.stop("body")
+            if signer and not frame_auth.equal(signer.hexdigest(), signature):
+                print("Bad summary signature")
+                return None
+            group = create_weather_display(summary, summary["battery_voltage"], orientation)
+            rotation = orientation_rotation(orientation)
+            OFFLINE.store(OfflineCache.SUMMARY, start, orientation, fetched_at)
+        else:
+            # php/index.php ignores format= and always sends a BMP
+            if bitmap is None:
+                gc.collect()
+                bitmap = displayio.Bitmap(DISPLAY_WIDTH, DISPLAY_HEIGHT, 4)
+            kept = None
+            if start[:len(RLE_MAGIC)] == RLE_MAGIC:
+                decoder = RleDecoder(bitmap)
+                kept = start  # the encoded frame, for OfflineCache
+            else:
+                decoder = BmpDecoder(bitmap)
+            decoder.feed(start)
+            start = None
+            for chunk in chunks:
+                if signer:
+                    signer.update(chunk)
+                decoder.feed(chunk)
+                if kept is not None:
+                    kept.extend(chunk)
+                    if len(kept) > OfflineCache.capacity():
+                        kept = None
+            palette = decoder.finish()
+            response.close()
+            TELEMETRY.stop("body")
+            # Checked before anything reaches the screen
+            if signer and not frame_auth.equal(signer.hexdigest(), signature):
+                print("Bad frame signature")
+                return None
 
-        # Create display group
-        tile_grid = displayio.TileGrid(bitmap, pixel_shader=palette)
-        group = displayio.Group()
-        group.append(tile_grid)
+            OFFLINE.store(OfflineCache.FRAME, kept, orientation, fetched_at)
+            # Server frames come already turned for the orientation
+            rotation = PANEL_ROTATION
 
-        # Atomic display update: Only set root and refresh once everything is ready
-        board.DISPLAY.root_group = group
-        board.DISPLAY.refresh()
+            # Create display group
+            tile_grid = displayio.TileGrid(bitmap, pixel_shader=palette)
+            group = displayio.Group()
+            group.append(tile_grid)
 
-        print("Image displayed successfully")
-        return True
+        # Shown with the wake's single refresh, see DisplayCoordinator
+        DISPLAY.show(group, new_etag, rotation)
+        print("Image ready for display")
+        return sleep_seconds
 
     except Exception as e:
         print(f"Error downloading/displaying image: {e}")
-        return False
+        return None
 
 def show_error_message(message):
-    """Display an error message as a non-destructive overlay on the current screen"""
+    """Queue an error message as a non-destructive overlay on the current screen"""
     try:
         from adafruit_display_text import label
-        display = board.DISPLAY
-        
+
         # Create overlay group
         overlay = displayio.Group()
         
@@ -184,41 +1051,143 @@ def show_error_message(message):
             y=y + h // 2
         )
         overlay.append(error_label)
-        
-        # Append to current root if possible, otherwise replace it
-        if isinstance(display.root_group, displayio.Group):
-            display.root_group.append(overlay)
-        else:
-            display.root_group = overlay
-            
-        display.refresh()
-        print(f"Error overlay shown: {message}")
+
+        # Drawn with the wake's single refresh, over the frame on screen
+        DISPLAY.overlay(overlay)
+        print(f"Error overlay queued: {message}")
         
     except Exception as e:
         print(f"Error showing error message: {e}")
 
+def stamp_note(bitmap, text, orientation):
+    """Write text black on white (frame_codec palette 3 on 0) over the "updated" corner of a server frame
+
+    The frame is in panel orientation; portrait frames were turned onto
+    the panel like dev_weather._rotate_for_orientation does.
+    """
+    portrait = orientation.startswith("portrait")
+    width, height = (DISPLAY_HEIGHT, DISPLAY_WIDTH) if portrait else (DISPLAY_WIDTH, DISPLAY_HEIGHT)
+
+    def panel(x, y):
+        if orientation == "portrait_up":
+            return height - 1 - y, x
+        if portrait:
+            return y, width - 1 - x
+        return x, y
+
+    box_width, box_height = 6 * len(text) + 4, 14
+    left, top = width - box_width, height - (26 if portrait else 14)
+    x1, y1 = panel(left, top)
+    x2, y2 = panel(width - 1, top + box_height - 1)
+    bitmaptools.fill_region(bitmap, min(x1, x2), min(y1, y2), max(x1, x2) + 1, max(y1, y2) + 1, 0)
+
+    # Glyphs of the built-in font are tiles in one bitmap
+    x = left + 2
+    for char in text:
+        glyph = terminalio.FONT.get_glyph(ord(char))
+        if glyph is None:
+            continue
+        origin = glyph.tile_index * glyph.width
+        for gy in range(glyph.height):
+            for gx in range(glyph.width):
+                if glyph.bitmap[origin + gx, gy]:
+                    bitmap[panel(x + glyph.dx + gx, top + 1 + gy)] = 3
+        x += glyph.shift_x
+
+def show_stale_frame():
+    """Queue the cached frame marked stale in place of an error, False if there is none
+
+    A forecast summary is moved on by the hours since it was fetched and
+    redrawn whenever that changes; a server frame is only drawn once.
+    """
+    try:
+        note = OFFLINE.note()
+        if OFFLINE.kind == OfflineCache.SUMMARY:
+            import weather_summary
+            summary = weather_summary.unpack(OFFLINE.data())
+            hours = min(OFFLINE.age // 3600, len(summary["hourly_data"]))
+            if OFFLINE.shown == hours + 1:
+                print("Stale forecast already on screen")
+                return True
+            if hours < len(summary["hourly_data"]):
+                summary["temperature"] = summary["hourly_data"][hours]["temp"]
+            summary["hourly_data"] = summary["hourly_data"][hours:]
+            orientation = get_orientation()
+            group = create_weather_display(summary, read_battery_voltage(), orientation, note)
+            rotation = orientation_rotation(orientation)
+            OFFLINE.shown = hours + 1
+        elif OFFLINE.kind == OfflineCache.FRAME:
+            if OFFLINE.shown:
+                print("Stale frame already on screen")
+                return True
+            bitmap = displayio.Bitmap(DISPLAY_WIDTH, DISPLAY_HEIGHT, 4)
+            decoder = RleDecoder(bitmap)
+            decoder.feed(OFFLINE.data())
+            palette = decoder.finish()
+            stamp_note(bitmap, note, ORIENTATIONS[OFFLINE.orientation])
+            group = displayio.Group()
+            group.append(displayio.TileGrid(bitmap, pixel_shader=palette))
+            rotation = PANEL_ROTATION
+            OFFLINE.shown = 1
+        else:
+            return False
+        # No ETag: the next good response is drawn even if the server's frame didn't change
+        DISPLAY.show(group, rotation=rotation)
+        print(f"Stale frame queued ({note})")
+        return True
+    except Exception as e:
+        print(f"Could not show the cached frame: {e}")
+        return False
+
 def main():
     """Main program loop"""
     print("MagTag Image Display Starting...")
+    sleep_seconds = DEFAULT_SLEEP
     
     # Connect to WiFi
-    if not connect_wifi():
-        show_error_message("WiFi connection failed")
-        time.sleep(5)
+    TELEMETRY.start()
+    connected = connect_wifi()
+    TELEMETRY.stop("wifi")
+    error = None
+    if not connected:
+        error = "WiFi connection failed"
     else:
         # Download and display the weather image
-        if not download_and_display_image():
-            show_error_message("Failed to load weather image")
-            time.sleep(5)
+        sleep_seconds = download_and_display_image()
+        if sleep_seconds is None:
+            error = "Failed to load weather image"
         
         # Disconnect WiFi to save power
         wifi.radio.enabled = False
 
-    print("Going to deep sleep...")
+    if error:
+        # No retry now: back off, and show the last good frame rather than the error
+        sleep_seconds = OFFLINE.failed()
+        print(f"{error}, failure {OFFLINE.failures} in a row")
+        if not show_stale_frame():
+            show_error_message(error)
+
+    # Everything this wake changed on screen, in one refresh with the radio off
+    TELEMETRY.start()
+    try:
+        if DISPLAY.flush():
+            TELEMETRY.stop("refresh")
+            print("Display refreshed")
+    except Exception as e:
+        print(f"Display refresh failed: {e}")
+
+    TELEMETRY.save()
+    OFFLINE.slept(sleep_seconds)
+    age_wifi_cache(sleep_seconds)
+    print(f"Going to deep sleep for {sleep_seconds} seconds...")
     
-    # Deep sleep for 3 hours
-    time_alarm = alarm.time.TimeAlarm(monotonic_time=time.monotonic() + 3 * 60 * 60)
-    alarm.exit_and_deep_sleep_until_alarms(time_alarm)
+    time_alarm = alarm.time.TimeAlarm(monotonic_time=time.monotonic() + sleep_seconds)
+    # Turning the board wakes it right away to redraw in the new orientation
+    rotation_alarm = orientation_alarm()
+    if rotation_alarm:
+        alarm.exit_and_deep_sleep_until_alarms(time_alarm, rotation_alarm)
+    else:
+        alarm.exit_and_deep_sleep_until_alarms(time_alarm)
 
 # Run the main program
 if __name__ == "__main__":
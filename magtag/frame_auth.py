@@ -0,0 +1,80 @@
+"""
+HMAC-SHA256 signing shared by the MagTag and render_server.py's LAN mode.
+
+CircuitPython has hashlib but no hmac module, so HMAC is built by hand
+(RFC 2104) and works the same on the board and on the host. The device
+adds a random nonce to its query string, signs it and sends the signature
+as a trailing &sig=; the server refuses a nonce it has seen before. Each
+response is signed over the request's signature, ETag, X-Next-Wake and
+body in X-Frame-Signature, which the device checks chunk by chunk while
+the frame streams in, so a recorded response can't be played back to a
+later wake or to another device.
+"""
+import binascii
+import hashlib
+import os
+
+BLOCK_SIZE = 64  # SHA-256 block size in bytes
+NONCE_SIZE = 8  # random bytes per signed query
+
+
+def _sha256(data=b""):
+    # CircuitPython's hashlib has no sha256() constructor, only new(); the
+    # Espressif port backs "sha256" with mbedtls. adafruit_hashlib covers
+    # builds that only know "sha1".
+    try:
+        return hashlib.new("sha256", data)
+    except ValueError:
+        import adafruit_hashlib
+        return adafruit_hashlib.sha256(data)
+
+
+class HmacSha256:
+    def __init__(self, key, message=b""):
+        if isinstance(key, str):
+            key = key.encode()
+        if len(key) > BLOCK_SIZE:
+            key = _sha256(key).digest()
+        key = key + bytes(BLOCK_SIZE - len(key))
+        self.outer_key = bytes(b ^ 0x5C for b in key)
+        self.inner = _sha256(bytes(b ^ 0x36 for b in key))
+        if message:
+            self.update(message)
+
+    def update(self, data):
+        self.inner.update(data)
+
+    def hexdigest(self):
+        outer = _sha256(self.outer_key)
+        outer.update(self.inner.digest())
+        return binascii.hexlify(outer.digest()).decode()
+
+
+def equal(a, b):
+    """Compare two signatures without returning early on the first difference"""
+    if len(a) != len(b):
+        return False
+    difference = 0
+    for x, y in zip(a, b):
+        difference |= ord(x) ^ ord(y)
+    return difference == 0
+
+
+def sign_query(key, query):
+    """Query string with a fresh nonce, and its signature appended as the last parameter"""
+    query += "&nonce=" + binascii.hexlify(os.urandom(NONCE_SIZE)).decode()
+    return query + "&sig=" + HmacSha256(key, query.encode()).hexdigest()
+
+
+def verify_query(key, signed_query):
+    """The query without its signature if the signature matches, None otherwise"""
+    query, separator, signature = signed_query.rpartition("&sig=")
+    if not separator or not equal(signature, HmacSha256(key, query.encode()).hexdigest()):
+        return None
+    return query
+
+
+def response_signer(key, signed_query, etag, next_wake):
+    """HmacSha256 over the request's signature and a response's ETag and X-Next-Wake, to be fed the body"""
+    signature = signed_query.rpartition("&sig=")[2]
+    return HmacSha256(key, f"{signature}\n{etag or ''}\n{next_wake or ''}\n".encode())
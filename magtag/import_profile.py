@@ -0,0 +1,63 @@
+"""
+Import time and heap per module, measured on the MagTag.
+
+deploy.py --profile puts this on CIRCUITPY. Stop code.py with Ctrl-C,
+press Enter for the REPL, then:
+
+    >>> import import_profile
+
+Every module a wake imports is imported in turn, first the ones at the top
+of code.py, then the ones it imports only on some paths. Each line shows
+the milliseconds the import took and the heap it kept after a collection;
+".py" means the module was compiled from source on the board.
+weather_main is code.py as deploy.py precompiles it; importing it runs
+nothing but its module level. Ctrl-D restarts code.py afterwards.
+"""
+import gc
+import time
+
+AT_START = (
+    "board", "alarm", "wifi", "socketpool", "ipaddress", "displayio", "terminalio",
+    "bitmaptools", "struct", "adafruit_requests", "weather_main",
+)
+ON_DEMAND = (
+    "ssl", "frame_auth", "weather_summary", "analogio", "busio", "adafruit_lis3dh",
+    "adafruit_display_text.label", "adafruit_bitmap_font.bitmap_font",
+)
+
+
+def source_of(name):
+    """'.mpy', '.py' or '' (built into the firmware) for a module just imported"""
+    module = __import__(name)
+    for part in name.split(".")[1:]:
+        module = getattr(module, part)
+    path = getattr(module, "__file__", "")
+    return ".mpy" if path.endswith(".mpy") else ".py" if path.endswith(".py") else ""
+
+
+def profile(names):
+    total_ms = total_kb = 0
+    for name in names:
+        gc.collect()
+        free = gc.mem_free()
+        started = time.monotonic_ns()
+        try:
+            __import__(name)
+        except ImportError as e:
+            print(f"  {name:<36} not available: {e}")
+            continue
+        elapsed = (time.monotonic_ns() - started) / 1000000
+        gc.collect()
+        used = (free - gc.mem_free()) / 1024
+        total_ms += elapsed
+        total_kb += used
+        print(f"  {name:<36} {elapsed:7.1f} ms {used:7.1f} KB  {source_of(name)}")
+    print(f"  {'total':<36} {total_ms:7.1f} ms {total_kb:7.1f} KB")
+
+
+gc.collect()
+print(f"Heap free: {gc.mem_free() // 1024} KB")
+print("Imported on every wake:")
+profile(AT_START)
+print("Imported on demand:")
+profile(ON_DEMAND)
@@ -0,0 +1,75 @@
+"""
+Packed forecast summary for rendering on the MagTag itself.
+
+With frame_format = "summary" in secrets.py the render server sends this
+instead of a frame: everything the display shows, in ~100 bytes, and the
+device composes the frame from the icons and fonts on CIRCUITPY. Shared by
+magtag/code.py (unpack) and dev_weather.py (pack), like frame_auth.py.
+
+    b"MTS1"
+    weekday (0 = Monday), day, month, hour, minute of the forecast update, local time
+    weather icon (index into ICON_NAMES, 255 if unknown)
+    temperature, low, high in 0.1 degC (int16)
+    battery bars (0-6), flags, battery runtime left in hours (uint16), battery voltage in 0.1 V
+    HOURS temperatures in 0.1 degC (int16), then HOURS precipitation amounts in 0.01 mm (uint16)
+
+Everything is little-endian. Flags: bit 0 battery warning, bit 1 update time known.
+The battery voltage is the one the device reported, rounded as it is drawn,
+so the summary's ETag changes whenever the drawn voltage would.
+"""
+import struct
+
+MAGIC = b"MTS1"
+HOURS = 16
+FORMAT = "<4s5BBhhhBBHB%dh%dH" % (HOURS, HOURS)
+SIZE = struct.calcsize(FORMAT)
+
+FLAG_BATTERY_WARNING = 1
+FLAG_UPDATED = 2
+UNKNOWN_ICON = 255
+
+# Weather icons in magtag/icons, in index order. Only ever append.
+DAY_ICONS = (
+    "chanceflurries", "chancerain", "chancesleet", "chancesnow", "chancetstorms", "clear",
+    "cloudy", "flurries", "fog", "hazy", "mostlycloudy", "mostlysunny", "partlycloudy",
+    "partlysunny", "rain", "sleet", "snow", "sunny", "tstorms",
+)
+ICON_NAMES = DAY_ICONS + tuple("nt_" + name for name in DAY_ICONS)
+
+
+def pack(icon_name, temperature, low, high, hourly, updated=None, battery_bars=0,
+         battery_hours=0, battery_warning=False, battery_voltage=0.0):
+    """Summary bytes; hourly is [(temperature, precipitation)], updated (weekday, day, month, hour, minute)"""
+    hourly = (list(hourly) + [(0.0, 0.0)] * HOURS)[:HOURS]
+    icon = ICON_NAMES.index(icon_name) if icon_name in ICON_NAMES else UNKNOWN_ICON
+    flags = (FLAG_BATTERY_WARNING if battery_warning else 0) | (FLAG_UPDATED if updated else 0)
+    return struct.pack(
+        FORMAT, MAGIC, *(updated or (0, 1, 1, 0, 0)), icon,
+        round(temperature * 10), round(low * 10), round(high * 10),
+        battery_bars, flags, min(battery_hours, 0xFFFF), min(round(battery_voltage * 10), 0xFF),
+        *[round(temp * 10) for temp, _ in hourly],
+        *[min(round(precip * 100), 0xFFFF) for _, precip in hourly],
+    )
+
+
+def unpack(data):
+    """Dict of the values in a summary, raises ValueError if it isn't one"""
+    if len(data) < SIZE or data[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not an MTS1 summary")
+    values = struct.unpack_from(FORMAT, data)
+    weekday, day, month, hour, minute, icon = values[1:7]
+    temperature, low, high, bars, flags, hours, decivolts = values[7:14]
+    temps, precips = values[14:14 + HOURS], values[14 + HOURS:]
+    return {
+        "icon_name": ICON_NAMES[icon] if icon < len(ICON_NAMES) else None,
+        "date": (weekday, day, month),
+        "updated": (hour, minute) if flags & FLAG_UPDATED else None,
+        "temperature": temperature / 10,
+        "min_temperature": low / 10,
+        "max_temperature": high / 10,
+        "battery_bars": bars,
+        "battery_hours": hours,
+        "battery_warning": bool(flags & FLAG_BATTERY_WARNING),
+        "battery_voltage": decivolts / 10,
+        "hourly_data": [{"temp": t / 10, "precip": p / 100} for t, p in zip(temps, precips)],
+    }
@@ -0,0 +1,75 @@
+"""
+Local stand-in for api.met.no's locationforecast endpoint.
+
+Serves a saved compact forecast with the caching headers met.no sends
+(Expires, Last-Modified) and answers If-Modified-Since with 304, so
+forecast_cache.py and render_server.py can be exercised offline.
+
+    python met_stand_in.py forecast.json --port 8091 --ttl 60
+    python render_server.py --met-url http://localhost:8091/weatherapi/locationforecast/2.0/compact
+"""
+import argparse
+import json
+import threading
+import time
+import email.utils
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    payload = b"{}"
+    last_modified = 0.0
+    ttl = 60
+    delay = 0.0
+    counts = {"200": 0, "304": 0}
+    lock = threading.Lock()
+
+    def do_GET(self):
+        # Simulated upstream latency, makes request coalescing visible
+        time.sleep(self.delay)
+        expires = email.utils.formatdate(time.time() + self.ttl, usegmt=True)
+        since = self.headers.get("If-Modified-Since")
+        try:
+            not_modified = since and email.utils.parsedate_to_datetime(since).timestamp() >= int(self.last_modified)
+        except (TypeError, ValueError):
+            not_modified = False
+
+        with self.lock:
+            self.counts["304" if not_modified else "200"] += 1
+        self.send_response(304 if not_modified else 200)
+        self.send_header("Expires", expires)
+        self.send_header("Last-Modified", email.utils.formatdate(self.last_modified, usegmt=True))
+        if not_modified:
+            self.end_headers()
+            return
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(self.payload)))
+        self.end_headers()
+        self.wfile.write(self.payload)
+
+    def log_message(self, format, *args):
+        print(f"{self.address_string()} {format % args} counts={self.counts}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for met.no locationforecast")
+    parser.add_argument("forecast", help="saved locationforecast/2.0/compact JSON")
+    parser.add_argument("--port", type=int, default=8091)
+    parser.add_argument("--ttl", type=int, default=60, help="seconds until Expires")
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds before answering")
+    args = parser.parse_args()
+
+    with open(args.forecast) as forecast_file:
+        payload = json.load(forecast_file)
+    StandInHandler.payload = json.dumps(payload).encode()
+    StandInHandler.last_modified = time.time()
+    StandInHandler.ttl = args.ttl
+    StandInHandler.delay = args.delay
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), StandInHandler)
+    print(f"met.no stand-in on http://127.0.0.1:{args.port}/weatherapi/locationforecast/2.0/compact")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -892,7 +892,20 @@ for ($y = 0; $y < $finalHeight; $y++) {
 // Draw border directly on the final image
 imagerectangle($indexed, 0, 0, $finalWidth - 1, $finalHeight - 1, $black);
 
+ob_start();
 imagebmp($indexed);
+$bmp = ob_get_clean();
 imagedestroy($indexed);
 imagedestroy($image);
+
+// Devices send back the ETag of the frame on screen and skip the e-ink
+// refresh when nothing changed
+$etag = '"' . substr(sha1($bmp), 0, 16) . '"';
+header("ETag: {$etag}");
+if (trim($_SERVER['HTTP_IF_NONE_MATCH'] ?? '') === $etag) {
+    http_response_code(304);
+    exit;
+}
+header('Content-Length: ' . strlen($bmp));
+echo $bmp;
 ?>
@@ -0,0 +1,127 @@
+"""
+Pre-render every frame a device at a location could ask for.
+
+When a new forecast lands for a grid cell, render_server.py (started with
+--prerender) hands it to a process pool here, which renders all five
+orientations for every battery bucket (one voltage per distinct icon,
+voltage text and warning state) and puts the results in the frame cache,
+so device requests never wait for a render.
+
+Run on its own it renders a batch of locations and reports throughput:
+
+    python prerender.py forecast.json --locations 52.52,13.41 59.91,10.75 --workers 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import dev_weather
+
+ORIENTATIONS = ("landscape_left", "landscape_right", "portrait_up", "portrait_down", "portrait_left")
+# Devices report the battery with two decimals
+VOLTAGES = tuple(round(2.8 + i / 100, 2) for i in range(141))
+
+
+def battery_buckets(warning_threshold):
+    """One representative voltage per distinct battery rendering"""
+    buckets = {}
+    for voltage in VOLTAGES:
+        buckets.setdefault(dev_weather.battery_bucket(voltage, warning_threshold), voltage)
+    return tuple(buckets.values())
+
+
+def frames_per_profile(profile):
+    """Frames render_location produces for one (timezone, warning_threshold, format) profile"""
+    return len(battery_buckets(profile[1])) * len(ORIENTATIONS)
+
+
+def profile_queries(profile, orientation, voltages, day_range=None):
+    """Device queries for a (timezone, warning_threshold, format) profile"""
+    timezone_offset, warning_threshold, frame_format = profile
+    return [{
+        "battery": voltage, "timezone": timezone_offset, "orientation": orientation,
+        "warning_threshold": warning_threshold, "format": frame_format, "day_range": day_range,
+    } for voltage in voltages]
+
+
+def _init_worker(icon_pack):
+    # The renderer prints progress for every frame
+    sys.stdout = open(os.devnull, "w")
+    dev_weather.ICONS.warm(icon_pack)
+
+
+def render_batch(weather_data, queries):
+    """Encoded frames for queries of one location, run in a worker process"""
+    return [dev_weather.render_frame(weather_data, q["battery"], q["timezone"], q["orientation"],
+                                     q["warning_threshold"], q["format"], q.get("day_range"))
+            for q in queries]
+
+
+def make_pool(workers=None, icon_pack=None):
+    return ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(icon_pack,))
+
+
+async def render_location(pool, weather_data, profiles, day_ranges=None):
+    """[(query, frame body)] for every orientation and battery bucket of each profile
+
+    One pool task per orientation and profile, so a location's payload is
+    pickled a handful of times rather than once per frame. day_ranges maps
+    a timezone to today's (low, high) from temperature_history.
+    """
+    loop = asyncio.get_running_loop()
+    batches = []
+    for profile in profiles:
+        voltages = battery_buckets(profile[1])
+        day_range = (day_ranges or {}).get(profile[0])
+        for orientation in ORIENTATIONS:
+            batches.append(profile_queries(profile, orientation, voltages, day_range))
+    results = await asyncio.gather(*(
+        loop.run_in_executor(pool, render_batch, weather_data, queries) for queries in batches))
+    return [pair for queries, bodies in zip(batches, results) for pair in zip(queries, bodies)]
+
+
+async def prerender_locations(pool, locations, profiles):
+    """Render several locations concurrently, returning {location: (frames, seconds)}"""
+    async def timed(location, weather_data):
+        started = time.perf_counter()
+        frames = await render_location(pool, weather_data, profiles)
+        return location, (frames, time.perf_counter() - started)
+
+    return dict(await asyncio.gather(*(timed(location, data) for location, data in locations.items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-render all frames for a batch of locations")
+    parser.add_argument("forecast", help="saved locationforecast/2.0/compact JSON used for every location")
+    parser.add_argument("--locations", nargs="+", default=["52.52,13.41"], help="lat,lon pairs")
+    parser.add_argument("--timezone", type=int, default=0)
+    parser.add_argument("--warning-threshold", type=float, default=3.4)
+    parser.add_argument("--format", default="rle")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--icon-pack", help="packed icon cache file")
+    args = parser.parse_args()
+
+    with open(args.forecast) as forecast_file:
+        weather_data = json.load(forecast_file)
+    locations = {tuple(map(float, pair.split(","))): weather_data for pair in args.locations}
+    profiles = [(args.timezone, args.warning_threshold, args.format)]
+
+    with make_pool(args.workers, args.icon_pack) as pool:
+        # Start every worker before timing, so pool startup isn't counted
+        list(pool.map(abs, range(args.workers)))
+        started = time.perf_counter()
+        results = asyncio.run(prerender_locations(pool, locations, profiles))
+        elapsed = time.perf_counter() - started
+
+    total = sum(len(frames) for frames, _ in results.values())
+    for location, (frames, seconds) in results.items():
+        print(f"{location}: {len(frames)} frames in {seconds:.2f}s")
+    print(f"{total} frames in {elapsed:.2f}s on {args.workers} workers, {total / elapsed:.0f} frames/s")
+
+
+if __name__ == "__main__":
+    main()
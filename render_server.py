@@ -0,0 +1,405 @@
+"""
+Long-running render service for the MagTag.
+
+Answers the same query magtag/code.py sends to php/index.php
+(lat, lon, battery, timezone, orientation, warning_threshold, plus format=rle
+for frame_codec's run-length frames) with a frame rendered by dev_weather,
+and keeps finished frames in an in-memory LRU so wakes that would produce
+an identical image skip the fetch and the render. Every response carries
+X-Next-Wake, the seconds wake_schedule recommends the device sleeps.
+Devices also report the previous wake's phase timings (device=, telemetry=),
+which /stats summarizes per device.
+
+With --lan-key-file the server only answers queries signed with that key
+(magtag/frame_auth.py), each with a nonce it hasn't seen before, and signs
+every frame over the query's signature, so devices on the local network can
+use plain HTTP instead of paying for a TLS handshake.
+
+With --fleet-file, devices that send device= are kept in a registry with
+their last query and the sleep they were told to take (fleet.py), and their
+frames are rendered --prefetch-lead seconds before they are due, one
+forecast fetch per grid cell. /stats reports the fleet and the scheduler.
+
+With --history-dir, every new forecast's hourly temperatures are kept per
+cell (temperature_history.py) and frames show today's calendar-day low and
+high, including the hours that have already dropped out of the forecast,
+instead of the next 24 hours'.
+
+format=summary answers with magtag/weather_summary.py's packed forecast
+summary instead of a frame, for devices that render locally; it costs no
+render and is never pre-rendered.
+
+With --prerender N, every new forecast for a cell is rendered ahead of time
+by N worker processes (prerender.py) for all orientations and battery
+buckets of the (timezone, warning threshold, format) combinations devices
+in that cell have asked for. The frame cache grows by those ~340 frames per
+combination and cell on its own; --cache-size is the room for frames
+rendered on demand.
+
+    python render_server.py --port 8080
+    curl 'http://localhost:8080/?lat=52.52&lon=13.41&battery=3.8&timezone=+2&orientation=landscape_left'
+    curl 'http://localhost:8080/stats'
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from email.utils import formatdate
+from urllib.parse import urlsplit, parse_qs
+
+from forecast_cache import ForecastCache, MET_NO_URL, round_location
+from magtag import frame_auth
+import dev_weather
+import fleet
+import frame_codec
+import forecast_model
+import prerender
+import temperature_history
+import wake_schedule
+from telemetry import TelemetryAggregator, parse_telemetry
+
+class FrameCache:
+    """LRU of finished frames with hit/miss statistics"""
+
+    def __init__(self, max_entries=512):
+        self.base_entries = max_entries
+        self.max_entries = max_entries
+        self.frames = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.hit_ns = 0
+        self.miss_ns = 0
+
+    def get(self, key):
+        frame = self.frames.get(key)
+        if frame is None:
+            self.misses += 1
+            return None
+        self.frames.move_to_end(key)
+        self.hits += 1
+        return frame
+
+    def put(self, key, frame):
+        self.frames[key] = frame
+        self.frames.move_to_end(key)
+        while len(self.frames) > self.max_entries:
+            self.frames.popitem(last=False)
+
+    def reserve(self, entries):
+        """Make room for entries (pre-rendered) frames on top of the configured size"""
+        self.max_entries = max(self.max_entries, self.base_entries + entries)
+
+    def record(self, hit, elapsed_ns):
+        """Account the time it took to serve a request"""
+        if hit:
+            self.hit_ns += elapsed_ns
+        else:
+            self.miss_ns += elapsed_ns
+
+    def stats(self):
+        requests_seen = self.hits + self.misses
+        return {
+            "entries": len(self.frames),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / requests_seen, 4) if requests_seen else 0.0,
+            "mean_hit_us": round(self.hit_ns / self.hits / 1000, 1) if self.hits else None,
+            "mean_miss_ms": round(self.miss_ns / self.misses / 1e6, 1) if self.misses else None,
+        }
+
+
+class Frame:
+    """An encoded frame and the ETag devices send back in If-None-Match"""
+    __slots__ = ("body", "etag")
+
+    def __init__(self, body):
+        self.body = body
+        self.etag = frame_codec.frame_etag(body)
+
+
+def parse_query(query):
+    """Parse the query string magtag/code.py sends, with php/index.php's defaults"""
+    params = {key: values[-1] for key, values in parse_qs(query).items()}
+    return {
+        "lat": float(params.get("lat", 52.5)),
+        "lon": float(params.get("lon", 13.45)),
+        "battery": float(params.get("battery", 3.8)),
+        "timezone": int(params.get("timezone", 0)),
+        "orientation": params.get("orientation", "landscape_left"),
+        "warning_threshold": float(params.get("warning_threshold", 3.40)),
+        "format": parse_format(params.get("format", "bmp")),
+        "device": params.get("device"),
+        # Reported for monitoring only, a garbled record must not cost the device its frame
+        "telemetry": parse_telemetry(params.get("telemetry")),
+    }
+
+
+SUMMARY_FORMAT = "summary"
+NONCE_MEMORY = 100000  # signed queries remembered to refuse replays, ~10 MB
+
+
+def parse_format(frame_format):
+    if frame_format not in frame_codec.ENCODERS and frame_format != SUMMARY_FORMAT:
+        raise ValueError(f"unknown format {frame_format!r}")
+    return frame_format
+
+
+def frame_key(cell, updated_at, query):
+    """Everything that can change a rendered frame"""
+    battery_bucket = dev_weather.battery_bucket(query["battery"], query["warning_threshold"])
+    local_date = (datetime.now(timezone.utc) + timedelta(hours=query["timezone"])).date().isoformat()
+    return (cell, updated_at, battery_bucket, query["orientation"], query["timezone"], local_date,
+            query["format"], query.get("day_range"))
+
+
+class RenderServer:
+    def __init__(self, cache, forecasts, telemetry=None, lan_key=None, pool=None, fleet=None,
+                 history=None):
+        self.cache = cache
+        self.forecasts = forecasts
+        self.telemetry = telemetry or TelemetryAggregator()
+        self.fleet = fleet
+        self.scheduler = None
+        self.prefetch_task = None  # the event loop only holds weak references to tasks
+        self.lan_key = lan_key
+        self.nonces = OrderedDict()  # nonces of signed queries answered, oldest first
+        self.pool = pool
+        self.history = history
+        self.recording = {}  # cell -> the history write of its latest forecast, on the executor
+        self.day_ranges = {}  # (cell, timezone) -> ((local date, recording), (low, high) or None)
+        self.profiles = {}  # cell -> {(timezone, warning_threshold, format)} seen in requests
+        self.prerendering = set()
+        self.prerendered = 0
+        # Recorded first, so a pre-render of the same forecast sees its hours
+        if history is not None:
+            forecasts.listeners.append(self.record_history)
+        if pool is not None:
+            forecasts.listeners.append(self.on_forecast)
+
+    def fresh_nonce(self, query):
+        """True the first time a signed query's nonce comes in, so a recorded query can't be replayed"""
+        nonce = parse_qs(query).get("nonce", [None])[-1]
+        if not nonce or nonce in self.nonces:
+            return False
+        self.nonces[nonce] = True
+        if len(self.nonces) > NONCE_MEMORY:
+            self.nonces.popitem(last=False)
+        return True
+
+    def record_history(self, cell, weather_data):
+        # flock, mmap and pruning are blocking file I/O, kept off the event loop. The
+        # store only changes here, so a cell's cached ranges are valid until the next one.
+        self.recording[cell] = asyncio.get_running_loop().run_in_executor(
+            None, self._record_history, cell, weather_data)
+
+    def _record_history(self, cell, weather_data):
+        model = forecast_model.model_for(weather_data)
+        self.history.record(cell, model.times, model.temperature)
+
+    async def day_range(self, cell, timezone_offset):
+        """Today's (low, high) from the history store, None without one or too few hours"""
+        if self.history is None:
+            return None
+        recording = self.recording.get(cell)
+        if recording is not None:
+            try:
+                await recording  # the range must include the forecast being written
+            except OSError as e:
+                print(f"Could not record history for {cell}: {e}")
+        version = ((datetime.now(timezone.utc) + timedelta(hours=timezone_offset)).date(), recording)
+        cached = self.day_ranges.get((cell, timezone_offset))
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        day_range = await asyncio.get_running_loop().run_in_executor(
+            None, self.history.day_range, cell, timezone_offset)
+        self.day_ranges[(cell, timezone_offset)] = (version, day_range)
+        return day_range
+
+    def on_forecast(self, cell, weather_data):
+        task = asyncio.get_running_loop().create_task(self.prerender_cell(cell, weather_data))
+        self.prerendering.add(task)
+        task.add_done_callback(self.prerendering.discard)
+
+    async def prerender_cell(self, cell, weather_data):
+        """Render every frame devices in a cell can ask for into the frame cache"""
+        profiles = self.profiles.get(cell)
+        if not profiles:
+            # No device has asked this cell for a frame yet, summary devices render their own
+            return
+        # Every cell's pre-renders have to fit, or they evict each other
+        self.cache.reserve(sum(prerender.frames_per_profile(profile)
+                               for cell_profiles in self.profiles.values() for profile in cell_profiles))
+        day_ranges = {profile[0]: await self.day_range(cell, profile[0]) for profile in profiles}
+        started = time.perf_counter()
+        frames = await prerender.render_location(self.pool, weather_data, profiles, day_ranges)
+        updated_at = weather_data["properties"]["meta"]["updated_at"]
+        for query, body in frames:
+            self.cache.put(frame_key(cell, updated_at, query), Frame(body))
+        self.prerendered += len(frames)
+        print(f"Pre-rendered {len(frames)} frames for {cell} in {time.perf_counter() - started:.2f}s")
+
+    async def render(self, query):
+        """Return (Frame, cache hit, next wake in seconds) for a device query
+
+        The Frame is None for a summary query while no forecast is available.
+        """
+        cell = round_location(query["lat"], query["lon"])
+        summary = query["format"] == SUMMARY_FORMAT
+        if not summary:
+            # Recorded before the fetch so a pre-render it triggers includes this device
+            self.profiles.setdefault(cell, set()).add(
+                (query["timezone"], query["warning_threshold"], query["format"]))
+        weather_data = await self.forecasts.get(*cell)
+        next_wake = wake_schedule.next_wake(weather_data, query["timezone"], query["battery"],
+                                            self.forecasts.expires(*cell))
+        query = dict(query, day_range=await self.day_range(cell, query["timezone"]))
+        if summary:
+            # A few struct.pack calls, not worth the cache or the executor
+            body = dev_weather.encode_summary(weather_data, query["battery"], query["timezone"],
+                                              query["warning_threshold"], query["day_range"])
+            return (Frame(body) if body else None), False, next_wake
+        if weather_data is None:
+            body = await asyncio.get_running_loop().run_in_executor(
+                None, dev_weather.render_frame, None, query["battery"], query["timezone"],
+                query["orientation"], query["warning_threshold"], query["format"])
+            return Frame(body), False, next_wake
+
+        key = frame_key(cell, weather_data["properties"]["meta"]["updated_at"], query)
+        frame = self.cache.get(key)
+        if frame is not None:
+            return frame, True, next_wake
+
+        body = await asyncio.get_running_loop().run_in_executor(
+            None, dev_weather.render_frame, weather_data, query["battery"], query["timezone"],
+            query["orientation"], query["warning_threshold"], query["format"], query["day_range"])
+        frame = Frame(body)
+        self.cache.put(key, frame)
+        return frame, False, next_wake
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            headers = {}
+            while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            started = time.perf_counter_ns()
+            method, target, _ = request_line.decode("latin-1").split(" ", 2)
+            url = urlsplit(target)
+
+            if method != "GET":
+                await respond(writer, 405, b"Method not allowed\n", "text/plain")
+            elif url.path == "/stats":
+                stats = {
+                    "frames": self.cache.stats(),
+                    "forecasts": self.forecasts.stats(),
+                    "icons": dev_weather.ICONS.stats(),
+                    "text": dev_weather.TEXT.stats(),
+                    "devices": self.telemetry.stats(),
+                    "prerendered": self.prerendered,
+                }
+                if self.fleet is not None:
+                    stats["fleet"] = self.fleet.stats()
+                if self.scheduler is not None:
+                    stats["prefetch"] = self.scheduler.stats()
+                body = json.dumps(stats, indent=2).encode() + b"\n"
+                await respond(writer, 200, body, "application/json")
+            elif self.lan_key and (verified := frame_auth.verify_query(self.lan_key, url.query)) is None:
+                await respond(writer, 403, b"Bad signature\n", "text/plain")
+            elif self.lan_key and not self.fresh_nonce(verified):
+                await respond(writer, 403, b"Replayed query\n", "text/plain")
+            else:
+                query = parse_query(url.query)
+                if query["device"] and query["telemetry"]:
+                    self.telemetry.add(query["device"], query["telemetry"])
+                frame, hit, next_wake = await self.render(query)
+                if query["format"] != SUMMARY_FORMAT:
+                    self.cache.record(hit, time.perf_counter_ns() - started)
+                if self.fleet is not None and query["device"]:
+                    self.fleet.seen(query["device"], query, next_wake)
+                if frame is None:
+                    await respond(writer, 503, b"Forecast unavailable\n", "text/plain",
+                                  {"X-Next-Wake": next_wake})
+                    return
+                extra_headers = {"ETag": frame.etag, "X-Next-Wake": next_wake}
+                # The device already shows this frame and skips the e-ink refresh
+                not_modified = headers.get("if-none-match") == frame.etag
+                body = b"" if not_modified else frame.body
+                if self.lan_key:
+                    signer = frame_auth.response_signer(self.lan_key, url.query, frame.etag, next_wake)
+                    signer.update(body)
+                    extra_headers["X-Frame-Signature"] = signer.hexdigest()
+                if not_modified:
+                    await respond(writer, 304, body, None, extra_headers)
+                else:
+                    content_type = frame_codec.CONTENT_TYPES.get(query["format"], "application/octet-stream")
+                    await respond(writer, 200, body, content_type, extra_headers)
+        except (ValueError, UnicodeDecodeError) as e:
+            await respond(writer, 400, f"Bad request: {e}\n".encode(), "text/plain")
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def respond(writer, status, body, content_type, extra_headers=None):
+    reason = {200: "OK", 304: "Not Modified", 400: "Bad Request", 403: "Forbidden",
+              405: "Method Not Allowed", 503: "Service Unavailable"}.get(status, "")
+    # The device shows the Date as "stale since" when it can't reach us later
+    head = [f"HTTP/1.1 {status} {reason}", f"Date: {formatdate(usegmt=True)}"]
+    if content_type:
+        head.append(f"Content-Type: {content_type}")
+    head.extend(f"{name}: {value}" for name, value in (extra_headers or {}).items())
+    head.append(f"Content-Length: {len(body)}")
+    head.append("Connection: close")
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+    await writer.drain()
+
+
+async def serve(host, port, max_entries, met_url=MET_NO_URL, icon_pack=None, lan_key=None,
+                prerender_workers=0, fleet_file=None, prefetch_lead=300, history_dir=None):
+    # Decode every icon before the first request so renders never touch the disk
+    print(f"Warmed {dev_weather.ICONS.warm(icon_pack)} icons")
+    pool = prerender.make_pool(prerender_workers, icon_pack) if prerender_workers else None
+    registry = fleet.FleetRegistry(fleet_file) if fleet_file else None
+    history = temperature_history.HistoryStore(history_dir) if history_dir else None
+    render_server = RenderServer(FrameCache(max_entries), ForecastCache(met_url), lan_key=lan_key, pool=pool,
+                                 fleet=registry, history=history)
+    if registry is not None and prefetch_lead > 0:
+        print(f"Prefetching for {len(registry.devices)} known devices, {prefetch_lead}s ahead")
+        render_server.scheduler = fleet.PrefetchScheduler(render_server, registry, prefetch_lead)
+        render_server.prefetch_task = asyncio.create_task(render_server.scheduler.run())
+    server = await asyncio.start_server(render_server.handle, host, port)
+    print(f"Render server listening on http://{host}:{port}/")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--cache-size", type=int, default=512, help="frames kept in memory")
+    parser.add_argument("--met-url", default=MET_NO_URL, help="locationforecast endpoint, e.g. met_stand_in.py")
+    parser.add_argument("--icon-pack", help="packed icon cache file, written on first start")
+    parser.add_argument("--lan-key-file", help="file with the key devices have as secrets['lan_key']")
+    parser.add_argument("--prerender", type=int, default=0, metavar="WORKERS",
+                        help="pre-render new forecasts with this many processes")
+    parser.add_argument("--fleet-file", help="device registry, enables prefetching before devices wake")
+    parser.add_argument("--prefetch-lead", type=int, default=300, metavar="SECONDS",
+                        help="how long before a device is due its frame is prepared, 0 disables")
+    parser.add_argument("--history-dir", help="keep hourly temperatures here and show today's low/high")
+    args = parser.parse_args()
+    lan_key = None
+    if args.lan_key_file:
+        with open(args.lan_key_file) as key_file:
+            lan_key = key_file.read().strip()
+    asyncio.run(serve(args.host, args.port, args.cache_size, args.met_url, args.icon_pack, lan_key,
+                      args.prerender, args.fleet_file, args.prefetch_lead, args.history_dir))
+
+
+if __name__ == "__main__":
+    main()
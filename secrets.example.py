@@ -4,5 +4,13 @@ secrets = {
     "latitude": 52.5200,
     "longitude": 13.4050,
     "timezone_offset": 1,
-    "use_fahrenheit": False
+    "use_fahrenheit": False,
+    # Optional: name this board in render_server.py's /stats and fleet registry (default: its MAC address)
+    # "device_id": "kitchen",
+    # Optional: render_server.py on the local network instead of the PHP endpoint
+    # "lan_endpoint": "http://192.168.1.10:8080/",
+    # "lan_key": "<same as the server's --lan-key-file>",
+    # Optional: "rle" (default), "bmp", or "summary" to download a ~100 byte
+    # forecast summary from render_server.py and draw the frame on the device
+    # "frame_format": "summary",
 }
\ No newline at end of file
@@ -0,0 +1,72 @@
+"""
+Per-device wake telemetry sent by magtag/code.py.
+
+Each wake uploads the previous wake's record as telemetry=<ms...>,<kb...>:
+the duration of every phase in milliseconds, then gc.mem_free() in KB at
+the end of that phase (see Telemetry in magtag/code.py for what each phase
+covers). The aggregator keeps the last `window` records per device, for at
+most `max_devices` devices: device= is whatever the query says, so the ones
+heard from least recently are dropped.
+
+    aggregator = TelemetryAggregator()
+    aggregator.add("f412fa4c9b10", parse_telemetry("1830,412,2210,954,312,1950,141,140,118,96,95,95"))
+    aggregator.stats()["f412fa4c9b10"]["wifi"]["ms"]["p50"]
+"""
+from collections import OrderedDict, deque
+
+import numpy as np
+
+# Same order as Telemetry.PHASES in magtag/code.py
+PHASES = ("wifi", "orientation", "setup", "request", "body", "refresh")
+PERCENTILES = (50, 90, 99)
+
+
+def parse_telemetry(value):
+    """(ms, kb) tuples for a telemetry= query value, None if it is malformed"""
+    try:
+        numbers = [int(part) for part in value.split(",")]
+    except (AttributeError, ValueError):
+        return None
+    if len(numbers) != 2 * len(PHASES):
+        return None
+    return tuple(numbers)
+
+
+class TelemetryAggregator:
+    def __init__(self, window=500, max_devices=1000):
+        self.window = window
+        self.max_devices = max_devices
+        self.devices = OrderedDict()  # least recently heard from first
+
+    def add(self, device, record):
+        series = self.devices.get(device)
+        if series is None:
+            series = self.devices[device] = deque(maxlen=self.window)
+            if len(self.devices) > self.max_devices:
+                self.devices.popitem(last=False)
+        else:
+            self.devices.move_to_end(device)
+        series.append(record)
+
+    def device_stats(self, device):
+        records = np.array(self.devices[device], dtype=np.float64)
+        ms, kb = records[:, :len(PHASES)], records[:, len(PHASES):]
+        # A phase that didn't run (e.g. refresh after a 304) is recorded as 0 ms
+        stats = {"records": len(records)}
+        for i, phase in enumerate(PHASES):
+            ran = ms[:, i] > 0
+            if not ran.any():
+                continue
+            stats[phase] = {
+                "runs": int(ran.sum()),
+                "ms": dict(zip((f"p{p}" for p in PERCENTILES),
+                               np.percentile(ms[ran, i], PERCENTILES).round(1).tolist())),
+                "min_free_kb": int(kb[ran, i].min()),
+            }
+        total = ms.sum(axis=1)
+        stats["total_ms"] = dict(zip((f"p{p}" for p in PERCENTILES),
+                                     np.percentile(total, PERCENTILES).round(1).tolist()))
+        return stats
+
+    def stats(self):
+        return {device: self.device_stats(device) for device in self.devices}
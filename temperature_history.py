@@ -0,0 +1,163 @@
+"""
+Hourly temperature history per grid cell, the Python counterpart of
+php/index.php's weather_cache.json.
+
+met.no's timeseries starts at the current hour, so the hours of today that
+have already passed drop out of every new forecast. The store keeps them:
+one file per (cell, UTC date) under root, holding 24 fixed-size records
+(temperature, when it was recorded), written in place through mmap under
+an exclusive flock on that file only. Renders for other cells never wait
+on each other, a read touches at most two small files, and files older
+than keep_days are removed as new ones are written.
+
+Hours that are still ahead take the latest forecast; once an hour has
+passed its record is frozen.
+
+    store = HistoryStore("history")
+    store.record((52.52, 13.41), model.times, model.temperature)
+    store.day_range((52.52, 13.41), timezone_offset=2)   # (low, high) or None
+
+    python temperature_history.py history 52.52 13.41 --timezone 2
+"""
+import argparse
+import fcntl
+import mmap
+import os
+import struct
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+
+from forecast_cache import round_location
+
+RECORD = struct.Struct("<fI")  # temperature in degC, epoch seconds it was recorded (0 = empty)
+HOURS = 24
+FILE_SIZE = RECORD.size * HOURS
+RECORD_AHEAD = 2 * 86400  # forecast hours further out than this are not stored
+MIN_HOURS = 4  # fewer known hours of the day than this and day_range() gives up, like the PHP
+
+
+def _utc_date(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).date()
+
+
+def _day_start(day):
+    return int(datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp())
+
+
+class HistoryStore:
+    def __init__(self, root, keep_days=3):
+        self.root = root
+        self.keep_days = keep_days
+
+    def _cell_dir(self, cell):
+        return os.path.join(self.root, f"{cell[0]:.2f}_{cell[1]:.2f}")
+
+    def _path(self, cell, day):
+        return os.path.join(self._cell_dir(cell), f"{day.isoformat()}.bin")
+
+    @contextmanager
+    def _mapped(self, path, write=False):
+        """mmap of a day file under a shared (read) or exclusive (write) lock, None if it doesn't exist"""
+        if write:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        else:
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except FileNotFoundError:
+                yield None
+                return
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if write else fcntl.LOCK_SH)
+            if os.fstat(fd).st_size < FILE_SIZE:
+                if not write:
+                    yield None
+                    return
+                os.ftruncate(fd, FILE_SIZE)
+            with mmap.mmap(fd, FILE_SIZE, access=mmap.ACCESS_WRITE if write else mmap.ACCESS_READ) as mapped:
+                yield mapped
+        finally:
+            os.close(fd)  # also releases the lock
+
+    def record(self, cell, times, temperatures, now=None):
+        """Store the hourly temperatures of a forecast, returns the number of hours written"""
+        now = time.time() if now is None else now
+        current_hour = int(now) // 3600 * 3600
+        by_day = {}
+        for epoch, temperature in zip(times, temperatures):
+            epoch = int(epoch)
+            if epoch % 3600 or not current_hour <= epoch < now + RECORD_AHEAD:
+                continue
+            by_day.setdefault(_utc_date(epoch), []).append((epoch, float(temperature)))
+
+        written = 0
+        for day, hours in by_day.items():
+            with self._mapped(self._path(cell, day), write=True) as mapped:
+                start = _day_start(day)
+                for epoch, temperature in hours:
+                    # Hours from now on are still forecasts and take the latest one
+                    RECORD.pack_into(mapped, (epoch - start) // 3600 * RECORD.size, temperature, int(now))
+                    written += 1
+        if by_day:
+            self.prune(cell, now)
+        return written
+
+    def hours(self, cell, start, end):
+        """[(epoch, temperature)] of the recorded hours with start <= epoch < end"""
+        result = []
+        day = _utc_date(start)
+        while _day_start(day) < end:
+            with self._mapped(self._path(cell, day)) as mapped:
+                if mapped is not None:
+                    day_start = _day_start(day)
+                    for hour, (temperature, recorded) in enumerate(RECORD.iter_unpack(mapped)):
+                        epoch = day_start + hour * 3600
+                        if recorded and start <= epoch < end:
+                            result.append((epoch, round(temperature, 1)))  # stored as float32
+            day += timedelta(days=1)
+        return result
+
+    def day_range(self, cell, timezone_offset=0, now=None):
+        """(low, high) over today's local calendar day, None with fewer than MIN_HOURS known"""
+        now = time.time() if now is None else now
+        offset = timezone_offset * 3600
+        start = (int(now) + offset) // 86400 * 86400 - offset
+        temperatures = [temperature for _, temperature in self.hours(cell, start, start + 86400)]
+        if len(temperatures) < MIN_HOURS:
+            return None
+        return min(temperatures), max(temperatures)
+
+    def prune(self, cell, now=None):
+        """Remove a cell's day files older than keep_days"""
+        oldest = _utc_date(time.time() if now is None else now) - timedelta(days=self.keep_days)
+        cell_dir = self._cell_dir(cell)
+        for name in os.listdir(cell_dir):
+            try:
+                day = date.fromisoformat(name[:-len(".bin")])
+            except ValueError:
+                continue
+            if day < oldest:
+                os.remove(os.path.join(cell_dir, name))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show a cell's recorded temperatures for today")
+    parser.add_argument("root", help="history directory, render_server.py's --history-dir")
+    parser.add_argument("lat", type=float)
+    parser.add_argument("lon", type=float)
+    parser.add_argument("--timezone", type=int, default=0)
+    args = parser.parse_args()
+
+    store = HistoryStore(args.root)
+    cell = round_location(args.lat, args.lon)
+    offset = args.timezone * 3600
+    start = (int(time.time()) + offset) // 86400 * 86400 - offset
+    for epoch, temperature in store.hours(cell, start, start + 86400):
+        local = datetime.fromtimestamp(epoch + offset, timezone.utc)
+        print(f"{local:%Y-%m-%d %H:%M}  {temperature:5.1f}")
+    print(f"Day range: {store.day_range(cell, args.timezone)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Memoized text rasterization for the Pillow renderer.
+
+Labels like '12.3º', weekday names, 'updated: 07:12' and voltages repeat
+from frame to frame. TextCache rasterizes each (text, font, size, style)
+once into a 4-shade coverage mask and remembers its bounding box, so
+repeated strings are measured and blitted without going through FreeType.
+render_server.py renders on executor threads, so the LRU is kept under a
+lock; rasterizing happens outside it.
+
+    cache = TextCache()
+    left, top, right, bottom = cache.bbox("Mon", FONT)
+    cache.draw(image, (10, 20), "Mon", (0, 0, 0), FONT)
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+
+class TextSprite:
+    __slots__ = ("mask", "bbox")
+
+    def __init__(self, mask, bbox):
+        self.mask = mask  # 'L' coverage, quantized to 0/85/170/255
+        self.bbox = bbox  # same as ImageDraw.textbbox((0, 0), text, font)
+
+
+def font_key(font):
+    """(file, size, style) identifying a Pillow font, the font object itself otherwise"""
+    path = getattr(font, "path", None)
+    if path is None:
+        return id(font)
+    style = font.getname()[1] if hasattr(font, "getname") else None
+    return (path, getattr(font, "size", None), style)
+
+
+def rasterize(text, font):
+    """Render one line of text to a TextSprite"""
+    left, top, right, bottom = font.getbbox(text)
+    mask = Image.new("L", (max(1, right - left), max(1, bottom - top)), 0)
+    ImageDraw.Draw(mask).text((-left, -top), text, fill=255, font=font)
+    coverage = np.asarray(mask, dtype=np.uint16)
+    mask = Image.fromarray(((coverage + 42) // 85 * 85).astype(np.uint8))
+    return TextSprite(mask, (left, top, right, bottom))
+
+
+class TextCache:
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.sprites = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def sprite(self, text, font):
+        key = (text, font_key(font))
+        with self.lock:
+            sprite = self.sprites.get(key)
+            if sprite is not None:
+                self.sprites.move_to_end(key)
+                self.hits += 1
+                return sprite
+            self.misses += 1
+        sprite = rasterize(text, font)
+        with self.lock:
+            self.sprites[key] = sprite
+            if len(self.sprites) > self.max_entries:
+                self.sprites.popitem(last=False)
+                self.evictions += 1
+        return sprite
+
+    def bbox(self, text, font):
+        """Bounding box of text drawn at (0, 0), like ImageDraw.textbbox"""
+        return self.sprite(text, font).bbox
+
+    def draw(self, image, xy, text, fill, font):
+        """Draw one line of text at xy, like ImageDraw.text"""
+        sprite = self.sprite(text, font)
+        left, top, right, bottom = sprite.bbox
+        x, y = int(xy[0]) + left, int(xy[1]) + top
+        image.paste(fill, (x, y, x + sprite.mask.width, y + sprite.mask.height), sprite.mask)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.sprites),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,83 @@
+"""
+Recommended next wake for a MagTag, sent back with each frame.
+
+Instead of a flat 3 hours the device sleeps until the next moment its
+display would change: local midnight (the date rolls over), shortly before
+precipitation starts, the hour of today's remaining high or low, or when
+met.no will have a newer forecast (Expires). Low batteries stretch the
+quiet-day interval. The result is clamped, and the device clamps it again.
+
+    seconds = next_wake(weather_data, timezone_offset=2, battery=3.7, expires=entry.expires)
+"""
+import time
+from datetime import datetime, timedelta, timezone
+
+import forecast_model
+
+DEFAULT_SLEEP = 3 * 60 * 60
+MIN_SLEEP = 15 * 60
+MAX_SLEEP = 8 * 60 * 60
+PRECIPITATION_LEAD = 30 * 60  # wake this long before rain starts
+EVENT_SLACK = 60              # land just after clock events, not just before
+
+# (voltage at or below, quiet-day interval multiplier)
+BATTERY_STRETCH = ((3.4, 2.5), (3.6, 1.5))
+
+
+def quiet_interval(battery):
+    """Sleep used when nothing in the forecast needs an earlier wake"""
+    for voltage, stretch in BATTERY_STRETCH:
+        if battery <= voltage:
+            return DEFAULT_SLEEP * stretch
+    return DEFAULT_SLEEP
+
+
+def local_midnight(now, timezone_offset=0):
+    """Epoch seconds of the next local midnight"""
+    tz = timezone(timedelta(hours=timezone_offset))
+    tomorrow = datetime.fromtimestamp(now, tz).date() + timedelta(days=1)
+    return datetime(tomorrow.year, tomorrow.month, tomorrow.day, tzinfo=tz).timestamp()
+
+
+def precipitation_onset(model, now):
+    """Start of the next hour with precipitation after a dry hour, None if none is forecast"""
+    # Windows starting at or before now are rain that is already falling
+    for start, _, _ in model.precipitation_windows(start=now - 3600 + 1):
+        if start > now:
+            return start
+    return None
+
+
+def temperature_extremes(model, now, midnight):
+    """Epoch seconds of the remaining hours with today's high and low"""
+    extremes = model.extremes(now + 1, midnight)
+    if extremes is None:
+        return []
+    _, high_at, _, low_at = extremes
+    return [high_at, low_at]
+
+
+def next_wake(weather_data, timezone_offset=0, battery=3.8, expires=None, now=None):
+    """Seconds the device should sleep before its next wake"""
+    now = time.time() if now is None else now
+    midnight = local_midnight(now, timezone_offset)
+    events = [midnight + EVENT_SLACK]
+
+    # A wake before Expires would get the same forecast back
+    interval = quiet_interval(battery)
+    if expires is not None:
+        interval = max(interval, expires - now + EVENT_SLACK)
+    events.append(now + interval)
+
+    if weather_data is not None:
+        model = forecast_model.model_for(weather_data)
+        onset = precipitation_onset(model, now)
+        if onset is not None:
+            # Rain closer than the lead still gets the earliest wake allowed
+            events.append(max(onset - PRECIPITATION_LEAD, now))
+        if battery > BATTERY_STRETCH[-1][0]:
+            events.extend(hour + EVENT_SLACK for hour in temperature_extremes(model, now, midnight))
+
+    # Every event is still ahead; one closer than MIN_SLEEP is woken for as early as allowed
+    upcoming = [max(event - now, MIN_SLEEP) for event in events]
+    return int(min(min(upcoming), MAX_SLEEP))
@@ -1,10 +1,11 @@
+import asyncio
 import json
 
-import requests
+from forecast_cache import ForecastCache
 
-params = {"lat": 52.5200, "lon": 13.4050}
-headers = {"User-Agent": "Magtag 0.1.2/ (jesse@krets.com)"}
-response = requests.get("https://api.met.no/weatherapi/locationforecast/2.0/compact", params=params, headers=headers)
-data = response.json()
-# print(response.text)
+# Kept between runs so repeated probes are served until met.no's Expires
+# and revalidated with If-Modified-Since afterwards
+cache = ForecastCache(store_path="forecast_cache.json")
+data = asyncio.run(cache.get(52.5200, 13.4050))
 print(json.dumps(data, indent=4))
+print(cache.stats())